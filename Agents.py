@@ -1,15 +1,48 @@
 import os
 import json
 import re
+import hashlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 
-from crewai import Agent, Task, Crew, LLM, Process
+from crewai import Agent, Task, Crew, Process
 from crewai.knowledge.source.pdf_knowledge_source import PDFKnowledgeSource
 from crewai.knowledge.source.string_knowledge_source import StringKnowledgeSource
-from crewai.knowledge.source.text_file_knowledge_source import TextFileKnowledgeSource
 from pydantic import BaseModel, Field
 
+from agent_docs import AgentDocsIndex
+from agent_pool import AgentPool
+from agent_router import AgentRouter
+from catalog_digest import ROUTING_CATALOG_TOKEN_BUDGET, CatalogDigest
+from deadlines import (
+    DeadlineExceeded,
+    PipelineCancelled,
+    check_deadline,
+    current_deadline,
+    current_stage,
+    deadline_stage,
+    use_deadline,
+)
+from flow_layout import (
+    SIEMENS_PRODUCT_MAP,
+    build_flow_graph,
+    detect_products,
+    parse_react_flow,
+    rule_edges,
+    rules_cover,
+)
+from knowledge_store import KnowledgeIndex
+from llm_json import JSONRepairConverter, JSONStreamParser, extract_json, strip_code_fences
+from llm_pool import LLMPool
+from llm_streaming import stream_tokens_to
+from local_formatter import contribution_products, format_answer
+from metrics import current_trace, record_span, record_tokens, span, use_trace
+from model_tiers import ModelTiers, TieredLLM, parse_model_chain, parse_stage_setting
+from routing_batcher import RoutingBatcher
+from utils import count_tokens
 
 # 🔴 Ensure CrewAI Telemetry is Fully Disabled
 os.environ["CREWAI_DISABLE_TELEMETRY"] = "true"
@@ -19,13 +52,92 @@ os.environ["OPENAI_MODEL_NAME"] = "gpt-4"
 os.environ["MISTRAL_API_KEY"] = "jIlcvnUbWBpWTT7f8jDOffD4ikTq19nR"
 output_dir = "./ai-agent-output"
 
-# Initialize the LLM using CrewAI's LLM interface with a Mistral model.
-llm = LLM(
-    model="ollama/llama3.2",
-    # model="mistral/pixtral-large-latest",
-    # base_url="http://localhost:11434",
-    temperature=0
+# Agent routing: "llm" asks the orchestrator crew, "local" only uses the TF-IDF router,
+# "hybrid" uses the router and falls back to the LLM (on the top candidates) when scores are ambiguous.
+# Each message can override the mode with a "routing_mode" key.
+ROUTING_MODES = ("llm", "local", "hybrid")
+ROUTING_MODE = os.environ.get("ROUTING_MODE", "llm")
+LOCAL_ROUTING_MIN_SCORE = float(os.environ.get("LOCAL_ROUTING_MIN_SCORE", "0.05"))
+LOCAL_ROUTING_CONFIDENT_SCORE = float(os.environ.get("LOCAL_ROUTING_CONFIDENT_SCORE", "0.2"))
+LOCAL_ROUTING_RELATIVE_CUTOFF = float(os.environ.get("LOCAL_ROUTING_RELATIVE_CUTOFF", "0.5"))
+LOCAL_ROUTING_MARGIN = float(os.environ.get("LOCAL_ROUTING_MARGIN", "0.02"))
+LOCAL_ROUTING_MAX_AGENTS = int(os.environ.get("LOCAL_ROUTING_MAX_AGENTS", "8"))
+
+# Specialist execution: "sequential" chains the specialists in one crew (each one sees the previous outputs),
+# "parallel" runs them concurrently, at most AGENT_CONCURRENCY at a time, and merges their outputs in the formatter.
+# Each message can override them with "execution_mode" and "agent_concurrency" keys.
+EXECUTION_MODES = ("sequential", "parallel")
+EXECUTION_MODE = os.environ.get("EXECUTION_MODE", "sequential")
+AGENT_CONCURRENCY = int(os.environ.get("AGENT_CONCURRENCY", "4"))
+
+# Workflow graph: the layout is always computed locally; "rules" takes the dependencies from RULE_DEPENDENCIES,
+# "edges" asks the LLM for the dependencies only, "auto" asks it only when the rules leave a product unconnected,
+# "llm" has the LLM draw the whole graph (then validated and laid out again). Messages can set "flow_mode".
+FLOW_MODES = ("auto", "rules", "edges", "llm")
+FLOW_MODE = os.environ.get("FLOW_MODE", "auto")
+
+# Output: "separate" formats the answer, then run_flow_agent builds the graph in a second pass; "combined" has the
+# formatter return the answer and the workflow (FormattedAnswer) at once. Messages can set "output_mode".
+OUTPUT_MODES = ("separate", "combined")
+OUTPUT_MODE = os.environ.get("OUTPUT_MODE", "separate")
+
+# Formatting: "local" assembles the answer from the specialist outputs without an LLM call (local_formatter),
+# "llm" has the Message Formatter agent write it; the LLM also formats when the local formatter has nothing to use.
+# Messages can set "formatter_mode".
+FORMATTER_MODES = ("local", "llm")
+FORMATTER_MODE = os.environ.get("FORMATTER_MODE", "local")
+
+# LLM routing calls arriving within ROUTING_BATCH_WINDOW_MS of each other (at most ROUTING_BATCH_MAX) for the same
+# candidate agents share one orchestrator prompt; a window of 0 routes every message on its own.
+ROUTING_BATCH_WINDOW_MS = float(os.environ.get("ROUTING_BATCH_WINDOW_MS", "5"))
+ROUTING_BATCH_MAX = int(os.environ.get("ROUTING_BATCH_MAX", "8"))
+
+# Forward specialist tokens to the on_event callback as they are generated (when the backend can stream).
+STREAM_TOKENS = os.environ.get("STREAM_TOKENS", "true").lower() == "true"
+
+# Seconds a single LLM request may take, so a hung backend cannot pin a pipeline thread; within a pipeline deadline
+# (see deadlines.py) the time left for the current stage applies when it is shorter.
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "120"))
+
+# Models: every stage uses LLM_MODEL unless STAGE_MODELS gives it a chain of models, preferred first, e.g.
+# "routing=ollama/llama3.2:1b;specialist=ollama/llama3.1:8b,ollama/llama3.2;formatter=ollama/llama3.2:1b".
+# A stage moves down its chain while a model's rolling p95 latency is over the STAGE_P95_SECONDS of the stage or
+# its error rate over MODEL_MAX_ERROR_RATE, and retries it after MODEL_COOLDOWN_SECONDS (see model_tiers.py);
+# GET /metrics/models shows the current state. LLM clients are pooled per model (llm_pool.py).
+LLM_MODEL = os.environ.get("LLM_MODEL", "ollama/llama3.2")
+LLM_STAGES = ("routing", "specialist", "formatter", "flow")
+STAGE_MODELS = parse_stage_setting(os.environ.get("STAGE_MODELS"), parse_model_chain)
+STAGE_P95_SECONDS = parse_stage_setting(
+    os.environ.get("STAGE_P95_SECONDS", "routing=10;specialist=90;formatter=30;flow=30"), float
+)
+MODEL_MAX_ERROR_RATE = float(os.environ.get("MODEL_MAX_ERROR_RATE", "0.2"))
+MODEL_HEALTH_WINDOW = int(os.environ.get("MODEL_HEALTH_WINDOW", "50"))
+MODEL_HEALTH_MIN_CALLS = int(os.environ.get("MODEL_HEALTH_MIN_CALLS", "5"))
+MODEL_COOLDOWN_SECONDS = float(os.environ.get("MODEL_COOLDOWN_SECONDS", "300"))
+LLM_POOL_CONNECTIONS = int(os.environ.get("LLM_POOL_CONNECTIONS", "32"))
+
+llm_pool = LLMPool(timeout=LLM_TIMEOUT, connections=LLM_POOL_CONNECTIONS)
+# Default LLM of every stage, through CrewAI's LLM interface (e.g. LLM_MODEL="mistral/pixtral-large-latest").
+llm = llm_pool.get(LLM_MODEL, temperature=0)
+model_tiers = ModelTiers(
+    {stage: STAGE_MODELS[stage] for stage in LLM_STAGES if STAGE_MODELS.get(stage)},
+    STAGE_P95_SECONDS,
+    max_error_rate=MODEL_MAX_ERROR_RATE,
+    window=MODEL_HEALTH_WINDOW,
+    min_calls=MODEL_HEALTH_MIN_CALLS,
+    cooldown=MODEL_COOLDOWN_SECONDS,
 )
+for unknown_stage in set(STAGE_MODELS) - set(LLM_STAGES):
+    print(f"Ignoring STAGE_MODELS entry '{unknown_stage}', expected one of {', '.join(LLM_STAGES)}")
+stage_llms = {stage: TieredLLM(stage, model_tiers, llm_pool, temperature=0) for stage in model_tiers.chains}
+
+
+def stage_llm(stage):
+    """
+    LLM the agents of a stage are built with: the shared `llm`, or a TieredLLM switching between the models of
+    the stage's STAGE_MODELS chain.
+    """
+    return stage_llms.get(stage) or llm
 
 
 def save_to_file(data, filename):
@@ -33,12 +145,42 @@ def save_to_file(data, filename):
     Save JSON data to a file with timestamp.
     """
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    os.makedirs(output_dir, exist_ok=True)
     filepath = os.path.join(output_dir, f"{filename}_{timestamp}.json")
     with open(filepath, "w") as f:
         json.dump(data, f, indent=4)
     print(f"✅ Saved output to {filepath}")
     return filepath
 
+class FlowEdge(BaseModel):
+    source: str = Field(..., title="the Siemens product whose output the target needs")
+    target: str = Field(..., title="the Siemens product that depends on the source")
+
+
+class FlowEdges(BaseModel):
+    edges: list[FlowEdge]
+
+
+class ReactFlowGraph(BaseModel):
+    nodes: list[dict]
+    edges: list[dict] = Field(default_factory=list)
+
+
+class FormattedAnswer(BaseModel):
+    message: str = Field(..., title="the formatted chat-style message for the user")
+    products: list[str] = Field(default_factory=list, title="the Siemens products used in the answer")
+    edges: list[FlowEdge] = Field(default_factory=list, title="the dependencies between those products")
+
+
+class QueryRoute(BaseModel):
+    query: int = Field(..., title="the number of the user query")
+    agent_ids: list[str] = Field(..., title="the ids of the agents that are relevant to this query")
+
+
+class BatchedRelevantAgents(BaseModel):
+    routes: list[QueryRoute]
+
+
 class RelevantAgents(BaseModel):
     agent_ids: list[str] = (
         Field(...,
@@ -49,30 +191,123 @@ class RelevantAgents(BaseModel):
 #     file_paths='HEEDS MDO.pdf',
 #     description="Documentation of HEEDS MDAO Product"
 # )
-text_file_source = TextFileKnowledgeSource(
-    file_paths='results_formatted_example.txt'
-)
+# The knowledge/ files (e.g. results_formatted_example.txt) are chunked and embedded once into a persistent
+# index; each crew only gets the KNOWLEDGE_TOP_K chunks relevant to the message instead of a knowledge source
+# that would be set up again for every Crew.
+knowledge_index = KnowledgeIndex()
+KNOWLEDGE_TOP_K = int(os.environ.get("KNOWLEDGE_TOP_K", "2"))
+
+# Each agent's `docs` field (inline text or knowledge/ file names, e.g. a product PDF) is chunked into a per-agent
+# index; its task only gets the AGENT_DOCS_TOP_K passages relevant to the message, within AGENT_DOCS_TOKEN_BUDGET.
+agent_docs_index = AgentDocsIndex()
+AGENT_DOCS_TOP_K = int(os.environ.get("AGENT_DOCS_TOP_K", "3"))
+AGENT_DOCS_TOKEN_BUDGET = int(os.environ.get("AGENT_DOCS_TOKEN_BUDGET", "400"))
+
+agent_router = AgentRouter()
+agent_pool = AgentPool()
+# The routing prompt describes the catalog with a compact digest instead of the full agent documents.
+catalog_digest = CatalogDigest()
+
+
+def build_agent(agent):
+    """
+    Convert an agent configuration dictionary into an Agent object.
+    """
+    return Agent(
+        role=agent["role"],
+        goal=agent["goals"],
+        backstory=agent["backstory"],
+        llm=stage_llm("specialist"),
+        verbose=True
+    )
 
 
 def get_agents(agents_data):
     """
     Convert a list of agent configuration dictionaries into Agent objects.
     """
+    return [build_agent(agent) for agent in agents_data]
+
+
+def agent_pool_key(agent):
+    """
+    Pool key of a catalog agent: its id plus a version derived from the fields the Agent object is built from.
+    """
+    version = hashlib.sha256(
+        json.dumps([agent["role"], agent["goals"], agent["backstory"]]).encode("utf-8")
+    ).hexdigest()[:16]
+    return "agent", str(agent["_id"]), version
+
+
+@contextmanager
+def lease_agent(key, factory):
+    """
+    Borrow a pooled Agent for the duration of one crew run.
+    """
+    agent = agent_pool.acquire(key, factory)
+    try:
+        yield agent
+    finally:
+        agent_pool.release(key, agent)
+
+
+@contextmanager
+def lease_agents(agents_data):
+    """
+    Borrow pooled Agent objects for a list of catalog agents, building only the ones that have no idle instance.
+    """
+    leased = []
+    try:
+        for agent in agents_data:
+            key = agent_pool_key(agent)
+            leased.append((key, agent_pool.acquire(key, lambda agent=agent: build_agent(agent))))
+        yield [siemens_agent for _, siemens_agent in leased]
+    finally:
+        for key, siemens_agent in leased:
+            agent_pool.release(key, siemens_agent)
+
+
+def refresh_agent_pool(agents_data):
+    """
+    Forget pooled Agents and docs indexes of catalog entries that were deleted or changed.
+    """
+    agent_pool.retain(agent_pool_key(agent) for agent in agents_data)
+    agent_docs_index.retain(agent["_id"] for agent in agents_data)
+
+
+def get_agent_docs_context(agent_data, query):
+    """
+    Passages of the agent's docs relevant to the query, ready to be appended to its task description.
+    """
+    try:
+        with span("agent_docs_search", agent=str(agent_data["_id"])):
+            passages = agent_docs_index.search(
+                agent_data, query, top_k=AGENT_DOCS_TOP_K, token_budget=AGENT_DOCS_TOKEN_BUDGET
+            )
+    except Exception as e:
+        print("Agent docs search failed:", str(e))
+        return ""
+    return "\n\n".join(f"[{passage['source']}]\n{passage['text']}" for passage in passages)
+
+
+def docs_instruction(docs_context):
+    """
+    Task description lines that ground a specialist in its product documentation.
+    """
+    if not docs_context:
+        return []
     return [
-        Agent(
-            role=agent["role"],
-            goal=agent["goals"],
-            backstory=agent["backstory"],
-            llm=llm,
-            verbose=True
-        ) for agent in agents_data
+        "base your answer on these excerpts of your product documentation when they apply:",
+        docs_context,
     ]
 
 
-def get_tasks(agents, query):
+def get_tasks(agents, query, docs_contexts=None):
     """
     Dynamically create a list of tasks for each agent.
+    docs_contexts, aligned with agents, holds the documentation passages injected into each task.
     """
+    docs_contexts = docs_contexts or [""] * len(agents)
     return [
         Task(
             # description=f"{agent.role} should respond to the user query {query} based on its expertise.",
@@ -82,6 +317,7 @@ def get_tasks(agents, query):
                     "use the siemens product assigned for this agent and try to explain if applicable how this product will be helpful in the implementation of the user query",
                     "if you are not the first agent learn from the previous agent's output and try to provide a more detailed explanation only on your expertise",
                     "highlight in what part of the query your agent's product will be used",
+                    *docs_instruction(docs_context),
                 ]),
             # expected_output=f"Detailed explanation from the perspective of {agent.role}.",
             expected_output="\n".join(
@@ -91,49 +327,123 @@ def get_tasks(agents, query):
                  ]),
             agent=agent,
             output_file=os.path.join(output_dir, "final_results.txt")
-        ) for agent in agents
+        ) for agent, docs_context in zip(agents, docs_contexts)
     ]
 
 
-def clean_json_output(raw_output: str) -> str:
+def get_parallel_task(agent, query, docs_context=""):
     """
-    Clean the raw output from the agent by removing markdown code fences and extra whitespace.
+    Create the task of a specialist that runs alongside the others, so it cannot build on their outputs.
     """
-    cleaned = raw_output.strip()
-    # Remove markdown code fences if present.
-    if cleaned.startswith("```") and cleaned.endswith("```"):
-        cleaned = cleaned[3:-3].strip()
-    return cleaned
+    return Task(
+        description="\n".join(
+            [
+                f"{agent.role} should respond to the user query {query} based on its expertise reply as short as possible.",
+                "use the siemens product assigned for this agent and try to explain if applicable how this product will be helpful in the implementation of the user query",
+                "only explain the parts of the query that fall in your expertise, other agents cover the rest",
+                "highlight in what part of the query your agent's product will be used",
+                *docs_instruction(docs_context),
+            ]),
+        expected_output="\n".join(
+            [f"Brief but complete explanation from the perspective of {agent.role} as short as possible.",
+             "highlight how your agent will be used in the implementation of the user query but make it as short as possible",
+             ]),
+        agent=agent,
+    )
 
 
-def parse_or_wrap_json(raw_result) -> dict:
+def parse_or_wrap_json(raw_result, schema=None) -> dict:
     """
-    Attempt to parse raw_result (converted to a string) as JSON.
-    If parsing fails, wrap it in a dictionary under the key 'result'.
+    Parse raw_result (converted to a string) as JSON with the tolerant extractor of llm_json; with a schema, the
+    first object of the text that matches it is used. If nothing usable is found, wrap the text under 'result'.
     """
     raw_str = str(raw_result)
-    cleaned = clean_json_output(raw_str)
-    try:
-        return json.loads(cleaned)
-    except Exception as parse_err:
-        print("Error parsing output as JSON:", str(parse_err))
-        # If parsing fails, return the cleaned string in a JSON object.
-        return {"result": cleaned}
+    cleaned = strip_code_fences(raw_str)
+    if schema is not None or cleaned.startswith("{"):
+        parsed = extract_json(raw_str, schema)
+        if parsed is not None:
+            return parsed
+        print("Error parsing output as JSON:", cleaned[:200])
+    # If parsing fails, return the cleaned string in a JSON object.
+    return {"result": cleaned}
 
 
-def get_relevant_agents_ids(agents_data, data):
+def message_token_emitter(emit, skip_tasks=0):
     """
-    Runs the orchestrator to determine relevant agents with improved error handling.
+    emit wrapper for a combined formatter, whose streamed answer is a FormattedAnswer JSON object: only the decoded
+    text of its "message" field is forwarded as "token" events. The tokens of the first skip_tasks tasks (the
+    specialists of a sequential crew) are forwarded as they are.
     """
-    orchestrator_agent = Agent(
+    if emit is ignore_event:
+        return emit
+    parser = JSONStreamParser(FormattedAnswer, field="message")
+    tasks_done = [0]
+
+    def on_event(event, payload):
+        if event == "task_done":
+            tasks_done[0] += 1
+        if event == "token" and tasks_done[0] >= skip_tasks:
+            text = parser.feed(payload["token"])
+            if text:
+                emit("token", {"token": text})
+            return
+        emit(event, payload)
+
+    return on_event
+
+
+def create_orchestrator_agent():
+    return Agent(
         role="Orchestrator agent",
         goal="Understand the user's query and recommend which application(s) to use and why.",
         backstory="You are the connector, ensuring users understand the strengths of each application.",
-        llm=llm,
+        llm=stage_llm("routing"),
         verbose=True
     )
+
+
+def count_prompt_tokens(stage, *texts):
+    """
+    Log and return the token count of the prompt text sent to the LLM by a pipeline stage.
+    """
+    tokens = sum(count_tokens(text) for text in texts)
+    print(f"🔢 {stage} prompt: {tokens} tokens")
+    record_tokens(stage, tokens, "prompt")
+    return tokens
+
+
+def count_completion_tokens(stage, text):
+    """
+    Record the token count of an LLM answer received by a pipeline stage.
+    """
+    tokens = count_tokens(text)
+    record_tokens(stage, tokens, "completion")
+    return tokens
+
+
+def get_relevant_agents_ids(agents_data, data, ranked=None):
+    """
+    Runs the orchestrator to determine relevant agents with improved error handling.
+    ranked, the local router scores, decides which agents stay in the prompt when the catalog exceeds its budget.
+    """
+    if ranked is None:
+        ranked = rank_agents_locally(agents_data, data['message'])
+    candidates_key = hashlib.sha256("\n".join(sorted(str(agent['_id']) for agent in agents_data)).encode()).hexdigest()
+    agent_ids = routing_batcher.submit(candidates_key, (agents_data, data, dict(ranked)))
+    if agent_ids is None:
+        print("Orchestrator answer has no agent ids, using the local routing instead")
+        return pick_local_agent_ids(ranked)
+    return agent_ids
+
+
+def run_orchestrator_crew(orchestrator_agent, agents_data, data, scores=None):
+    """
+    Ask the orchestrator agent which agents are relevant to the message.
+    """
+    digest, _ = catalog_digest.render(agents_data, scores, ROUTING_CATALOG_TOKEN_BUDGET)
     orchestrator_task_description = '\n'.join([
-        f'Given this json data about the available agents: {json.dumps(agents_data)}',
+        'Given these available agents, one per line as "id | product | capability":',
+        digest,
         f"and Given this user query {data['message']}, recommend the most relevant agent(s) to handle the request.",
         "Determine which agent(s)'s products that could be used to help in the user query implementation.",
         "Return a list of the relevant agents ids."
@@ -142,9 +452,11 @@ def get_relevant_agents_ids(agents_data, data):
         description=orchestrator_task_description,
         expected_output="Determine which agent(s)'s product are most relevant to the user query and return a list of the relevant agents ids.",
         output_json=RelevantAgents,
+        converter_cls=JSONRepairConverter,
         output_file=os.path.join(output_dir, "orchestrator_output.json"),
         agent=orchestrator_agent,
     )
+    count_prompt_tokens("routing", orchestrator_task_description)
 
     crew_obj = Crew(
         agents=[orchestrator_agent],
@@ -155,18 +467,339 @@ def get_relevant_agents_ids(agents_data, data):
     )
 
     raw_result = crew_obj.kickoff()
+    count_completion_tokens("routing", raw_result.raw)
     # relevant_agents = RelevantAgents.parse_obj(raw_result)
     # print("Raw Crew Result:", relevant_agents.agent_ids)
 
-    results = parse_or_wrap_json(raw_result.json)
+    results = raw_result.json_dict or parse_or_wrap_json(raw_result.raw, RelevantAgents)
     print("Orchestrator Results:", results)
-    return results['agent_ids']
+    return results.get('agent_ids')
+
+
+def route_requests(requests):
+    """
+    Routing calls gathered by the routing batcher, as (agents_data, data, scores) sharing the same candidate agents:
+    one orchestrator crew answers them all. Returns the agent ids of every request (None when it got no answer).
+    """
+    agents_data = requests[0][0]
+    with lease_agent(("builtin", "orchestrator"), create_orchestrator_agent) as orchestrator_agent:
+        if len(requests) == 1:
+            _, data, scores = requests[0]
+            return [run_orchestrator_crew(orchestrator_agent, agents_data, data, scores)]
+        scores = {}
+        for _, _, request_scores in requests:
+            for agent_id, score in request_scores.items():
+                scores[agent_id] = max(score, scores.get(agent_id, 0.0))
+        return run_batched_orchestrator_crew(orchestrator_agent, agents_data, [data for _, data, _ in requests], scores)
+
+
+def run_batched_orchestrator_crew(orchestrator_agent, agents_data, messages, scores=None):
+    """
+    Ask the orchestrator agent which agents are relevant to each of several messages, sharing the catalog digest.
+    """
+    digest, _ = catalog_digest.render(agents_data, scores, ROUTING_CATALOG_TOKEN_BUDGET)
+    orchestrator_task_description = '\n'.join([
+        'Given these available agents, one per line as "id | product | capability":',
+        digest,
+        'and Given these user queries, one per line as "number | query":',
+        *(f"{number} | {json.dumps(data['message'])}" for number, data in enumerate(messages, start=1)),
+        "recommend for each query the most relevant agent(s) to handle the request.",
+        "Determine which agent(s)'s products that could be used to help in the implementation of each query.",
+        "Return the number of every query with the list of its relevant agents ids."
+    ])
+    orchestrator_task = Task(
+        description=orchestrator_task_description,
+        expected_output="For each user query, its number and the list of the relevant agents ids.",
+        output_json=BatchedRelevantAgents,
+        converter_cls=JSONRepairConverter,
+        agent=orchestrator_agent,
+    )
+    count_prompt_tokens("routing", orchestrator_task_description)
+
+    crew_obj = Crew(
+        agents=[orchestrator_agent],
+        tasks=[orchestrator_task],
+        process=Process.sequential,
+        verbose=True,
+    )
+    raw_result = crew_obj.kickoff()
+    count_completion_tokens("routing", raw_result.raw)
+
+    results = raw_result.json_dict or parse_or_wrap_json(raw_result.raw, BatchedRelevantAgents)
+    print("Batched Orchestrator Results for", len(messages), "messages:", results)
+    routes = {route['query']: route['agent_ids'] for route in results.get('routes', [])}
+    return [routes.get(number) for number in range(1, len(messages) + 1)]
+
+
+routing_batcher = RoutingBatcher(route_requests, ROUTING_BATCH_WINDOW_MS / 1000, ROUTING_BATCH_MAX)
+
+
+def rank_agents_locally(agents_data, query):
+    """
+    Rank the agents against the query with the local TF-IDF router (no LLM call).
+    """
+    agent_router.ensure_fitted(agents_data)
+    return agent_router.rank(query)
+
+
+def local_routing_cutoff(ranked):
+    """
+    Minimum score an agent needs to be selected: relative to the best match, never below the absolute floor.
+    """
+    if not ranked:
+        return LOCAL_ROUTING_MIN_SCORE
+    return max(LOCAL_ROUTING_MIN_SCORE, ranked[0][1] * LOCAL_ROUTING_RELATIVE_CUTOFF)
+
+
+def pick_local_agent_ids(ranked):
+    """
+    Keep the ranked agents that clear the cutoff, best first.
+    """
+    cutoff = local_routing_cutoff(ranked)
+    return [agent_id for agent_id, score in ranked if score >= cutoff][:LOCAL_ROUTING_MAX_AGENTS]
+
+
+def is_routing_ambiguous(ranked):
+    """
+    Routing is ambiguous when nothing matches confidently or when some agent scores too close to the cutoff to call.
+    """
+    if not ranked or ranked[0][1] < LOCAL_ROUTING_CONFIDENT_SCORE:
+        return True
+    cutoff = local_routing_cutoff(ranked)
+    return any(abs(score - cutoff) < LOCAL_ROUTING_MARGIN for _, score in ranked)
+
+
+def select_agent_ids(agents_data, data, routing_mode=ROUTING_MODE):
+    """
+    Pick the ids of the agents that should answer the message using the given routing mode.
+    """
+    catalog_digest.ensure(agents_data)
+    ranked = rank_agents_locally(agents_data, data['message'])
+    if routing_mode == "llm":
+        return get_llm_agent_ids(agents_data, data, ranked)
+
+    print("Local Routing Scores:", [(agent_id, round(score, 3)) for agent_id, score in ranked])
+    if routing_mode == "local" or not is_routing_ambiguous(ranked):
+        return pick_local_agent_ids(ranked)
+
+    # Ambiguous: let the LLM decide, but only among the agents the router found at least somewhat relevant.
+    candidate_ids = {agent_id for agent_id, score in ranked[:LOCAL_ROUTING_MAX_AGENTS] if score > 0}
+    candidates = [agent for agent in agents_data if agent['_id'] in candidate_ids] or agents_data
+    print("Routing is ambiguous, asking the orchestrator among", len(candidates), "agents")
+    return get_llm_agent_ids(candidates, data, ranked)
+
+
+def get_llm_agent_ids(agents_data, data, ranked):
+    """
+    Agent ids picked by the orchestrator, or by the local router when routing runs out of its share of the deadline.
+    """
+    try:
+        return get_relevant_agents_ids(agents_data, data, ranked)
+    except (DeadlineExceeded, PipelineCancelled) as e:
+        # A batched call runs under the deadline of the message that leads the batch, which may not be this one.
+        deadline = current_deadline()
+        if deadline is not None and deadline.cancelled:
+            raise
+        print(f"Routing stopped ({e}), using the local router")
+        return pick_local_agent_ids(ranked)
+
+
+def ignore_event(event, payload):
+    """
+    Default on_event callback: progress events are dropped.
+    """
+
+
+def get_knowledge_context(query):
+    """
+    Relevant passages of the knowledge files for the query, ready to be appended to a task description.
+    """
+    try:
+        with span("knowledge_search"):
+            passages = knowledge_index.search(query, top_k=KNOWLEDGE_TOP_K)
+    except Exception as e:
+        print("Knowledge search failed:", str(e))
+        return ""
+    return "\n\n".join(f"[{passage['source']}]\n{passage['text']}" for passage in passages)
+
+
+def kickoff_crew(crew, emit):
+    """
+    Run the crew, forwarding its tokens to emit when token streaming is on.
+    """
+    if STREAM_TOKENS and emit is not ignore_event:
+        with stream_tokens_to(lambda token: emit("token", {"token": token})):
+            return crew.kickoff()
+    return crew.kickoff()
+
+
+def task_done_callback(emit, formatter_role):
+    """
+    crewai task_callback of a sequential crew: emits "task_done" and records the task as a specialist or
+    formatter span, timed from the end of the previous task.
+    """
+    last_done = [time.perf_counter()]
+
+    def on_task_done(output):
+        now = time.perf_counter()
+        stage = "formatter" if output.agent == formatter_role else "specialist"
+        record_span(stage, now - last_done[0], start=last_done[0], agent=output.agent)
+        count_completion_tokens(stage, output.raw)
+        last_done[0] = now
+        emit("task_done", {"agent": output.agent, "output": output.raw})
+        # Raising from the callback stops the crew before its next task.
+        check_deadline()
+
+    return on_task_done
+
+
+def run_sequential_crew(siemens_agents, query, emit, docs_contexts=None, combined=False):
+    """
+    Chain the specialists and the formatter in a single sequential crew.
+    """
+    if combined:
+        emit = message_token_emitter(emit, skip_tasks=len(siemens_agents))
+    siemens_agents_tasks = get_tasks(siemens_agents, query, docs_contexts)
+    count_prompt_tokens("specialists", *(task.description for task in siemens_agents_tasks))
+    with lease_agent(("builtin", "formatter"), create_format_agent) as format_agent:
+        format_task = create_format_task(format_agent, knowledge=get_knowledge_context(query), combined=combined)
+        count_prompt_tokens("formatter", format_task.description)
+        siemens_agent_crew = Crew(
+            agents=siemens_agents + [format_agent],
+            tasks=siemens_agents_tasks + [format_task],
+            process=Process.sequential,
+            verbose=True,
+            task_callback=task_done_callback(emit, format_agent.role),
+        )
+        return kickoff_crew(siemens_agent_crew, emit)
+
+
+def run_sequential_specialists(siemens_agents, query, emit, docs_contexts=None):
+    """
+    Chain the specialists in a sequential crew without the formatter; returns their (role, output) pairs.
+    """
+    siemens_agents_tasks = get_tasks(siemens_agents, query, docs_contexts)
+    count_prompt_tokens("specialists", *(task.description for task in siemens_agents_tasks))
+    siemens_agent_crew = Crew(
+        agents=siemens_agents,
+        tasks=siemens_agents_tasks,
+        process=Process.sequential,
+        verbose=True,
+        task_callback=task_done_callback(emit, None),
+    )
+    crew_output = kickoff_crew(siemens_agent_crew, emit)
+    return [(output.agent, output.raw) for output in crew_output.tasks_output]
+
+
+def run_parallel_crew(siemens_agents, query, emit, concurrency=AGENT_CONCURRENCY, docs_contexts=None,
+                      combined=False):
+    """
+    Run every specialist in its own crew on a thread pool, then merge their outputs in one formatter crew.
+    """
+    with deadline_stage("specialists"):
+        specialist_outputs = run_parallel_specialists(siemens_agents, query, emit, concurrency, docs_contexts)
+    with deadline_stage("formatter"):
+        return run_format_crew(specialist_outputs, query, emit, combined)
+
+
+def run_parallel_specialists(siemens_agents, query, emit, concurrency=AGENT_CONCURRENCY, docs_contexts=None):
+    """
+    Run every specialist in its own crew on a thread pool; returns their (role, output) pairs in agent order.
+    """
+    trace = current_trace()
+    deadline, stage = current_deadline(), current_stage()
+
+    def run_specialist(agent, docs_context):
+        with use_trace(trace), use_deadline(deadline, stage), span("specialist", agent=agent.role):
+            check_deadline()
+            task = get_parallel_task(agent, query, docs_context)
+            count_prompt_tokens("specialist", task.description)
+            specialist_crew = Crew(
+                agents=[agent],
+                tasks=[task],
+                process=Process.sequential,
+                verbose=True,
+            )
+            output = kickoff_crew(specialist_crew, emit)
+            count_completion_tokens("specialist", output.raw)
+        emit("task_done", {"agent": agent.role, "output": output.raw})
+        return agent.role, output.raw
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(siemens_agents)))) as pool:
+        return list(pool.map(run_specialist, siemens_agents, docs_contexts or [""] * len(siemens_agents)))
+
+
+def run_format_crew(specialist_outputs, query, emit, combined=False):
+    """
+    Merge the (role, output) pairs of the specialists into one message with the formatter crew.
+    """
+    if combined:
+        emit = message_token_emitter(emit)
+    with lease_agent(("builtin", "formatter"), create_format_agent) as format_agent:
+        format_task = create_format_task(format_agent, specialist_outputs, get_knowledge_context(query), combined)
+        count_prompt_tokens("formatter", format_task.description)
+        format_crew = Crew(
+            agents=[format_agent],
+            tasks=[format_task],
+            process=Process.sequential,
+            verbose=True,
+            task_callback=task_done_callback(emit, format_agent.role),
+        )
+        return kickoff_crew(format_crew, emit)
+
+
+def format_locally(query, agents_data, specialist_outputs, combined=False):
+    """
+    Formatted result of the specialist outputs built by local_formatter, with the workflow graph of the products
+    they cover when combined. Returns (None, None) when the outputs leave nothing to format.
+    """
+    contributions = [
+        {"title": agent_data.get("title"), "role": role, "output": output}
+        for agent_data, (role, output) in zip(agents_data, specialist_outputs)
+    ]
+    with span("formatter", mode="local"):
+        message = format_answer(query, contributions)
+    if not message:
+        return None, None
+    graph = None
+    if combined:
+        products = contribution_products(contributions)
+        with span("flow_layout"):
+            graph = build_flow_graph(products, rule_edges(products))
+    return {"result": message}, graph if graph and graph["nodes"] else None
+
+
+def parse_combined_output(final_results):
+    """
+    Split the output of a combined formatter into the formatted result and the laid out workflow graph.
+    When the output does not match FormattedAnswer the graph is None and the text is used as the result.
+    """
+    try:
+        answer = FormattedAnswer.model_validate(
+            final_results.json_dict or parse_or_wrap_json(final_results.raw, FormattedAnswer)
+        )
+    except Exception as e:
+        print("Combined output does not match the schema, the graph will be built separately:", str(e))
+        return parse_or_wrap_json(final_results), None
+    products = answer.products or detect_products(answer.message)
+    edges = [(edge.source, edge.target) for edge in answer.edges] or rule_edges(products)
+    with span("flow_layout"):
+        graph = build_flow_graph(products, edges)
+    return {"result": answer.message}, graph if graph["nodes"] else None
 
 
-def run_orchestrator(data, agents_data) -> dict:
+def run_orchestrator(data, agents_data, on_event=None, agent_ids=None) -> dict:
     """
     Original orchestrator task that returns the Crew's textual output as a JSON object.
+    Progress is reported through on_event(event, payload): "routing", "task_done", "token" and "formatted".
+    When agent_ids is given (e.g. a remembered routing decision) the routing step is skipped.
+    In "combined" output mode the result also carries the workflow under "graph", so run_flow_agent is not needed.
+    In "local" formatter mode the specialist outputs are formatted without the formatter LLM (see format_locally).
+    Under a pipeline deadline (deadlines.use_deadline) every stage gets its share of the budget; when the
+    specialists or the formatter run out of time the result is built from the finished specialists (partial_result).
+    PipelineCancelled is raised when the pipeline is cancelled.
     """
+    emit = on_event or ignore_event
     os.makedirs(output_dir, exist_ok=True)
     # agents = get_agents(agents_data)
     # tasks = get_tasks(agents)
@@ -176,128 +809,179 @@ def run_orchestrator(data, agents_data) -> dict:
     if "message" not in data:
         return {"error": "Missing 'message' in input data."}
 
-    try:
-        orchestrator_agent = Agent(
-            role="Orchestrator agent",
-            goal="Understand the user's query and recommend which application(s) to use and why.",
-            backstory="You are the connector, ensuring users understand the strengths of each application.",
-            llm=llm,
-            verbose=True
-        )
-        orchestrator_task_description = '\n'.join([
-            f'Given this json data about the available agents: {json.dumps(agents_data)}',
-            f"and Given this user query {data['message']}, recommend the most relevant agent(s) to handle the request.",
-            "Determine which agent(s)'s products that could be used to help in the user query implementation.",
-            "Return a list of the relevant agents ids."
-        ])
-        orchestrator_task = Task(
-            description=orchestrator_task_description,
-            expected_output="Determine which agent(s)'s product are most relevant to the user query and return a list of the relevant agents ids.",
-            output_json=RelevantAgents,
-            output_file=os.path.join(output_dir, "orchestrator_output.json"),
-            agent=orchestrator_agent,
-        )
+    routing_mode = data.get("routing_mode", ROUTING_MODE)
+    if routing_mode not in ROUTING_MODES:
+        return {"error": f"Unknown routing mode '{routing_mode}', expected one of {', '.join(ROUTING_MODES)}."}
+    execution_mode = data.get("execution_mode", EXECUTION_MODE)
+    if execution_mode not in EXECUTION_MODES:
+        return {"error": f"Unknown execution mode '{execution_mode}', expected one of {', '.join(EXECUTION_MODES)}."}
+    output_mode = data.get("output_mode", OUTPUT_MODE)
+    if output_mode not in OUTPUT_MODES:
+        return {"error": f"Unknown output mode '{output_mode}', expected one of {', '.join(OUTPUT_MODES)}."}
+    combined = output_mode == "combined"
+    formatter_mode = data.get("formatter_mode", FORMATTER_MODE)
+    if formatter_mode not in FORMATTER_MODES:
+        return {"error": f"Unknown formatter mode '{formatter_mode}', expected one of {', '.join(FORMATTER_MODES)}."}
 
-        crew_obj = Crew(
-            agents=[orchestrator_agent],
-            tasks=[orchestrator_task],
-            process=Process.sequential,
-            verbose=True,
-            # knowledge_sources=[orchestrator_knowledge_source]
-        )
+    # (role, output) of the specialists that finished, answered from when the pipeline runs out of time.
+    completed = []
 
-        raw_result = crew_obj.kickoff()
-        # relevant_agents = RelevantAgents.parse_obj(raw_result)
-        # print("Raw Crew Result:", relevant_agents.agent_ids)
+    def collect(event, payload):
+        if event == "task_done":
+            completed.append((payload["agent"], payload["output"]))
+        emit(event, payload)
 
-        results = parse_or_wrap_json(raw_result.json)
-        print("Orchestrator Results:", results)
-        agent_ids = results['agent_ids']
+    relevant_agents_data = []
+    try:
+        if agent_ids is None:
+            with span("routing", mode=routing_mode), deadline_stage("routing"):
+                agent_ids = select_agent_ids(agents_data, data, routing_mode)
+        emit("routing", {"agent_ids": agent_ids})
         # print('Agents Data: ', agents_data)
-        relevant_agents_data = []
         for agent_data in agents_data:
             if agent_data['_id'] in agent_ids:
                 print("Relevant Agent Data:", agent_data['_id'])
                 relevant_agents_data.append(agent_data)
 
         # siemens_agents = get_agents([agent_data if agent_data['_id'] in agent_ids else None for agent_data in agents_data])
-        siemens_agents = get_agents(relevant_agents_data)
-        print("Siemens Agents num:", len(siemens_agents))
-        if siemens_agents:
-            manager = Agent(
-                role="Project Manager",
-                goal="Efficiently manage the crew and ensure high-quality task completion",
-                backstory="You're an experienced project manager, skilled in overseeing complex projects and guiding teams to success. Your role is to coordinate the efforts of the crew members, ensuring that each task is completed on time and to the highest standard.",
-                allow_delegation=True,
-                llm=llm,
-            )
-
-            print("Siemens Agents is here")
-            siemens_agents_tasks = get_tasks(siemens_agents, data['message'])
-            format_agent = create_format_agent()
-            format_task = create_format_task(format_agent)
-            siemens_agent_crew = Crew(
-                agents=siemens_agents + [format_agent],
-                tasks=siemens_agents_tasks + [format_task],
-                process=Process.sequential,
-                verbose=True,
-                knowledge_sources=[text_file_source,
-                                   # pdf_source,
-                                   ]
-            )
-            final_results = siemens_agent_crew.kickoff()
-            print('Final Results:', final_results)
-            return parse_or_wrap_json(final_results)
-        else:
-            print("Siemens Agents is none")
-            return {"error": "No relevant agents found."}
-
+        with lease_agents(relevant_agents_data) as siemens_agents:
+            print("Siemens Agents num:", len(siemens_agents))
+            if siemens_agents:
+                print("Siemens Agents is here")
+                docs_contexts = [
+                    get_agent_docs_context(agent_data, data['message']) for agent_data in relevant_agents_data
+                ]
+                concurrency = int(data.get("agent_concurrency", AGENT_CONCURRENCY))
+                formatted_results = graph = None
+                if formatter_mode == "local":
+                    with deadline_stage("specialists"):
+                        if execution_mode == "parallel":
+                            specialist_outputs = run_parallel_specialists(
+                                siemens_agents, data['message'], collect, concurrency, docs_contexts
+                            )
+                        else:
+                            specialist_outputs = run_sequential_specialists(
+                                siemens_agents, data['message'], collect, docs_contexts
+                            )
+                    formatted_results, graph = format_locally(
+                        data['message'], relevant_agents_data, specialist_outputs, combined
+                    )
+                    if formatted_results is None:
+                        print("Nothing to format locally, falling back to the formatter LLM")
+                        with deadline_stage("formatter"):
+                            final_results = run_format_crew(specialist_outputs, data['message'], collect, combined)
+                elif execution_mode == "parallel":
+                    final_results = run_parallel_crew(
+                        siemens_agents, data['message'], collect, concurrency, docs_contexts, combined
+                    )
+                else:
+                    # The formatter shares the crew of the specialists, the whole crew has to end with its stage.
+                    with deadline_stage("formatter"):
+                        final_results = run_sequential_crew(
+                            siemens_agents, data['message'], collect, docs_contexts, combined
+                        )
+                if formatted_results is None:
+                    print('Final Results:', final_results)
+                    if combined:
+                        formatted_results, graph = parse_combined_output(final_results)
+                    else:
+                        formatted_results, graph = parse_or_wrap_json(final_results), None
+                emit("formatted", {"result": formatted_results})
+                if graph is not None:
+                    return {**formatted_results, "graph": graph}
+                return formatted_results
+            else:
+                print("Siemens Agents is none")
+                return {"error": "No relevant agents found."}
 
+    except DeadlineExceeded as e:
+        print("Error occurred:", str(e))
+        result = partial_result(data['message'], relevant_agents_data, completed)
+        emit("formatted", {"result": result})
+        return result
+    except PipelineCancelled:
+        raise
     except Exception as e:
         print("Error occurred:", str(e))
         return {"error": str(e)}
 
+
+def partial_result(query, agents_data, completed):
+    """
+    Answer of a pipeline that ran out of time: the outputs of the specialists that finished, formatted locally and
+    flagged "partial" so that no workflow graph is built for it.
+    """
+    data_by_role = {agent_data["role"]: agent_data for agent_data in agents_data}
+    specialist_outputs = [(role, output) for role, output in completed if role in data_by_role]
+    print("Answering with the outputs of", len(specialist_outputs), "of", len(agents_data), "specialists")
+    result = None
+    if specialist_outputs:
+        result, _ = format_locally(query, [data_by_role[role] for role, _ in specialist_outputs], specialist_outputs)
+    if result is None:
+        result = {"error": "The agents did not answer in time."}
+    return {**result, "partial": True}
+
 def run_flow_agent(data, agents_results) -> dict:
     """
     Generates a hierarchical React Flow graph dynamically based on relevant Siemens agents.
-    - Uses agent responses to determine workflow dependencies.
-    - Outputs a structured React Flow JSON graph.
+    - Finds the Siemens products the agent responses use and their workflow dependencies.
+    - Lays the graph out locally (flow_layout) and outputs a structured React Flow JSON graph.
+    The dependencies come from RULE_DEPENDENCIES, from the LLM (edges only) or, in "llm" mode, from a full graph
+    drawn by the LLM whose labels and positions are then validated and recomputed.
     """
     print("📥 Received Task Data:", data.get("message"))
 
     if "message" not in data:
         return {"error": "Missing 'message' in input data."}
 
+    flow_mode = data.get("flow_mode", FLOW_MODE)
+    if flow_mode not in FLOW_MODES:
+        return {"error": f"Unknown flow mode '{flow_mode}', expected one of {', '.join(FLOW_MODES)}."}
+
     try:
         if not agents_results or not isinstance(agents_results, dict):
             return {"error": "Invalid or missing agent results."}
 
         print("✅ Received Agents Results:", json.dumps(agents_results, indent=2))
 
-        # 🔹 Siemens Product Mapping (Restricts Mistral to Valid Names)
-        siemens_product_map = {
-            "CAD Modeling": "NX",
-            "Simulation": "Simcenter 3D",
-            "Thermal Management": "Star-CCM+",
-            "System Simulation": "AMESIM",
-            "Multidisciplinary Design": "HEEDS",
-            "Test & Validation": "Simcenter Testlab",
-            "Simulation Data Management": "Teamcenter Simulation",
-            "FEA Analysis": "NASTRAN",
-            "Finite Element Modeling": "FEMAP"
-        }
-        # Step 1: Define Flow Orchestrator Agent
-        flow_orchestrator_agent = Agent(
-            role="Flow Orchestrator Agent",
-            goal=(
-                "Generate a hierarchical React Flow JSON representing dependencies between Siemens products. "
-                "Only use product names from the predefined Siemens software list."
-            ),
-            backstory="You specialize in structuring workflows based on Siemens software dependencies.",
-            llm=llm,
-            verbose=True
-        )
+        with deadline_stage("flow"):
+            if flow_mode == "llm":
+                products, edges = parse_react_flow(run_flow_graph_crew(data, agents_results))
+            else:
+                products = detect_products(json.dumps(agents_results))
+                edges = rule_edges(products)
+                if flow_mode == "edges" or (flow_mode == "auto" and not rules_cover(products, edges)):
+                    try:
+                        edges = get_flow_edges(data, products) or edges
+                    except DeadlineExceeded:
+                        print("Flow edges ran out of time, using the rule-based dependencies")
+        print("Workflow products:", products, "dependencies:", edges)
+
+        with span("flow_layout"):
+            flow_parsed_results = build_flow_graph(products, edges)
+
+        # Validate the graph before returning
+        if not flow_parsed_results["nodes"]:
+            return {"error": "Failed to generate valid workflow hierarchy"}
+
+        # Save JSON results for debugging/logging
+        save_to_file(flow_parsed_results, "flow_hierarchy_results")
+
+        return flow_parsed_results
 
+    except PipelineCancelled:
+        raise
+    except Exception as e:
+        print("❌ Error occurred:", str(e))
+        return {"error": str(e)}
+
+
+def run_flow_graph_crew(data, agents_results) -> dict:
+    """
+    Ask the flow agent for a complete React Flow graph (nodes, levels, positions and edges).
+    """
+    # Step 1: Borrow the Flow Orchestrator Agent
+    with lease_agent(("builtin", "flow"), create_flow_agent) as flow_orchestrator_agent:
         # Step 2: Define React Flow Diagram Task
         flow_task = Task(
             description=f"""
@@ -319,7 +1003,7 @@ def run_flow_agent(data, agents_results) -> dict:
 
             🔹 **STRICT OUTPUT RULES:**
             - Nodes must use **ONLY these Siemens product names**:
-              {json.dumps(list(siemens_product_map.values()), indent=2)}
+              {json.dumps(list(SIEMENS_PRODUCT_MAP.values()), indent=2)}
             - **DO NOT** generate new product names.
             - **DO NOT** return explanations, markdown (` ```json `), or any extra text.
             - **ONLY** return **one valid JSON object**.
@@ -329,6 +1013,8 @@ def run_flow_agent(data, agents_results) -> dict:
             agent=flow_orchestrator_agent,
         )
 
+        count_prompt_tokens("flow", flow_task.description)
+
         # Step 3: Run Crew for React Flow Diagram Generation
         flow_crew = Crew(
             agents=[flow_orchestrator_agent],
@@ -337,23 +1023,65 @@ def run_flow_agent(data, agents_results) -> dict:
             verbose=True
         )
 
-        raw_flow_result = flow_crew.kickoff()
+        with span("flow"):
+            raw_flow_result = flow_crew.kickoff()
+        count_completion_tokens("flow", raw_flow_result.raw)
 
-        # Step 4: Parse & Validate JSON Output
-        flow_parsed_results = parse_or_wrap_json(raw_flow_result)
+    return parse_or_wrap_json(raw_flow_result.raw, ReactFlowGraph)
 
-        # Step 5: Validate JSON before returning
-        if not flow_parsed_results.get("nodes") or not flow_parsed_results.get("edges"):
-            return {"error": "Failed to generate valid workflow hierarchy"}
 
-        # Step 6: Save JSON results for debugging/logging
-        save_to_file(flow_parsed_results, "flow_hierarchy_results")
+def get_flow_edges(data, products):
+    """
+    Ask the flow agent which of the workflow products depend on which; returns (source, target) label pairs,
+    or an empty list when the answer cannot be used.
+    """
+    if len(products) < 2:
+        return []
+    with lease_agent(("builtin", "flow"), create_flow_agent) as flow_orchestrator_agent:
+        edges_task = Task(
+            description="\n".join([
+                f"User Query: {json.dumps(data['message'])}",
+                f"The workflow uses these Siemens products: {json.dumps(products)}",
+                "Return the dependencies between them: an edge goes from a product (source) to a product that needs "
+                "its output (target).",
+                "Only use the product names listed above and do not return any other text.",
+            ]),
+            expected_output='A JSON object {"edges": [{"source": product, "target": product}]}.',
+            output_json=FlowEdges,
+            converter_cls=JSONRepairConverter,
+            agent=flow_orchestrator_agent,
+        )
+        count_prompt_tokens("flow", edges_task.description)
+        edges_crew = Crew(
+            agents=[flow_orchestrator_agent],
+            tasks=[edges_task],
+            process=Process.sequential,
+            verbose=True
+        )
+        with span("flow"):
+            raw_edges_result = edges_crew.kickoff()
+        count_completion_tokens("flow", raw_edges_result.raw)
 
-        return flow_parsed_results
+    parsed = raw_edges_result.json_dict or parse_or_wrap_json(raw_edges_result.raw, FlowEdges)
+    if not isinstance(parsed.get("edges"), list):
+        print("Flow edges could not be parsed, using the rule-based dependencies")
+        return []
+    return [
+        (edge.get("source"), edge.get("target")) for edge in parsed["edges"] if isinstance(edge, dict)
+    ]
+
+def create_flow_agent():
+    return Agent(
+        role="Flow Orchestrator Agent",
+        goal=(
+            "Generate a hierarchical React Flow JSON representing dependencies between Siemens products. "
+            "Only use product names from the predefined Siemens software list."
+        ),
+        backstory="You specialize in structuring workflows based on Siemens software dependencies.",
+        llm=stage_llm("flow"),
+        verbose=True
+    )
 
-    except Exception as e:
-        print("❌ Error occurred:", str(e))
-        return {"error": str(e)}
 
 def create_format_agent():
     return Agent(
@@ -361,13 +1089,41 @@ def create_format_agent():
         goal='Format and beautify text messages into chat-like responses',
         backstory='Specialist in text formatting and presentation',
         allow_delegation=False,
-        llm=llm,
+        llm=stage_llm("formatter"),
     )
 
 
-def create_format_task(agent):
+def create_format_task(agent, specialist_outputs=None, knowledge=None, combined=False):
+    """
+    Formatter task; when the specialists ran in parallel their (role, output) pairs are merged into its input.
+    Knowledge passages (e.g. formatted result examples) are appended as reference material.
+    A combined task also returns the workflow of the answer, as a FormattedAnswer.
+    """
+    description = 'Format and beautify the input message'
+    if specialist_outputs:
+        description = '\n\n'.join(
+            ['Merge the following answers of the specialist agents into one message, then format and beautify it']
+            + [f'{role}:\n{output}' for role, output in specialist_outputs]
+        )
+    if knowledge:
+        description += f'\n\nUse this reference material for the style and structure of the message:\n{knowledge}'
+    if combined:
+        description += '\n\n' + '\n'.join([
+            'Return one JSON object with the formatted message, the Siemens products it uses and their dependencies.',
+            f'Products must be named exactly as in this list: {json.dumps(list(SIEMENS_PRODUCT_MAP.values()))}',
+            'An edge goes from a product (source) to a product that needs its output (target).',
+        ])
+        return Task(
+            description=description,
+            agent=agent,
+            expected_output=(
+                'A JSON object with the formatted chat-style message, the products and the edges between them'
+            ),
+            output_json=FormattedAnswer,
+            converter_cls=JSONRepairConverter,
+        )
     return Task(
-        description='Format and beautify the input message',
+        description=description,
         agent=agent,
         expected_output='A well-formatted informative chat-style message that highlights the key points',
         output_file=os.path.join(output_dir, "final_results_formatted.txt"),
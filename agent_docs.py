@@ -0,0 +1,145 @@
+import os
+import threading
+
+import numpy as np
+
+from embeddings import get_embedder
+from knowledge_store import KNOWLEDGE_DIR, chunk_text, content_hash
+from utils import count_tokens
+
+AGENT_DOCS_CHUNK_SIZE = int(os.environ.get("AGENT_DOCS_CHUNK_SIZE", "600"))
+AGENT_DOCS_CHUNK_OVERLAP = int(os.environ.get("AGENT_DOCS_CHUNK_OVERLAP", "80"))
+AGENT_DOCS_FILE_TYPES = (".txt", ".md", ".pdf")
+
+
+def docs_entries(docs):
+    """
+    The agent `docs` field as a list of entries: a single string, one entry per line, or a list of strings.
+    """
+    if not docs:
+        return []
+    if isinstance(docs, (list, tuple)):
+        return [str(entry).strip() for entry in docs if str(entry).strip()]
+    docs = str(docs).strip()
+    lines = [line.strip() for line in docs.splitlines() if line.strip()]
+    if lines and all(resolve_docs_file(line) for line in lines):
+        return lines
+    return [docs]
+
+
+def resolve_docs_file(entry):
+    """
+    Path of the documentation file an entry refers to (absolute, or relative to the knowledge directory), or None.
+    """
+    if "\n" in entry or not entry.lower().endswith(AGENT_DOCS_FILE_TYPES):
+        return None
+    for path in (entry, os.path.join(KNOWLEDGE_DIR, entry)):
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def read_docs_file(path):
+    if path.lower().endswith(".pdf"):
+        # pdfplumber comes with crewai's PDF knowledge source.
+        import pdfplumber
+        with pdfplumber.open(path) as pdf:
+            return "\n\n".join(page.extract_text() or "" for page in pdf.pages)
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def docs_version(entries):
+    """
+    Version of an agent's docs: the entries themselves plus the modification time of every referenced file.
+    """
+    parts = []
+    for entry in entries:
+        path = resolve_docs_file(entry)
+        parts.append(f"{entry}@{os.path.getmtime(path)}" if path else entry)
+    return content_hash("\n".join(parts))
+
+
+def select_passages(passages, token_budget):
+    """
+    Keep the best passages, in order, as long as they fit in token_budget; a passage that does not fit is skipped
+    so a smaller, less relevant one can still make it.
+    """
+    selected, used = [], 0
+    for passage in passages:
+        tokens = count_tokens(passage["text"])
+        if used + tokens > token_budget:
+            continue
+        selected.append(passage)
+        used += tokens
+    return selected
+
+
+class AgentDocsIndex:
+    """
+    One small in-memory vector index per agent over the chunks of its `docs` field.
+
+    An agent's index is built the first time it is searched and rebuilt only when its docs (or the files they
+    reference) change, so repeated messages only pay for embedding the query.
+    """
+
+    def __init__(self):
+        self.indexes = {}
+        self._lock = threading.Lock()
+
+    def _build(self, entries):
+        chunks = []
+        for entry in entries:
+            path = resolve_docs_file(entry)
+            try:
+                text, source = (read_docs_file(path), os.path.basename(path)) if path else (entry, "docs")
+            except Exception as e:
+                print("Could not read agent docs", entry, str(e))
+                continue
+            chunks.extend(
+                {"text": chunk, "source": source}
+                for chunk in chunk_text(text, AGENT_DOCS_CHUNK_SIZE, AGENT_DOCS_CHUNK_OVERLAP)
+            )
+        matrix = get_embedder().embed([chunk["text"] for chunk in chunks]) if chunks else None
+        return chunks, matrix
+
+    def get(self, agent):
+        """
+        (chunks, matrix) of the agent's docs, building or rebuilding them if needed.
+        """
+        entries = docs_entries(agent.get("docs"))
+        if not entries:
+            return [], None
+        agent_id = str(agent["_id"])
+        version = docs_version(entries)
+        with self._lock:
+            cached = self.indexes.get(agent_id)
+            if cached and cached["version"] == version:
+                return cached["chunks"], cached["matrix"]
+        chunks, matrix = self._build(entries)
+        print(f"📚 Indexed {len(chunks)} docs chunks for agent {agent_id}")
+        with self._lock:
+            self.indexes[agent_id] = {"version": version, "chunks": chunks, "matrix": matrix}
+        return chunks, matrix
+
+    def search(self, agent, query, top_k=3, token_budget=None):
+        """
+        Return up to top_k {"text", "source", "score"} chunks of the agent's docs most similar to the query,
+        trimmed to token_budget when one is given.
+        """
+        chunks, matrix = self.get(agent)
+        if not chunks:
+            return []
+        scores = matrix @ get_embedder().embed([query])[0]
+        order = np.argsort(-scores)[:top_k]
+        passages = [{**chunks[index], "score": float(scores[index])} for index in order]
+        return select_passages(passages, token_budget) if token_budget is not None else passages
+
+    def retain(self, agent_ids):
+        """
+        Drop the indexes of agents that are no longer in the catalog.
+        """
+        agent_ids = {str(agent_id) for agent_id in agent_ids}
+        with self._lock:
+            for agent_id in set(self.indexes) - agent_ids:
+                del self.indexes[agent_id]
@@ -0,0 +1,43 @@
+import threading
+from collections import defaultdict
+
+
+class AgentPool:
+    """
+    Keeps constructed crewai Agents around so requests stop rebuilding them.
+
+    crewai mutates an Agent during kickoff (crew, executor, i18n), so an instance is only ever used by one crew at a
+    time: acquire() hands out an idle instance for the key or builds a new one, release() puts it back.
+    Keys carry a version, so an edited agent never reuses an instance built from its old definition.
+    """
+
+    def __init__(self, max_idle_per_key=4):
+        self.max_idle_per_key = max_idle_per_key
+        self._idle = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def acquire(self, key, factory):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+        return factory()
+
+    def release(self, key, agent):
+        with self._lock:
+            idle = self._idle[key]
+            if len(idle) < self.max_idle_per_key:
+                idle.append(agent)
+
+    def retain(self, keys):
+        """
+        Drop the idle instances of every key not in keys (deleted agents, superseded versions).
+        """
+        keys = set(keys)
+        with self._lock:
+            for key in [key for key in self._idle if key[0] != "builtin" and key not in keys]:
+                del self._idle[key]
+
+    def clear(self):
+        with self._lock:
+            self._idle.clear()
@@ -0,0 +1,121 @@
+import math
+import re
+import threading
+from collections import Counter
+
+import numpy as np
+
+from utils import catalog_fingerprint
+
+# Fields of an agent document that describe what the agent can help with,
+# together with how much each one counts towards the agent's vector.
+ROUTED_FIELDS = {
+    "title": 2.0,
+    "role": 2.0,
+    "goals": 1.5,
+    "backstory": 1.0,
+    "docs": 0.5,
+}
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9][a-z0-9+\-]*")
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "for", "from", "how", "i", "in", "into", "is", "it",
+    "its", "me", "my", "of", "on", "or", "our", "should", "that", "the", "their", "this", "to", "us", "use",
+    "using", "we", "what", "which", "with", "you", "your",
+}
+
+
+def tokenize(text):
+    """
+    Lowercase the text and split it into unigram and bigram terms, skipping stop words.
+    """
+    words = [word for word in TOKEN_PATTERN.findall(str(text or "").lower()) if word not in STOP_WORDS]
+    return words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+
+
+class AgentRouter:
+    """
+    TF-IDF index over the agent catalog used to rank agents for a user query without calling the LLM.
+    The index is rebuilt only when the catalog fingerprint changes.
+    """
+
+    def __init__(self):
+        self.fingerprint = None
+        self.agent_ids = []
+        self.vocabulary = {}
+        self.idf = np.zeros(0)
+        self.matrix = np.zeros((0, 0))
+        self._lock = threading.Lock()
+
+    def fit(self, agents_data):
+        """
+        Build the TF-IDF matrix (one L2-normalized row per agent) from the routed fields.
+        """
+        documents = []
+        for agent in agents_data:
+            weighted_counts = Counter()
+            for field, weight in ROUTED_FIELDS.items():
+                for term, count in Counter(tokenize(agent.get(field))).items():
+                    weighted_counts[term] += weight * count
+            documents.append(weighted_counts)
+
+        vocabulary = {}
+        for counts in documents:
+            for term in counts:
+                vocabulary.setdefault(term, len(vocabulary))
+
+        document_frequency = np.zeros(len(vocabulary))
+        for counts in documents:
+            for term in counts:
+                document_frequency[vocabulary[term]] += 1
+        idf = np.log((1 + len(documents)) / (1 + document_frequency)) + 1
+
+        matrix = np.zeros((len(documents), len(vocabulary)))
+        for row, counts in enumerate(documents):
+            for term, count in counts.items():
+                matrix[row, vocabulary[term]] = 1 + math.log(count)
+        matrix *= idf
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+
+        self.agent_ids = [str(agent["_id"]) for agent in agents_data]
+        self.vocabulary = vocabulary
+        self.idf = idf
+        self.matrix = matrix
+        self.fingerprint = catalog_fingerprint(agents_data)
+
+    def ensure_fitted(self, agents_data):
+        """
+        Refit the index if the catalog changed since the last fit.
+        """
+        fingerprint = catalog_fingerprint(agents_data)
+        with self._lock:
+            if fingerprint != self.fingerprint:
+                self.fit(agents_data)
+
+    def vectorize(self, text):
+        """
+        Project a query onto the catalog vocabulary; terms unknown to the catalog are ignored.
+        """
+        vector = np.zeros(len(self.vocabulary))
+        for term, count in Counter(tokenize(text)).items():
+            index = self.vocabulary.get(term)
+            if index is not None:
+                vector[index] = 1 + math.log(count)
+        vector *= self.idf
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def rank(self, query, top_k=None):
+        """
+        Return (agent_id, cosine score) pairs sorted from most to least relevant.
+        """
+        with self._lock:
+            if not self.agent_ids:
+                return []
+            agent_ids = self.agent_ids
+            scores = self.matrix @ self.vectorize(query)
+        order = np.argsort(-scores, kind="stable")
+        if top_k is not None:
+            order = order[:top_k]
+        return [(agent_ids[index], float(scores[index])) for index in order]
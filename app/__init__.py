@@ -3,26 +3,52 @@
 from flask import Flask
 from flask_pymongo import PyMongo
 from flask_socketio import SocketIO
+from .cache import TTLCache
+from .catalog import AgentCatalog
 from .config import Config
+from .jobs import JobQueue
+from .pipeline_registry import PipelineRegistry
+from .routing_memo import RoutingMemo
+from .single_flight import SingleFlight
 
 # Initialize extensions
 mongo = PyMongo()
 socketio = SocketIO(cors_allowed_origins="*")
+pipeline_jobs = JobQueue()
+pipeline_flights = SingleFlight()
+running_pipelines = PipelineRegistry()
+result_cache = TTLCache('RESULT_CACHE')
+routing_memo = RoutingMemo()
+agent_catalog = AgentCatalog()
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
 
     # Initialize extensions with the app
-    mongo.init_app(app)
-    socketio.init_app(app)
+    mongo.init_app(app, maxPoolSize=app.config['MONGO_MAX_POOL_SIZE'])
+    socketio.init_app(
+        app,
+        async_mode=app.config['SOCKETIO_ASYNC_MODE'],
+        message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'],
+    )
+    pipeline_jobs.init_app(app)
+    pipeline_flights.init_app(app)
+    result_cache.init_app(app)
+    routing_memo.init_app(app)
+    agent_catalog.init_app(app)
 
     # Import and register blueprints
     from app.controllers.agent_controller import agent_bp
     from app.controllers.chat_controller import chat_bp
+    from app.controllers.cache_controller import cache_bp
+    from app.controllers.metrics_controller import metrics_bp
+    from app.controllers import socket_controller  # noqa: F401 - registers the Socket.IO handlers
 
     # Blueprints are registered with URL prefixes
     app.register_blueprint(agent_bp, url_prefix='/agent')
     app.register_blueprint(chat_bp, url_prefix='/chat')
+    app.register_blueprint(cache_bp, url_prefix='/cache')
+    app.register_blueprint(metrics_bp, url_prefix='/metrics')
 
     return app
@@ -0,0 +1,62 @@
+# app/catalog.py
+
+import threading
+
+from metrics import record_cache_lookup
+
+
+class AgentCatalog:
+    """
+    In-memory copy of the agents collection so the message hot path does no catalog I/O.
+
+    The copy is dropped by every write that goes through agent_repository and, when AGENT_CATALOG_WATCH is on
+    (Mongo replica set required), by a change stream on the agents collection, then reloaded on the next read.
+    """
+
+    def __init__(self, app=None):
+        self._agents = None
+        self._generation = 0
+        self._reload_callbacks = []
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.config.get('AGENT_CATALOG_WATCH', False):
+            threading.Thread(target=self._watch, name='agent-catalog-watch', daemon=True).start()
+
+    def on_reload(self, callback):
+        """
+        Register callback(agents), called every time the catalog is loaded again after a change.
+        """
+        self._reload_callbacks.append(callback)
+
+    def get(self, loader):
+        """
+        Return the cached agents, loading them with loader() after an invalidation.
+        """
+        with self._lock:
+            agents, generation = self._agents, self._generation
+        record_cache_lookup('agent_catalog', agents is not None)
+        if agents is None:
+            agents = loader()
+            with self._lock:
+                # Only keep the result if nothing was written while it loaded.
+                if generation == self._generation:
+                    self._agents = agents
+            for callback in self._reload_callbacks:
+                callback(agents)
+        return list(agents)
+
+    def invalidate(self):
+        with self._lock:
+            self._agents = None
+            self._generation += 1
+
+    def _watch(self):
+        from app.repositories.agent_repository import watch_agent_changes
+
+        try:
+            watch_agent_changes(self.invalidate)
+        except Exception as e:
+            print("Agent change stream unavailable, relying on write invalidation:", e)
@@ -1,6 +1,63 @@
 # app/config.py
+import os
 
 class Config:
     SECRET_KEY = 'supersecretkey'
     MONGO_URI = "mongodb://localhost:27017/mydatabase"
     # For production or remote deployments, update the URI accordingly.
+    MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+
+    # Socket.IO server mode: None picks the best available (threading for the dev server),
+    # "gevent" or "eventlet" when serving through wsgi.py / gunicorn.conf.py.
+    SOCKETIO_ASYNC_MODE = os.environ.get('SOCKETIO_ASYNC_MODE') or None
+
+    # Chat pipelines run on a bounded worker pool; messages beyond the backlog get a 503. A message coalesced onto
+    # an identical running pipeline (PIPELINE_COALESCE) waits for the leader's result without taking a worker.
+    PIPELINE_WORKERS = int(os.environ.get('PIPELINE_WORKERS', '2'))
+    PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', '16'))
+    PIPELINE_JOB_HISTORY = 1000
+
+    # Concurrent messages with the same normalized text, pipeline options and agent catalog share one pipeline run;
+    # every chat still gets the events and its own SYSTEM message.
+    PIPELINE_COALESCE = os.environ.get('PIPELINE_COALESCE', 'true').lower() == 'true'
+
+    # Seconds a message may take from the moment it is sent, split across routing, specialists, formatter and flow
+    # graph (deadlines.STAGE_SHARES); past it the answer is built from the specialists that finished and the graph is
+    # skipped. Each message can override it with a "deadline" key, 0 means no deadline.
+    PIPELINE_DEADLINE = float(os.environ.get('PIPELINE_DEADLINE_SECONDS', '300'))
+
+    # "thread" runs the pipelines on the pool above; "mongo" queues them durably in the pipeline_jobs collection
+    # for worker.py processes (leases renewed while running, retries with backoff, then dead-lettered).
+    JOB_BACKEND = os.environ.get('JOB_BACKEND', 'thread')
+    JOB_QUEUE_LIMIT = int(os.environ.get('JOB_QUEUE_LIMIT', '1000'))
+    JOB_LEASE_SECONDS = 60
+    JOB_MAX_ATTEMPTS = 3
+    JOB_RETRY_DELAY = 10
+    JOB_POLL_INTERVAL = 1.0
+    JOB_HISTORY_TTL = 7 * 24 * 3600
+
+    # Message queue shared by every web node and worker so Socket.IO events reach clients connected anywhere,
+    # e.g. "redis://localhost:6379/0" (redis package) or "mongodb://localhost:27017/socketio" (kombu package).
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or None
+
+    # Exact-match cache of finished pipelines (in-process LRU in front of the Mongo result_cache collection).
+    RESULT_CACHE_SIZE = 256
+    RESULT_CACHE_TTL = 24 * 3600
+
+    # Reuse the routing decision of the most similar earlier message (cosine similarity of local embeddings).
+    ROUTING_MEMO_SIZE = 5000
+    ROUTING_MEMO_THRESHOLD = 0.8
+
+    # The agent catalog is cached in memory and dropped on writes; also follow a change stream (replica sets only).
+    AGENT_CATALOG_WATCH = False
+
+    # Chat listing and chat views are paginated; previews of the last message are truncated.
+    CHAT_PAGE_SIZE = 50
+    CHAT_PAGE_MAX_SIZE = 200
+    CHAT_PREVIEW_LENGTH = 120
+
+    # POST /agent/bulk inserts agents in unordered batches of this size (JSON array or NDJSON body).
+    BULK_BATCH_SIZE = 500
+
+    # Attach the per-stage timing trace to the SYSTEM message (each message can override it with a "trace" key).
+    PIPELINE_TRACE = os.environ.get('PIPELINE_TRACE', 'false').lower() == 'true'
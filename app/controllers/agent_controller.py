@@ -1,6 +1,8 @@
 # app/controllers/agent_controller.py
 
-from flask import Blueprint, request, jsonify
+import json
+
+from flask import Blueprint, request, jsonify, current_app
 from app.services.agent_service import create_agent, get_agents, get_agent, update_agent, delete_agent, create_agents
 
 agent_bp = Blueprint('agent', __name__)
@@ -11,10 +13,27 @@ def create_agent_route():
     result, status = create_agent(data)
     return jsonify(result), status
 
+def read_ndjson(stream):
+    """Yield (index, agent) for every non-empty line of an NDJSON body, (index, error) for unparsable lines."""
+    index = 0
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            yield index, json.loads(line)
+        except ValueError as e:
+            yield index, e
+        index += 1
+
 @agent_bp.route('/bulk', methods=['POST'])
 def create_agents_route():
-    data_list = request.get_json()
-    result, status = create_agents(data_list)
+    batch_size = current_app.config['BULK_BATCH_SIZE']
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        # Streamed import: the body is read line by line, and only counts and errors are returned.
+        result, status = create_agents(read_ndjson(request.stream), batch_size, include_agents=False)
+    else:
+        data_list = request.get_json()
+        result, status = create_agents(data_list, batch_size)
     return jsonify(result), status
 
 
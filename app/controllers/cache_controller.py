@@ -0,0 +1,17 @@
+# app/controllers/cache_controller.py
+
+from flask import Blueprint, jsonify
+
+from app.services.cache_service import get_cache_stats, clear_cache
+
+cache_bp = Blueprint('cache', __name__)
+
+@cache_bp.route('/stats', methods=['GET'])
+def get_cache_stats_route():
+    result, status = get_cache_stats()
+    return jsonify(result), status
+
+@cache_bp.route('', methods=['DELETE'])
+def clear_cache_route():
+    result, status = clear_cache()
+    return jsonify(result), status
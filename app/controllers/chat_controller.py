@@ -3,7 +3,7 @@
 from flask import Blueprint, request, jsonify
 
 from app.services.chat_service import create_chat, get_chats, get_chat, update_chat, send_message, delete_chat, \
-    delete_all_chats, delete_chats
+    delete_all_chats, delete_chats, get_job
 
 chat_bp = Blueprint('chat', __name__)
 
@@ -15,12 +15,17 @@ def create_chat_route():
 
 @chat_bp.route('', methods=['GET'])
 def get_chats_route():
-    result, status = get_chats()
+    result, status = get_chats(request.args.get('after'), request.args.get('limit'))
     return jsonify(result), status
 
 @chat_bp.route('/<chat_id>', methods=['GET'])
 def get_chat_route(chat_id):
-    result, status = get_chat(chat_id)
+    result, status = get_chat(chat_id, limit=request.args.get('limit'))
+    return jsonify(result), status
+
+@chat_bp.route('/<chat_id>/messages', methods=['GET'])
+def get_chat_messages_route(chat_id):
+    result, status = get_chat(chat_id, request.args.get('before'), request.args.get('limit'))
     return jsonify(result), status
 
 @chat_bp.route('/<chat_id>', methods=['PUT'])
@@ -35,6 +40,11 @@ def send_message_route(chat_id):
     result, status = send_message(chat_id, data)
     return jsonify(result), status
 
+@chat_bp.route('/<chat_id>/jobs/<job_id>', methods=['GET'])
+def get_job_route(chat_id, job_id):
+    result, status = get_job(chat_id, job_id)
+    return jsonify(result), status
+
 @chat_bp.route('/<chat_id>', methods=['DELETE'])
 def delete_chat_route(chat_id):
     result, status = delete_chat(chat_id)
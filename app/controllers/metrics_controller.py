@@ -0,0 +1,17 @@
+# app/controllers/metrics_controller.py
+
+from flask import Blueprint, Response, jsonify
+
+from app.services.metrics_service import get_metrics, get_model_status
+
+metrics_bp = Blueprint('metrics', __name__)
+
+@metrics_bp.route('', methods=['GET'])
+def get_metrics_route():
+    body, status, content_type = get_metrics()
+    return Response(body, status=status, content_type=content_type)
+
+@metrics_bp.route('/models', methods=['GET'])
+def get_model_status_route():
+    result, status = get_model_status()
+    return jsonify(result), status
@@ -0,0 +1,21 @@
+# app/controllers/socket_controller.py
+
+from flask_socketio import join_room, leave_room, emit
+
+from app import socketio
+
+# Clients join the room of a chat to receive the progress of its pipelines
+# ("routing", "task_done", "token", "formatted", "graph" and "message" events, or "cancelled" when the chat was
+# deleted or a newer message superseded the pipeline).
+
+@socketio.on('join')
+def join_chat(data):
+    if not data or 'chat_id' not in data:
+        emit('error', {'error': 'Missing required field: chat_id'})
+        return
+    join_room(str(data['chat_id']))
+
+@socketio.on('leave')
+def leave_chat(data):
+    if data and 'chat_id' in data:
+        leave_room(str(data['chat_id']))
@@ -0,0 +1,136 @@
+# app/jobs.py
+
+import atexit
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+class QueueFullError(Exception):
+    """Raised when every worker is busy and the backlog is at capacity."""
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+class JobQueue:
+    """
+    Bounded worker pool for the chat pipelines.
+
+    At most PIPELINE_WORKERS jobs run at once and at most PIPELINE_QUEUE_SIZE more wait for a worker;
+    beyond that reserve() raises QueueFullError so the caller can answer 503 instead of piling up crews.
+    Each job is tracked as queued -> running -> done/failed/cancelled for the status endpoint. Work that waits for
+    another job instead of running on the pool (a coalesced message) is recorded with track() and finish().
+    """
+
+    def __init__(self, app=None):
+        self.executor = None
+        self.history_size = 0
+        self.jobs = OrderedDict()
+        self._slots = None
+        self._closed = False
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        workers = app.config.get('PIPELINE_WORKERS', 2)
+        queue_size = app.config.get('PIPELINE_QUEUE_SIZE', 16)
+        self.history_size = app.config.get('PIPELINE_JOB_HISTORY', 1000)
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pipeline')
+        atexit.register(self.shutdown)
+
+    def reserve(self, chat_id, job=None):
+        """
+        Claim a slot for a new job, or for a tracked job that has to run on the pool after all, raising
+        QueueFullError when there is none left.
+        """
+        if self._closed or not self._slots.acquire(blocking=False):
+            raise QueueFullError()
+        if job is not None:
+            job['status'] = 'queued'
+            return job
+        job = {
+            '_id': uuid.uuid4().hex,
+            'chat_id': str(chat_id),
+            'status': 'queued',
+            'created_at': _now(),
+        }
+        with self._lock:
+            self.jobs[job['_id']] = job
+        return job
+
+    def track(self, chat_id):
+        """
+        Record a running job that takes no slot of the pool; it ends with finish().
+        """
+        now = _now()
+        job = {
+            '_id': uuid.uuid4().hex,
+            'chat_id': str(chat_id),
+            'status': 'running',
+            'created_at': now,
+            'started_at': now,
+        }
+        with self._lock:
+            self.jobs[job['_id']] = job
+        return job
+
+    def finish(self, job, status, **fields):
+        job.update(fields)
+        job['status'] = status
+        job['finished_at'] = _now()
+        self._trim_history()
+
+    def release(self, job):
+        """
+        Give back the slot of a reserved job that will not be started.
+        """
+        with self._lock:
+            self.jobs.pop(job['_id'], None)
+        self._slots.release()
+
+    def start(self, job, target, *args, deadline=None):
+        """
+        Hand a reserved job to the pool. A job whose deadline is cancelled while it runs ends "cancelled".
+        """
+        self.executor.submit(self._run, job, target, args, deadline)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _run(self, job, target, args, deadline=None):
+        job['status'] = 'running'
+        job['started_at'] = _now()
+        try:
+            target(*args)
+            # The pipeline reports a cancellation to the chat and returns normally.
+            if deadline is not None and deadline.cancelled:
+                self.finish(job, 'cancelled', cancel_reason=deadline.reason)
+            else:
+                self.finish(job, 'done')
+        except Exception as e:
+            print("Pipeline job failed:", job['_id'], str(e))
+            self.finish(job, 'failed', error=str(e))
+        finally:
+            self._slots.release()
+
+    def _trim_history(self):
+        with self._lock:
+            finished = [job_id for job_id, job in self.jobs.items() if job['status'] in ('done', 'failed', 'cancelled')]
+            for job_id in finished[:max(0, len(self.jobs) - self.history_size)]:
+                del self.jobs[job_id]
+
+    def shutdown(self, wait=True):
+        """
+        Stop accepting jobs and, by default, wait for the queued and running ones to finish.
+        """
+        self._closed = True
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait)
@@ -0,0 +1,48 @@
+# app/pipeline_registry.py
+
+import threading
+
+
+class PipelineRegistry:
+    """
+    Deadlines (deadlines.Deadline) of the pipelines queued or running in this process, by chat, so that deleting a
+    chat or sending it a newer message can cancel them. Cancellation is cooperative: the pipeline stops at its next
+    task or LLM token.
+    """
+
+    def __init__(self):
+        self.pipelines = {}
+        self._lock = threading.Lock()
+
+    def register(self, chat_id, deadline):
+        with self._lock:
+            self.pipelines.setdefault(str(chat_id), set()).add(deadline)
+
+    def unregister(self, chat_id, deadline):
+        with self._lock:
+            deadlines = self.pipelines.get(str(chat_id))
+            if deadlines is not None:
+                deadlines.discard(deadline)
+                if not deadlines:
+                    del self.pipelines[str(chat_id)]
+
+    def cancel(self, chat_id, reason):
+        """
+        Cancel the pipelines of a chat; returns how many there were.
+        """
+        with self._lock:
+            deadlines = self.pipelines.pop(str(chat_id), set())
+        for deadline in deadlines:
+            deadline.cancel(reason)
+        return len(deadlines)
+
+    def cancel_all(self, reason):
+        with self._lock:
+            deadlines = [deadline for chat_deadlines in self.pipelines.values() for deadline in chat_deadlines]
+            self.pipelines.clear()
+        for deadline in deadlines:
+            deadline.cancel(reason)
+        return len(deadlines)
+
+    def __len__(self):
+        return sum(len(deadlines) for deadlines in self.pipelines.values())
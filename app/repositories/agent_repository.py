@@ -1,34 +1,68 @@
 # app/repositories/agent_repository.py
 
-from app import mongo
+from app import mongo, agent_catalog
 from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from metrics import timed
 
 def transform_doc(doc):
     doc['_id'] = str(doc['_id'])
     return doc
 
+@timed('agents.insert_agent')
 def insert_agent(agent_doc):
     result = mongo.db.agents.insert_one(agent_doc)
+    agent_catalog.invalidate()
     agent_doc['_id'] = str(result.inserted_id)
     return agent_doc
 
+@timed('agents.insert_agents')
+def insert_agents(agent_docs):
+    """Insert a batch in one unordered round trip; returns the inserted docs and {position: error} for the rest."""
+    failed = {}
+    try:
+        mongo.db.agents.insert_many(agent_docs, ordered=False)
+    except BulkWriteError as e:
+        failed = {error['index']: error.get('errmsg', 'Insert failed') for error in e.details.get('writeErrors', [])}
+    agent_catalog.invalidate()
+    inserted = []
+    for position, agent_doc in enumerate(agent_docs):
+        if position not in failed:
+            inserted.append(transform_doc(agent_doc))
+    return inserted, failed
+
+@timed('agents.find_agents')
 def find_agents():
     agents_cursor = mongo.db.agents.find()
     return [transform_doc(agent) for agent in agents_cursor]
 
+def find_cached_agents():
+    return agent_catalog.get(find_agents)
+
+@timed('agents.find_agent_by_id')
 def find_agent_by_id(agent_id):
     agent = mongo.db.agents.find_one({"_id": ObjectId(agent_id)})
     if agent:
         return transform_doc(agent)
     return None
 
+@timed('agents.update_agent_by_id')
 def update_agent_by_id(agent_id, update_data):
     result = mongo.db.agents.update_one({"_id": ObjectId(agent_id)}, {"$set": update_data})
+    agent_catalog.invalidate()
     if result.matched_count == 0:
         return None
     agent = mongo.db.agents.find_one({"_id": ObjectId(agent_id)})
     return transform_doc(agent)
 
+@timed('agents.delete_agent_by_id')
 def delete_agent_by_id(agent_id):
     result = mongo.db.agents.delete_one({"_id": ObjectId(agent_id)})
+    agent_catalog.invalidate()
     return result.deleted_count > 0
+
+def watch_agent_changes(on_change):
+    """Call on_change for every change to the agents collection (blocks; needs a replica set)."""
+    with mongo.db.agents.watch() as stream:
+        for _ in stream:
+            on_change()
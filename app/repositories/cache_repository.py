@@ -0,0 +1,30 @@
+# app/repositories/cache_repository.py
+
+from datetime import datetime
+
+from app import mongo
+from metrics import timed
+
+_indexes_ready = False
+
+def ensure_cache_indexes():
+    """Let Mongo drop expired results by itself."""
+    global _indexes_ready
+    if not _indexes_ready:
+        mongo.db.result_cache.create_index('expires_at', expireAfterSeconds=0)
+        _indexes_ready = True
+
+@timed('result_cache.find_cached_result')
+def find_cached_result(key):
+    # The TTL monitor only runs every minute, so expired documents are filtered out here as well.
+    return mongo.db.result_cache.find_one({"_id": key, "expires_at": {"$gt": datetime.utcnow()}})
+
+@timed('result_cache.upsert_cached_result')
+def upsert_cached_result(key, cache_doc):
+    ensure_cache_indexes()
+    mongo.db.result_cache.replace_one({"_id": key}, cache_doc, upsert=True)
+
+@timed('result_cache.delete_all_cached_results')
+def delete_all_cached_results():
+    result = mongo.db.result_cache.delete_many({})
+    return result.deleted_count
@@ -2,37 +2,160 @@
 
 from app import mongo
 from bson import ObjectId
+from pymongo import ReturnDocument
+from metrics import timed
 
 def transform_doc(doc):
     doc['_id'] = str(doc['_id'])
     return doc
 
+def summary_fields(messages):
+    """Denormalized fields the chat listing reads instead of the message array."""
+    last = messages[-1] if messages else {}
+    return {"message_count": len(messages), "last_message": last.get("message"), "last_owner": last.get("owner")}
+
+_summaries_ready = False
+
+def backfill_chat_summaries(chat_id=None):
+    """
+    Add the summary fields to chats created before they existed: to every chat once per process, or to one chat.
+    Returns the number of chats updated.
+    """
+    global _summaries_ready
+    if chat_id is None and _summaries_ready:
+        return 0
+    match = {"message_count": {"$exists": False}}
+    if chat_id is not None:
+        match["_id"] = ObjectId(chat_id)
+    legacy_chats = mongo.db.chats.aggregate([
+        {"$match": match},
+        {"$project": {
+            "messages": {"$slice": [{"$ifNull": ["$messages", []]}, -1]},
+            "message_count": {"$size": {"$ifNull": ["$messages", []]}},
+        }},
+    ])
+    updated = 0
+    for chat in legacy_chats:
+        fields = summary_fields(chat['messages'])
+        fields['message_count'] = chat['message_count']
+        result = mongo.db.chats.update_one({"_id": chat['_id'], "message_count": {"$exists": False}}, {"$set": fields})
+        updated += result.modified_count
+    if chat_id is None:
+        _summaries_ready = True
+    return updated
+
+@timed('chats.insert_chat')
 def insert_chat(chat_doc):
+    chat_doc.update(summary_fields(chat_doc.get('messages', [])))
     result = mongo.db.chats.insert_one(chat_doc)
     chat_doc['_id'] = str(result.inserted_id)
     return chat_doc
 
+@timed('chats.find_chats')
 def find_chats():
     chats_cursor = mongo.db.chats.find()
     return [transform_doc(chat) for chat in chats_cursor]
 
+@timed('chats.find_chat_summaries')
+def find_chat_summaries(after=None, limit=50):
+    """
+    Newest chats first, keyset-paginated on _id. Only the denormalized summary fields are read, never the messages,
+    so the cost does not depend on the length of the histories.
+    """
+    backfill_chat_summaries()
+    match = {"_id": {"$lt": ObjectId(after)}} if after else {}
+    summaries = mongo.db.chats.find(
+        match,
+        projection={"title": 1, "updated_at": 1, "message_count": 1, "last_message": 1, "last_owner": 1},
+        sort=[("_id", -1)],
+        limit=limit,
+    )
+    # Empty chats have no last message.
+    return [
+        transform_doc({field: value for field, value in summary.items() if value is not None})
+        for summary in summaries
+    ]
+
+@timed('chats.find_chat_messages')
+def find_chat_messages(chat_id, before=None, limit=50):
+    """The chat with a window of `limit` messages ending right before index `before` (the latest ones by default)."""
+    if before is None:
+        window = {"$slice": ["$messages", -limit]}
+    elif before <= 0:
+        window = {"$literal": []}
+    else:
+        start = max(0, before - limit)
+        window = {"$slice": ["$messages", start, before - start]}
+    chats = list(mongo.db.chats.aggregate([
+        {"$match": {"_id": ObjectId(chat_id)}},
+        {"$project": {
+            "title": 1,
+            "updated_at": 1,
+            "message_count": {"$size": {"$ifNull": ["$messages", []]}},
+            "messages": window,
+        }},
+    ]))
+    if chats:
+        return transform_doc(chats[0])
+    return None
+
+@timed('chats.find_chat_by_id')
 def find_chat_by_id(chat_id):
     chat = mongo.db.chats.find_one({"_id": ObjectId(chat_id)})
     if chat:
         return transform_doc(chat)
     return None
 
+@timed('chats.update_chat_by_id')
 def update_chat_by_id(chat_id, update_data):
+    if 'messages' in update_data:
+        update_data = {**update_data, **summary_fields(update_data['messages'])}
     result = mongo.db.chats.update_one({"_id": ObjectId(chat_id)}, {"$set": update_data})
     if result.matched_count == 0:
         return None
     chat = mongo.db.chats.find_one({"_id": ObjectId(chat_id)})
     return transform_doc(chat)
 
+@timed('chats.push_message')
+def push_message(chat_id, message):
+    """
+    Atomically append one message; the cost does not depend on the length of the history. Returns the chat's _id,
+    message_count and the appended message only (under "messages"), or None when the chat does not exist.
+    A message with a job_id is appended once: None is returned when the chat already holds that job's message.
+    """
+    chat = _push_message(chat_id, message)
+    # A chat created before the summary fields existed gets them first, or its count would start from 0.
+    if chat is None and backfill_chat_summaries(chat_id):
+        chat = _push_message(chat_id, message)
+    if chat:
+        return transform_doc(chat)
+    return None
+
+def _push_message(chat_id, message):
+    query = {"_id": ObjectId(chat_id), "message_count": {"$exists": True}}
+    if message.get('job_id'):
+        query["messages.job_id"] = {"$ne": message['job_id']}
+    return mongo.db.chats.find_one_and_update(
+        query,
+        {
+            "$push": {"messages": message},
+            "$inc": {"message_count": 1},
+            "$set": {
+                "updated_at": message['timestamp'],
+                "last_message": message.get('message'),
+                "last_owner": message.get('owner'),
+            },
+        },
+        projection={"messages": {"$slice": -1}, "message_count": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+
+@timed('chats.delete_chat_by_id')
 def delete_chat_by_id(chat_id):
     result = mongo.db.chats.delete_one({"_id": ObjectId(chat_id)})
     return result.deleted_count > 0
 
+@timed('chats.delete_all_chats')
 def delete_all_chats():
     result = mongo.db.chats.delete_many({})
     return result.deleted_count
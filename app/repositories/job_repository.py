@@ -0,0 +1,138 @@
+# app/repositories/job_repository.py
+
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, ReturnDocument
+
+from app import mongo
+from metrics import timed
+
+_indexes_ready = False
+
+def ensure_job_indexes():
+    """Index the claim query and let Mongo drop finished jobs by itself (dead jobs are kept)."""
+    global _indexes_ready
+    if not _indexes_ready:
+        mongo.db.pipeline_jobs.create_index([('status', ASCENDING), ('available_at', ASCENDING)])
+        mongo.db.pipeline_jobs.create_index([('status', ASCENDING), ('lease_expires_at', ASCENDING)])
+        mongo.db.pipeline_jobs.create_index('expires_at', expireAfterSeconds=0)
+        _indexes_ready = True
+
+@timed('pipeline_jobs.insert_job')
+def insert_job(job_doc):
+    ensure_job_indexes()
+    mongo.db.pipeline_jobs.insert_one(job_doc)
+    return job_doc
+
+@timed('pipeline_jobs.find_job')
+def find_job(job_id):
+    return mongo.db.pipeline_jobs.find_one({"_id": job_id})
+
+@timed('pipeline_jobs.count_pending_jobs')
+def count_pending_jobs():
+    return mongo.db.pipeline_jobs.count_documents({"status": {"$in": ["queued", "running"]}})
+
+@timed('pipeline_jobs.claim_job')
+def claim_job(worker_id, lease_seconds, max_attempts):
+    """
+    Atomically take the oldest available job: a queued one whose retry time has come, or a running one whose
+    worker let its lease expire (and that has attempts left).
+    """
+    now = datetime.utcnow()
+    return mongo.db.pipeline_jobs.find_one_and_update(
+        {"$or": [
+            {"status": "queued", "available_at": {"$lte": now}},
+            {"status": "running", "lease_expires_at": {"$lt": now}, "attempts": {"$lt": max_attempts}},
+        ]},
+        {
+            "$set": {
+                "status": "running",
+                "worker": worker_id,
+                "started_at": now,
+                "lease_expires_at": now + timedelta(seconds=lease_seconds),
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("available_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+@timed('pipeline_jobs.extend_job_lease')
+def extend_job_lease(job_id, worker_id, lease_seconds):
+    """
+    Returns the job (with its cancel_reason once it was cancelled), or None when the worker no longer holds it
+    (its lease expired and another worker took it).
+    """
+    return mongo.db.pipeline_jobs.find_one_and_update(
+        {"_id": job_id, "worker": worker_id, "status": "running"},
+        {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=lease_seconds)}},
+        projection={"cancel_reason": True},
+        return_document=ReturnDocument.AFTER,
+    )
+
+@timed('pipeline_jobs.cancel_jobs')
+def cancel_jobs(chat_id, reason, history_seconds):
+    """
+    Cancel the queued jobs of a chat (of every chat when chat_id is None) and flag its running ones, which their
+    worker stops at its next lease renewal. Returns the number of jobs affected.
+    """
+    query = {} if chat_id is None else {"chat_id": str(chat_id)}
+    now = datetime.utcnow()
+    queued = mongo.db.pipeline_jobs.update_many(
+        {**query, "status": "queued"},
+        {"$set": {"status": "cancelled", "cancel_reason": reason, "finished_at": now,
+                  "expires_at": now + timedelta(seconds=history_seconds)}},
+    )
+    running = mongo.db.pipeline_jobs.update_many(
+        {**query, "status": "running"},
+        {"$set": {"cancel_reason": reason}},
+    )
+    return queued.modified_count + running.modified_count
+
+@timed('pipeline_jobs.finish_job')
+def finish_job(job_id, worker_id, history_seconds):
+    now = datetime.utcnow()
+    mongo.db.pipeline_jobs.update_one(
+        {"_id": job_id, "worker": worker_id, "status": "running"},
+        {"$set": {"status": "done", "finished_at": now, "expires_at": now + timedelta(seconds=history_seconds)},
+         "$unset": {"lease_expires_at": ""}},
+    )
+
+@timed('pipeline_jobs.finish_cancelled_job')
+def finish_cancelled_job(job_id, worker_id, reason, history_seconds):
+    """
+    Record that a running job stopped because it was cancelled.
+    """
+    now = datetime.utcnow()
+    mongo.db.pipeline_jobs.update_one(
+        {"_id": job_id, "worker": worker_id, "status": "running"},
+        {"$set": {"status": "cancelled", "cancel_reason": reason, "finished_at": now,
+                  "expires_at": now + timedelta(seconds=history_seconds)},
+         "$unset": {"lease_expires_at": ""}},
+    )
+
+@timed('pipeline_jobs.retry_job')
+def retry_job(job_id, worker_id, error, available_at):
+    mongo.db.pipeline_jobs.update_one(
+        {"_id": job_id, "worker": worker_id},
+        {"$set": {"status": "queued", "error": error, "available_at": available_at},
+         "$unset": {"lease_expires_at": "", "worker": ""}},
+    )
+
+@timed('pipeline_jobs.dead_letter_job')
+def dead_letter_job(job_id, worker_id, error):
+    mongo.db.pipeline_jobs.update_one(
+        {"_id": job_id, "worker": worker_id},
+        {"$set": {"status": "dead", "error": error, "finished_at": datetime.utcnow()},
+         "$unset": {"lease_expires_at": "", "expires_at": ""}},
+    )
+
+@timed('pipeline_jobs.dead_letter_expired_jobs')
+def dead_letter_expired_jobs(max_attempts):
+    """Jobs whose last attempt lost its worker (crash, kill) are given up instead of being claimed again."""
+    result = mongo.db.pipeline_jobs.update_many(
+        {"status": "running", "lease_expires_at": {"$lt": datetime.utcnow()}, "attempts": {"$gte": max_attempts}},
+        {"$set": {"status": "dead", "error": "Worker lease expired", "finished_at": datetime.utcnow()},
+         "$unset": {"lease_expires_at": "", "expires_at": ""}},
+    )
+    return result.modified_count
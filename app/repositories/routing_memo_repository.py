@@ -0,0 +1,27 @@
+# app/repositories/routing_memo_repository.py
+
+from app import mongo
+from metrics import timed
+
+@timed('routing_memo.find_routing_memo_entries')
+def find_routing_memo_entries(limit):
+    cursor = mongo.db.routing_memo.find().sort('last_used', -1).limit(limit)
+    return list(cursor)
+
+@timed('routing_memo.upsert_routing_memo_entry')
+def upsert_routing_memo_entry(entry_doc):
+    mongo.db.routing_memo.replace_one({"_id": entry_doc['_id']}, entry_doc, upsert=True)
+
+@timed('routing_memo.touch_routing_memo_entry')
+def touch_routing_memo_entry(entry_id, last_used):
+    mongo.db.routing_memo.update_one({"_id": entry_id}, {"$set": {"last_used": last_used}})
+
+@timed('routing_memo.delete_routing_memo_entries')
+def delete_routing_memo_entries(entry_ids):
+    if entry_ids:
+        mongo.db.routing_memo.delete_many({"_id": {"$in": list(entry_ids)}})
+
+@timed('routing_memo.delete_all_routing_memo_entries')
+def delete_all_routing_memo_entries():
+    result = mongo.db.routing_memo.delete_many({})
+    return result.deleted_count
@@ -0,0 +1,76 @@
+# app/routing_memo.py
+
+import threading
+import time
+
+import numpy as np
+
+
+class RoutingMemo:
+    """
+    Bounded in-memory nearest-neighbour index of past routing decisions (message vector -> agent ids).
+    Holds at most ROUTING_MEMO_SIZE entries and evicts the least recently used one when full.
+    """
+
+    def __init__(self, app=None):
+        self.max_size = 5000
+        self.threshold = 0.8
+        self.keys = []
+        self.entries = {}
+        self.vectors = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_size = app.config.get('ROUTING_MEMO_SIZE', self.max_size)
+        self.threshold = app.config.get('ROUTING_MEMO_THRESHOLD', self.threshold)
+
+    def nearest(self, vector, catalog):
+        """
+        Return (entry, similarity) of the most similar message routed against the same catalog, or (None, 0).
+        Only matches at or above the threshold are returned.
+        """
+        with self._lock:
+            if not self.keys:
+                return None, 0.0
+            similarities = self.vectors[:len(self.keys)] @ vector
+            for index in np.argsort(-similarities):
+                if similarities[index] < self.threshold:
+                    break
+                entry = self.entries[self.keys[index]]
+                if entry['catalog'] == catalog:
+                    entry['last_used'] = time.time()
+                    return entry, float(similarities[index])
+            return None, 0.0
+
+    def add(self, entry, vector):
+        """
+        Insert or replace an entry; returns the keys evicted to stay within the size bound.
+        """
+        evicted = []
+        with self._lock:
+            if self.vectors is None or self.vectors.shape[1] != len(vector):
+                self.vectors = np.zeros((self.max_size, len(vector)), dtype=np.float32)
+                self.keys, self.entries = [], {}
+            key = entry['_id']
+            if key in self.entries:
+                index = self.keys.index(key)
+            elif len(self.keys) < self.max_size:
+                index = len(self.keys)
+                self.keys.append(key)
+            else:
+                index = min(range(len(self.keys)), key=lambda i: self.entries[self.keys[i]]['last_used'])
+                evicted.append(self.keys[index])
+                del self.entries[self.keys[index]]
+                self.keys[index] = key
+            self.entries[key] = entry
+            self.vectors[index] = vector
+        return evicted
+
+    def clear(self):
+        with self._lock:
+            self.keys, self.entries, self.vectors = [], {}, None
+
+    def __len__(self):
+        return len(self.keys)
@@ -1,62 +1,93 @@
 # app/services/agent_service.py
 
+from itertools import islice
+from types import GeneratorType
+
 from app.repositories.agent_repository import (
     insert_agent,
-    find_agents,
+    insert_agents,
+    find_cached_agents,
     find_agent_by_id,
     update_agent_by_id,
     delete_agent_by_id,
 )
+from app.services.cache_service import invalidate_results
 
-def create_agent(data):
+def build_agent_doc(data):
     required_fields = ['title', 'role', 'goals', 'backstory']
-    if not data or not all(field in data for field in required_fields):
-        return {'error': 'Missing required fields: title, role, goals, backstory'}, 400
-
-    agent_doc = {
+    if not isinstance(data, dict) or not all(field in data for field in required_fields):
+        return None
+    return {
         "title": data['title'],
         "role": data['role'],
         "goals": data['goals'],
         "backstory": data['backstory'],
         "docs": data.get('docs', '')
     }
+
+
+def create_agent(data):
+    agent_doc = build_agent_doc(data)
+    if not agent_doc:
+        return {'error': 'Missing required fields: title, role, goals, backstory'}, 400
+
     inserted_agent = insert_agent(agent_doc)
+    invalidate_results()
     return inserted_agent, 201
 
 
-def create_agents(data_list):
-    required_fields = ['title', 'role', 'goals', 'backstory']
-
-    if not isinstance(data_list, list):
+def create_agents(data_list, batch_size=500, include_agents=True):
+    """
+    Validate the agents and insert them in unordered batches of batch_size (one round trip per batch).
+    data_list is either a list of agents or a generator of (index, agent) pairs (read_ndjson), which lets streamed
+    bodies be consumed one batch at a time; an exception in place of the agent is reported as that index's error.
+    """
+    if isinstance(data_list, list):
+        data_list = enumerate(data_list)
+    elif not isinstance(data_list, GeneratorType):
         return {'error': 'Expected a list of agents'}, 400
 
     agents = []
     errors = []
-
-    for index, data in enumerate(data_list):
-        if not all(field in data for field in required_fields):
-            errors.append({'index': index, 'error': 'Missing required fields: title, role, goals, backstory'})
+    inserted_count = 0
+
+    while True:
+        batch = list(islice(data_list, batch_size))
+        if not batch:
+            break
+        agent_docs, positions = [], []
+        for index, data in batch:
+            if isinstance(data, Exception):
+                errors.append({'index': index, 'error': f'Invalid JSON: {data}'})
+                continue
+            agent_doc = build_agent_doc(data)
+            if not agent_doc:
+                errors.append({'index': index, 'error': 'Missing required fields: title, role, goals, backstory'})
+                continue
+            agent_docs.append(agent_doc)
+            positions.append(index)
+        if not agent_docs:
             continue
 
-        agent_doc = {
-            "title": data['title'],
-            "role": data['role'],
-            "goals": data['goals'],
-            "backstory": data['backstory'],
-            "docs": data.get('docs', '')
-        }
-        inserted_agent = insert_agent(agent_doc)
-        agents.append(inserted_agent)
-
-    response = {"agents": agents}
+        inserted, failed = insert_agents(agent_docs)
+        inserted_count += len(inserted)
+        if include_agents:
+            agents.extend(inserted)
+        errors.extend({'index': positions[position], 'error': error} for position, error in failed.items())
+
+    if inserted_count:
+        invalidate_results()
+    response = {"inserted": inserted_count}
+    if include_agents:
+        response["agents"] = agents
     if errors:
-        response["errors"] = errors
+        response["errors"] = sorted(errors, key=lambda error: error['index'])
 
-    return response, 201 if agents else 400
+    return response, 201 if inserted_count else 400
 
 
 def get_agents():
-    agents = find_agents()
+    agents = find_cached_agents()
     return agents, 200
 
 def get_agent(agent_id):
@@ -79,6 +110,7 @@ def update_agent(agent_id, data):
         return {'error': 'Invalid agent ID'}, 400
     if not updated:
         return {'error': 'Agent not found'}, 404
+    invalidate_results()
     return updated, 200
 
 def delete_agent(agent_id):
@@ -88,4 +120,5 @@ def delete_agent(agent_id):
         return {'error': 'Invalid agent ID'}, 400
     if not deleted:
         return {'error': 'Agent not found'}, 404
+    invalidate_results()
     return {'result': 'Agent deleted'}, 200
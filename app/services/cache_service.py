@@ -0,0 +1,107 @@
+# app/services/cache_service.py
+import hashlib
+import json
+import threading
+from datetime import datetime, timedelta
+
+from app import result_cache
+from app.services.routing_memo_service import get_routing_memo_stats, invalidate_routing_memo
+from app.repositories.cache_repository import (
+    find_cached_result,
+    upsert_cached_result,
+    delete_all_cached_results,
+)
+from metrics import record_cache_lookup
+from utils import catalog_fingerprint, normalize_message
+
+# Exact-match cache of finished pipelines (formatted result + flow graph): an in-process LRU in front of the
+# Mongo "result_cache" collection. Keys include the catalog fingerprint, so a changed catalog never serves stale
+# answers, and agent writes also clear both tiers explicitly.
+
+# Message keys that change what the pipeline produces: part of the cache key, so a message is only answered from
+# (or coalesced with, see chat_service.run_pipeline) a run made with the same options.
+PIPELINE_OPTIONS = ('routing_mode', 'execution_mode', 'agent_concurrency', 'flow_mode', 'output_mode', 'formatter_mode')
+
+_stats = {'memory_hits': 0, 'mongo_hits': 0, 'misses': 0, 'stores': 0, 'invalidations': 0}
+_stats_lock = threading.Lock()
+
+def _count(counter):
+    with _stats_lock:
+        _stats[counter] += 1
+
+def result_cache_key(message, agents):
+    normalized = normalize_message(message['message'])
+    options = json.dumps({option: message[option] for option in PIPELINE_OPTIONS if option in message}, sort_keys=True)
+    return hashlib.sha256(f"{catalog_fingerprint(agents)}\n{options}\n{normalized}".encode('utf-8')).hexdigest()
+
+def get_cached_result(message, agents):
+    """
+    Return the cached {'result', 'graph'} for the message, or None.
+    """
+    key = result_cache_key(message, agents)
+    cached = result_cache.get(key)
+    if cached is not None:
+        _count('memory_hits')
+        record_cache_lookup('result', True)
+        return cached
+    try:
+        cache_doc = find_cached_result(key)
+    except Exception as e:
+        print("Result cache lookup failed:", e)
+        cache_doc = None
+    if not cache_doc:
+        _count('misses')
+        record_cache_lookup('result', False)
+        return None
+    _count('mongo_hits')
+    record_cache_lookup('result', True)
+    cached = {'result': cache_doc['result'], 'graph': cache_doc['graph']}
+    remaining = (cache_doc['expires_at'] - datetime.utcnow()).total_seconds()
+    result_cache.set(key, cached, ttl=max(0, remaining))
+    return cached
+
+def store_result(message, agents, result, graph):
+    """
+    Cache a successful pipeline run; results or graphs that carry an error are not cached.
+    """
+    if 'error' in result or 'error' in graph:
+        return
+    key = result_cache_key(message, agents)
+    cached = {'result': result, 'graph': graph}
+    result_cache.set(key, cached)
+    now = datetime.utcnow()
+    try:
+        upsert_cached_result(key, {
+            '_id': key,
+            **cached,
+            'created_at': now,
+            'expires_at': now + timedelta(seconds=result_cache.ttl),
+        })
+    except Exception as e:
+        print("Result cache store failed:", e)
+    _count('stores')
+
+def invalidate_results():
+    """
+    Drop every cached result and routing decision, called whenever the agent catalog changes.
+    """
+    result_cache.clear()
+    delete_all_cached_results()
+    invalidate_routing_memo()
+    _count('invalidations')
+
+def get_cache_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats['memory_hits'] + stats['mongo_hits'] + stats['misses']
+    stats['hit_ratio'] = (stats['memory_hits'] + stats['mongo_hits']) / lookups if lookups else 0.0
+    stats['memory_entries'] = len(result_cache)
+    stats['routing_memo'] = get_routing_memo_stats()
+    return stats, 200
+
+def clear_cache():
+    try:
+        invalidate_results()
+    except Exception:
+        return {'error': 'Failed to clear the cache'}, 500
+    return {'result': 'Cache cleared'}, 200
@@ -1,18 +1,47 @@
 # app/services/chat_service.py
+import copy
 import json
 import threading
 from datetime import datetime
 
+from flask import current_app
 
-from Agents import run_orchestrator, run_flow_agent
+from Agents import run_orchestrator, run_flow_agent, refresh_agent_pool, partial_result
+from app import pipeline_jobs, pipeline_flights, running_pipelines, socketio, agent_catalog
+from app.jobs import QueueFullError
 from app.repositories.chat_repository import (
     insert_chat,
-    find_chats,
-    find_chat_by_id,
+    find_chat_summaries,
+    find_chat_messages,
     update_chat_by_id,
+    push_message,
     delete_chat_by_id, delete_all_chats,
 )
 from app.services.agent_service import get_agents
+from app.services.cache_service import get_cached_result, store_result, result_cache_key
+from app.services.job_service import cancel_queued_jobs, enqueue_job, get_queued_job, job_queue_full
+from app.services.routing_memo_service import lookup_agent_ids, remember_agent_ids
+from deadlines import Deadline, DeadlineExceeded, PipelineCancelled, current_deadline, use_deadline
+from metrics import Trace, record_cache_lookup, span, use_trace
+
+# How often a message that joined another one's pipeline checks whether it was cancelled meanwhile.
+FLIGHT_POLL_SECONDS = 0.5
+
+# Graph of an answer built from the specialists that finished in time.
+PARTIAL_GRAPH = {'error': 'Workflow graph skipped, the answer ran out of time'}
+
+# Pooled crewai Agents and docs indexes of deleted or edited catalog entries are dropped whenever the catalog reloads.
+agent_catalog.on_reload(refresh_agent_pool)
+
+
+class PipelineFailed(Exception):
+    """
+    The orchestrator answered with an error (e.g. the LLM is unreachable); the job fails so that it can be retried.
+    """
+
+    def __init__(self, error):
+        super().__init__(error)
+        self.error = error
 
 
 def create_chat(data):
@@ -20,22 +49,64 @@ def create_chat(data):
         return {'error': 'Missing required field: title'}, 400
     chat_doc = {
         "title": data['title'],
-        "messages": data.get('messages', [])
+        "messages": data.get('messages', []),
+        "updated_at": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     }
     inserted_chat = insert_chat(chat_doc)
     return inserted_chat, 201
 
-def get_chats():
-    chats = find_chats()
-    return chats, 200
+def parse_limit(limit):
+    if limit is None:
+        return current_app.config['CHAT_PAGE_SIZE']
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return None
+    return limit if 0 < limit <= current_app.config['CHAT_PAGE_MAX_SIZE'] else None
+
+def limit_error():
+    return {'error': f"limit must be between 1 and {current_app.config['CHAT_PAGE_MAX_SIZE']}"}, 400
+
+def preview(message):
+    if isinstance(message, dict) and isinstance(message.get('result'), str):
+        message = message['result']
+    text = message if isinstance(message, str) else json.dumps(message)
+    length = current_app.config['CHAT_PREVIEW_LENGTH']
+    if len(text) > length:
+        return text[:length].rstrip() + '…'
+    return text
 
-def get_chat(chat_id):
+def get_chats(after=None, limit=None):
+    limit = parse_limit(limit)
+    if limit is None:
+        return limit_error()
     try:
-        chat = find_chat_by_id(chat_id)
+        chats = find_chat_summaries(after, limit)
+    except Exception:
+        return {'error': 'Invalid cursor'}, 400
+    for chat in chats:
+        if 'last_message' in chat:
+            chat['last_message'] = preview(chat['last_message'])
+    next_after = chats[-1]['_id'] if len(chats) == limit else None
+    return {'chats': chats, 'next': next_after}, 200
+
+def get_chat(chat_id, before=None, limit=None):
+    limit = parse_limit(limit)
+    if limit is None:
+        return limit_error()
+    try:
+        before = int(before) if before is not None else None
+    except (TypeError, ValueError):
+        return {'error': 'before must be a message index (integer)'}, 400
+    try:
+        chat = find_chat_messages(chat_id, before, limit)
     except Exception:
         return {'error': 'Invalid chat ID'}, 400
     if not chat:
         return {'error': 'Chat not found'}, 404
+    # Index of the first returned message, pass it as `before` to load the previous page.
+    end = chat['message_count'] if before is None else min(before, chat['message_count'])
+    chat['first_index'] = max(0, end - len(chat['messages']))
     return chat, 200
 
 def update_chat(chat_id, data):
@@ -53,50 +124,333 @@ def update_chat(chat_id, data):
     return updated, 200
 
 def send_message(chat_id, data):
+    """
+    Append the user's message and start its pipeline. The response is {'_id', 'message', 'message_count', 'job_id'}:
+    the stored message, not the whole chat (load the history with GET /chat/<id>/messages), and the job to poll.
+    """
     if not data or 'message' not in data:
         return {'error': 'Missing required field: message'}, 400
     try:
-        chat = find_chat_by_id(chat_id)
-    except Exception as e:
-        print(e)
-        return {'error': 'Invalid chat ID'}, 400
-    if not chat:
-        return {'error': 'Chat not found'}, 404
+        deadline_seconds = float(data.get('deadline', current_app.config['PIPELINE_DEADLINE']))
+    except (TypeError, ValueError):
+        return {'error': 'deadline must be a number of seconds'}, 400
+    agents = get_agents()[0]
+    trace = bool(data.get('trace', current_app.config['PIPELINE_TRACE']))
+    # With the "mongo" backend the pipeline runs in a worker.py process, otherwise on this process's pool.
+    durable = current_app.config['JOB_BACKEND'] == 'mongo'
+    # An identical message already running here is followed without a worker of the pool. Traced messages run
+    # the pipeline (and join the flight there) so that their trace has its spans.
+    flight = None if durable or trace else pipeline_flights.get(result_cache_key(data, agents))
+    try:
+        if durable:
+            if job_queue_full():
+                raise QueueFullError()
+            job = None
+        elif flight is None:
+            job = pipeline_jobs.reserve(chat_id)
+        else:
+            job = None
+    except QueueFullError:
+        return {'error': 'Too many messages are being processed, please retry later'}, 503
 
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    chat['messages'].append({
-        'message': data['message'],
-        'owner': 'USER',
-        'timestamp': timestamp
-    })
     try:
-        updated_data = {'messages': chat['messages']}
-        updated = update_chat_by_id(chat_id, updated_data)
+        updated = push_message(chat_id, {
+            'message': data['message'],
+            'owner': 'USER',
+            'timestamp': timestamp
+        })
     except Exception as e:
         print(e)
+        if job:
+            pipeline_jobs.release(job)
         return {'error': 'Invalid chat ID'}, 400
     if not updated:
+        if job:
+            pipeline_jobs.release(job)
         return {'error': 'Chat not found'}, 404
-    agents = get_agents()[0]
-    threading.Thread(target=chat_and_publish, args=(chat, data, agents,)).start()
+    # The answer of an older message still being computed is superseded by this one.
+    cancel_pipelines(chat_id, 'superseded by a newer message')
+    deadline_seconds = deadline_seconds if deadline_seconds > 0 else None
+    if durable:
+        job = enqueue_job(chat_id, data, agents, trace, deadline_seconds)
+    elif flight is not None:
+        job = follow_pipeline(chat_id, data, agents, flight, Deadline(deadline_seconds))
+    else:
+        deadline = Deadline(deadline_seconds)
+        running_pipelines.register(chat_id, deadline)
+        pipeline_jobs.start(job, chat_and_publish, chat_id, data, agents, trace, deadline, job['_id'],
+                            deadline=deadline)
 
-    return updated, 200
+    return {
+        '_id': updated['_id'],
+        'message': updated['messages'][-1],
+        'message_count': updated['message_count'],
+        'job_id': job['_id'],
+    }, 200
+
+def get_job(chat_id, job_id):
+    if current_app.config['JOB_BACKEND'] == 'mongo':
+        job = get_queued_job(job_id)
+    else:
+        job = pipeline_jobs.get(job_id)
+    if not job or job['chat_id'] != chat_id:
+        return {'error': 'Job not found'}, 404
+    return job, 200
+
+def publish(chat_id, event, payload):
+    """
+    Push a pipeline event to the clients that joined the chat's room.
+    """
+    socketio.emit(event, {'chat_id': chat_id, **payload}, to=chat_id)
+
+def cancel_pipelines(chat_id, reason):
+    """
+    Cancel the pipelines of a chat (of every chat when chat_id is None), in this process and in the job queue.
+    """
+    if chat_id is None:
+        cancelled = running_pipelines.cancel_all(reason)
+    else:
+        cancelled = running_pipelines.cancel(chat_id, reason)
+    if current_app.config['JOB_BACKEND'] == 'mongo':
+        cancelled += cancel_queued_jobs(chat_id, reason)
+    if cancelled:
+        print("Cancelled", cancelled, "pipelines:", reason)
+    return cancelled
+
+def chat_and_publish(chat_id, message, agents, trace=False, deadline=None, job_id=None, final=True):
+    """
+    Run the pipeline of a message under its deadline; a cancelled pipeline only publishes a "cancelled" event.
+    A failed pipeline raises PipelineFailed; on the job's last attempt (final) its error is stored as the answer first.
+    The answer of a job (job_id) is stored once, however many times the job runs.
+    """
+    deadline = deadline or Deadline()
+    running_pipelines.register(chat_id, deadline)
+    try:
+        with use_trace(Trace() if trace else None) as request_trace, use_deadline(deadline):
+            # The span has to end before the answer is stored to be part of the trace attached to it.
+            with span('pipeline'):
+                if deadline.cancelled:
+                    raise PipelineCancelled(deadline.reason)
+                result, graph = run_pipeline(chat_id, message, agents)
+            publish(chat_id, 'graph', {'graph': graph})
+            answer(chat_id, result, graph, job_id, request_trace)
+    except PipelineCancelled as e:
+        print("Pipeline of chat", chat_id, "cancelled:", e.reason)
+        publish(chat_id, 'cancelled', {'reason': e.reason})
+    except PipelineFailed as e:
+        print("Pipeline of chat", chat_id, "failed:", e.error)
+        if final:
+            answer(chat_id, {'error': e.error}, job_id=job_id)
+        raise
+    finally:
+        running_pipelines.unregister(chat_id, deadline)
 
-def chat_and_publish(chat, message, agents):
-    result = run_orchestrator(message, agents)
+def run_pipeline(chat_id, message, agents):
+    """
+    (result, graph) of a message: from the cache, from an identical pipeline running in this process, or computed.
+    """
+    use_cache = message.get('use_cache', True)
+    cached = get_cached_result(message, agents) if use_cache else None
+    if cached:
+        result, graph = cached['result'], cached['graph']
+        publish(chat_id, 'formatted', {'result': result, 'cached': True})
+    else:
+        # Identical messages (same text, options and catalog) already running in this process are joined instead.
+        key = result_cache_key(message, agents)
 
-    # Step 2: Attempt to Generate Graph
-    graph = run_flow_agent(message, result)
+        def relay(event, payload):
+            publish(chat_id, event, payload)
 
+        while True:
+            flight, leader = pipeline_flights.join(key, relay)
+            record_cache_lookup('single_flight', not leader)
+            if leader:
+                try:
+                    result, graph = run_agents(message, agents, flight.publish, use_cache)
+                except Exception as e:
+                    pipeline_flights.finish(key, flight, error=e)
+                    raise
+                pipeline_flights.finish(key, flight, (result, graph))
+                break
+            try:
+                with span('coalesced'):
+                    result, graph = copy.deepcopy(follow_flight(flight))
+                break
+            except DeadlineExceeded:
+                # This message's budget ran out before the pipeline it joined: answer with what it finished so far.
+                flight.unsubscribe(relay)
+                result, graph = flight_partial_result(message, agents, flight)
+                publish(chat_id, 'formatted', {'result': result})
+                break
+            except PipelineCancelled:
+                if current_deadline() is not None and current_deadline().cancelled:
+                    raise
+                print("The pipeline this message joined was cancelled, running it again")
+    return result, graph
+
+def answer(chat_id, result, graph=None, job_id=None, request_trace=None):
+    """
+    Store the SYSTEM message answering a chat message and publish it. A retried job does not store a second answer.
+    """
     # Step 4: Construct Result Message
     result_message = {
         'message': result,
         'owner': 'SYSTEM',
-        'graph':graph,
         'timestamp': str(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
     }
+    if graph is not None:
+        result_message['graph'] = graph
+    if job_id is not None:
+        result_message['job_id'] = job_id
+    if request_trace is not None:
+        result_message['trace'] = request_trace.to_dict()
+
+    push_message(chat_id, result_message)
+    publish(chat_id, 'message', {'message': result_message})
+
+def follow_pipeline(chat_id, message, agents, flight, deadline):
+    """
+    Answer a message from an identical pipeline running in this process without taking a worker of the pool: the
+    message listens to the leader's flight and is settled by whichever comes first of the leader finishing, its own
+    deadline running out (partial answer, see flight_partial_result) and its cancellation. When the leader was
+    cancelled the message runs its own pipeline on the pool after all. Returns the job tracking the message.
+    """
+    job = pipeline_jobs.track(chat_id)
+    record_cache_lookup('single_flight', True)
+    settled = threading.Event()
+    lock = threading.Lock()
+    timer = None
+
+    def relay(event, payload):
+        publish(chat_id, event, payload)
+
+    def settle():
+        with lock:
+            if settled.is_set():
+                return False
+            settled.set()
+        if timer is not None:
+            timer.cancel()
+        flight.unsubscribe(relay)
+        running_pipelines.unregister(chat_id, deadline)
+        return True
+
+    def fail(error):
+        print("Coalesced message of chat", chat_id, "failed:", error)
+        pipeline_jobs.finish(job, 'failed', error=error)
+        answer(chat_id, {'error': error}, job_id=job['_id'])
+
+    def on_cancel(reason):
+        if settle():
+            print("Pipeline of chat", chat_id, "cancelled:", reason)
+            publish(chat_id, 'cancelled', {'reason': reason})
+            pipeline_jobs.finish(job, 'cancelled', cancel_reason=reason)
+
+    def on_timeout():
+        if not settle():
+            return
+        try:
+            result, graph = flight_partial_result(message, agents, flight)
+            publish(chat_id, 'formatted', {'result': result})
+            publish(chat_id, 'graph', {'graph': graph})
+            answer(chat_id, result, graph, job['_id'])
+            pipeline_jobs.finish(job, 'done')
+        except Exception as e:
+            fail(str(e))
+
+    def on_done(flight):
+        if not settle():
+            return
+        try:
+            result, graph = copy.deepcopy(flight.wait())
+        except PipelineCancelled:
+            print("The pipeline this message joined was cancelled, running it again")
+            try:
+                pipeline_jobs.reserve(chat_id, job)
+            except QueueFullError:
+                fail('Too many messages are being processed, please retry later')
+                return
+            running_pipelines.register(chat_id, deadline)
+            pipeline_jobs.start(job, chat_and_publish, chat_id, message, agents, False, deadline, job['_id'],
+                                deadline=deadline)
+            return
+        except Exception as e:
+            fail(e.error if isinstance(e, PipelineFailed) else str(e))
+            return
+        try:
+            publish(chat_id, 'graph', {'graph': graph})
+            answer(chat_id, result, graph, job['_id'])
+            pipeline_jobs.finish(job, 'done')
+        except Exception as e:
+            fail(str(e))
+
+    running_pipelines.register(chat_id, deadline)
+    remaining = deadline.remaining()
+    if remaining is not None:
+        timer = threading.Timer(remaining, on_timeout)
+        timer.daemon = True
+        timer.start()
+    flight.subscribe(relay)
+    deadline.on_cancel(on_cancel)
+    flight.add_done_callback(on_done)
+    return job
+
+def follow_flight(flight):
+    """
+    Result of a pipeline led by another message; raises PipelineCancelled if this message is cancelled meanwhile and
+    DeadlineExceeded when its own budget runs out before the leader finishes.
+    """
+    deadline = current_deadline()
+    while True:
+        timeout = FLIGHT_POLL_SECONDS
+        if deadline is not None:
+            deadline.check()
+            remaining = deadline.remaining()
+            if remaining is not None:
+                timeout = min(timeout, remaining)
+        if flight.finished(timeout):
+            return flight.wait()
+
+def flight_partial_result(message, agents, flight):
+    """
+    (result, graph) of a message that ran out of time while following another one's pipeline: the outputs of the
+    specialists that pipeline finished so far, as run_orchestrator answers when its own budget runs out.
+    """
+    agent_ids, completed = [], []
+    for event, payload in flight.history():
+        if event == 'routing':
+            agent_ids = payload['agent_ids']
+        elif event == 'task_done':
+            completed.append((payload['agent'], payload['output']))
+    relevant_agents = [agent for agent in agents if agent['_id'] in agent_ids]
+    return partial_result(message['message'], relevant_agents, completed), dict(PARTIAL_GRAPH)
+
+def run_agents(message, agents, on_event, use_cache=True):
+    """
+    Run the crews and the flow agent for a message; returns (result, graph) and caches them when use_cache is on.
+    """
+    agent_ids = lookup_agent_ids(message, agents) if use_cache else None
+
+    def on_routing(event, payload):
+        if event == 'routing' and agent_ids is None:
+            remember_agent_ids(message, agents, payload['agent_ids'])
+        on_event(event, payload)
+
+    result = run_orchestrator(message, agents, on_event=on_routing, agent_ids=agent_ids)
+    # A partial result (out of time) is still an answer, retrying it would not get more time.
+    if 'error' in result and not result.get('partial'):
+        raise PipelineFailed(result['error'])
 
-    update_chat_by_id(chat['_id'], {'messages': chat['messages'] + [result_message]})
+    # Step 2: Attempt to Generate Graph, unless the combined output already holds it or the pipeline ran out of time
+    graph = result.pop('graph', None)
+    if result.get('partial'):
+        graph = dict(PARTIAL_GRAPH)
+    elif graph is None:
+        graph = run_flow_agent(message, result)
+    if use_cache:
+        store_result(message, agents, result, graph)
+    return result, graph
 
 def delete_chat(chat_id):
     try:
@@ -105,6 +459,7 @@ def delete_chat(chat_id):
         return {'error': 'Invalid chat ID'}, 400
     if not deleted:
         return {'error': 'Chat not found'}, 404
+    cancel_pipelines(chat_id, 'chat deleted')
     return {'result': 'Chat deleted'}, 200
 
 
@@ -115,5 +470,6 @@ def delete_chats():
         return {'error': 'Failed to delete chats'}, 500
     if deleted_count == 0:
         return {'error': 'No chats found to delete'}, 404
+    cancel_pipelines(None, 'chats deleted')
     return {'result': f'{deleted_count} chats deleted'}, 200
 
@@ -0,0 +1,119 @@
+# app/services/job_service.py
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+
+from app.repositories.job_repository import (
+    insert_job,
+    find_job,
+    count_pending_jobs,
+    claim_job,
+    extend_job_lease,
+    finish_job,
+    finish_cancelled_job,
+    retry_job,
+    dead_letter_job,
+    dead_letter_expired_jobs,
+    cancel_jobs,
+)
+from deadlines import Deadline
+from utils import catalog_fingerprint
+
+# Durable pipeline jobs (JOB_BACKEND = "mongo"): web nodes enqueue chat messages in the "pipeline_jobs"
+# collection and worker.py processes claim them under a lease they keep renewing while the pipeline runs.
+# A failed job is retried with exponential backoff, then dead-lettered (status "dead") after JOB_MAX_ATTEMPTS;
+# the job of a worker that died is claimed again once its lease expires. Deleting a chat or sending it a newer
+# message cancels its jobs: queued ones are dropped, running ones stop at their next lease renewal.
+
+def job_queue_full():
+    return count_pending_jobs() >= current_app.config['JOB_QUEUE_LIMIT']
+
+def enqueue_job(chat_id, message, agents, trace=False, deadline=None):
+    """
+    Queue the pipeline of a chat message; the catalog fingerprint lets the worker notice a stale agent catalog.
+    deadline is the time budget of the pipeline in seconds (None for none), counted from now.
+    """
+    now = datetime.utcnow()
+    return insert_job({
+        '_id': uuid.uuid4().hex,
+        'chat_id': str(chat_id),
+        'message': message,
+        'catalog': catalog_fingerprint(agents),
+        'trace': trace,
+        'deadline': deadline,
+        'status': 'queued',
+        'attempts': 0,
+        'created_at': now,
+        'available_at': now,
+    })
+
+def get_queued_job(job_id):
+    return find_job(job_id)
+
+def cancel_queued_jobs(chat_id, reason):
+    """
+    Cancel the jobs of a chat, or of every chat when chat_id is None.
+    """
+    return cancel_jobs(chat_id, reason, current_app.config['JOB_HISTORY_TTL'])
+
+def job_deadline(job):
+    """
+    Deadline of a job's pipeline, counted from when the message was queued.
+    """
+    waited = (datetime.utcnow() - job['created_at']).total_seconds()
+    deadline = Deadline(job.get('deadline'), started=time.time() - waited)
+    if job.get('cancel_reason'):
+        deadline.cancel(job['cancel_reason'])
+    return deadline
+
+def run_next_job(worker_id, handler):
+    """
+    Claim the next available job and run handler(job, deadline) on it; returns False when no job was available.
+    The deadline is cancelled when the job is cancelled while it runs.
+    """
+    config = current_app.config
+    max_attempts = config['JOB_MAX_ATTEMPTS']
+    lease_seconds = config['JOB_LEASE_SECONDS']
+    dead_letter_expired_jobs(max_attempts)
+    job = claim_job(worker_id, lease_seconds, max_attempts)
+    if not job:
+        return False
+
+    print("Running job", job['_id'], "attempt", job['attempts'], "of", max_attempts)
+    done = threading.Event()
+    app = current_app._get_current_object()
+    deadline = job_deadline(job)
+
+    def renew_lease():
+        with app.app_context():
+            while not done.wait(lease_seconds / 3):
+                lease = extend_job_lease(job['_id'], worker_id, lease_seconds)
+                if not lease:
+                    print("Lost the lease of job", job['_id'])
+                    return
+                if lease.get('cancel_reason'):
+                    deadline.cancel(lease['cancel_reason'])
+
+    heartbeat = threading.Thread(target=renew_lease, name=f"lease-{job['_id']}", daemon=True)
+    heartbeat.start()
+    try:
+        handler(job, deadline)
+        # The pipeline reports a cancellation to the chat and returns normally, the job must not read "done".
+        if deadline.cancelled:
+            finish_cancelled_job(job['_id'], worker_id, deadline.reason, config['JOB_HISTORY_TTL'])
+        else:
+            finish_job(job['_id'], worker_id, config['JOB_HISTORY_TTL'])
+    except Exception as e:
+        print("Pipeline job failed:", job['_id'], str(e))
+        if job['attempts'] < max_attempts:
+            delay = config['JOB_RETRY_DELAY'] * 2 ** (job['attempts'] - 1)
+            retry_job(job['_id'], worker_id, str(e), datetime.utcnow() + timedelta(seconds=delay))
+        else:
+            dead_letter_job(job['_id'], worker_id, str(e))
+    finally:
+        done.set()
+        heartbeat.join()
+    return True
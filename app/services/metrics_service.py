@@ -0,0 +1,17 @@
+# app/services/metrics_service.py
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+import Agents
+
+def get_metrics():
+    """
+    Current pipeline, repository and cache metrics in the Prometheus text format.
+    """
+    return generate_latest(), 200, CONTENT_TYPE_LATEST
+
+def get_model_status():
+    """
+    Model each stage with a STAGE_MODELS chain currently uses, with the rolling latency and error statistics of the
+    chain; the other stages use the default model.
+    """
+    return {'default_model': Agents.llm.model, 'stages': Agents.model_tiers.status()}, 200
@@ -0,0 +1,108 @@
+# app/services/routing_memo_service.py
+import hashlib
+import threading
+import time
+
+import numpy as np
+
+from app import routing_memo
+from app.repositories.routing_memo_repository import (
+    find_routing_memo_entries,
+    upsert_routing_memo_entry,
+    touch_routing_memo_entry,
+    delete_routing_memo_entries,
+    delete_all_routing_memo_entries,
+)
+from embeddings import get_embedder
+from metrics import record_cache_lookup
+from utils import catalog_fingerprint, normalize_message
+
+# Routing decisions are remembered per message embedding so that paraphrases of a previous question reuse its
+# agent ids instead of running the orchestrator crew. The index lives in memory and is mirrored in the
+# Mongo "routing_memo" collection so it survives restarts.
+
+_stats = {'hits': 0, 'misses': 0}
+_stats_lock = threading.Lock()
+_loaded = False
+_load_lock = threading.Lock()
+
+def _load_persisted_entries():
+    global _loaded
+    with _load_lock:
+        if _loaded:
+            return
+        for entry_doc in reversed(find_routing_memo_entries(routing_memo.max_size)):
+            vector = np.array(entry_doc.pop('vector'), dtype=np.float32)
+            routing_memo.add(entry_doc, vector)
+        _loaded = True
+
+def routing_scope(message, agents):
+    """
+    Routing decisions are only reused for messages routed against the same catalog with the same routing mode.
+    """
+    return f"{catalog_fingerprint(agents)}:{message.get('routing_mode', '')}"
+
+def _embed(message):
+    normalized = normalize_message(message['message'])
+    return normalized, get_embedder().embed([normalized])[0]
+
+def lookup_agent_ids(message, agents):
+    """
+    Return the agent ids chosen for the most similar earlier message, or None when nothing is close enough.
+    """
+    try:
+        _load_persisted_entries()
+        _, vector = _embed(message)
+        entry, similarity = routing_memo.nearest(vector, routing_scope(message, agents))
+    except Exception as e:
+        print("Routing memo lookup failed:", e)
+        return None
+    if entry is None:
+        with _stats_lock:
+            _stats['misses'] += 1
+        record_cache_lookup('routing_memo', False)
+        return None
+    with _stats_lock:
+        _stats['hits'] += 1
+    record_cache_lookup('routing_memo', True)
+    print(f"Routing memo hit ({similarity:.2f}) on '{entry['message']}':", entry['agent_ids'])
+    try:
+        touch_routing_memo_entry(entry['_id'], entry['last_used'])
+    except Exception as e:
+        print("Routing memo touch failed:", e)
+    return entry['agent_ids']
+
+def remember_agent_ids(message, agents, agent_ids):
+    """
+    Store the routing decision for the message and drop whatever the bounded index evicted.
+    """
+    if not agent_ids:
+        return
+    try:
+        _load_persisted_entries()
+        normalized, vector = _embed(message)
+        scope = routing_scope(message, agents)
+        entry = {
+            '_id': hashlib.sha256(f"{scope}\n{normalized}".encode('utf-8')).hexdigest(),
+            'message': normalized,
+            'agent_ids': list(agent_ids),
+            'catalog': scope,
+            'last_used': time.time(),
+        }
+        evicted = routing_memo.add(entry, vector)
+        upsert_routing_memo_entry({**entry, 'vector': vector.tolist()})
+        delete_routing_memo_entries(evicted)
+    except Exception as e:
+        print("Routing memo store failed:", e)
+
+def invalidate_routing_memo():
+    """
+    Forget every routing decision, called whenever the agent catalog changes.
+    """
+    routing_memo.clear()
+    delete_all_routing_memo_entries()
+
+def get_routing_memo_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    return {**stats, 'entries': len(routing_memo)}
@@ -0,0 +1,120 @@
+# app/single_flight.py
+
+import threading
+
+
+class Flight:
+    """
+    One in-flight pipeline execution shared by every request that joined it.
+
+    Events published by the leader are recorded and delivered, in order, to every listener; a listener that joins
+    late first receives the events it missed. wait() returns the leader's result (or raises its error), and the
+    callbacks added with add_done_callback(callback) are called with the flight once it is complete.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.listeners = []
+        self.result = None
+        self.error = None
+        self.callbacks = []
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def subscribe(self, listener):
+        with self._lock:
+            for event, payload in self.events:
+                listener(event, payload)
+            self.listeners.append(listener)
+
+    def unsubscribe(self, listener):
+        with self._lock:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    def history(self):
+        """
+        Events published so far.
+        """
+        with self._lock:
+            return list(self.events)
+
+    def publish(self, event, payload):
+        with self._lock:
+            self.events.append((event, payload))
+            for listener in self.listeners:
+                listener(event, payload)
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self._done.is_set():
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+    def complete(self, result=None, error=None):
+        with self._lock:
+            self.result, self.error = result, error
+            self._done.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                print("Flight callback failed:", str(e))
+
+    def finished(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def wait(self):
+        self._done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent executions with the same key onto one (the leader's); the others follow its events and
+    share its result. Turned off with PIPELINE_COALESCE = False, in which case every caller leads its own flight.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self.flights = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('PIPELINE_COALESCE', self.enabled)
+
+    def join(self, key, listener):
+        """
+        Return (flight, leader): leader is True when the caller must run the execution and finish the flight.
+        """
+        with self._lock:
+            flight = self.flights.get(key) if self.enabled else None
+            leader = flight is None
+            if leader:
+                flight = Flight()
+                if self.enabled:
+                    self.flights[key] = flight
+        flight.subscribe(listener)
+        return flight, leader
+
+    def get(self, key):
+        """
+        The flight running under key, or None (always None when coalescing is off).
+        """
+        with self._lock:
+            return self.flights.get(key) if self.enabled else None
+
+    def finish(self, key, flight, result=None, error=None):
+        with self._lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+        flight.complete(result, error)
+
+    def __len__(self):
+        return len(self.flights)
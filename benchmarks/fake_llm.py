@@ -0,0 +1,120 @@
+import hashlib
+import json
+import re
+import threading
+import time
+
+import llm_streaming
+from deadlines import check_deadline, llm_timeout
+from flow_layout import detect_products
+from llm_streaming import StreamingLLM
+from utils import count_tokens
+
+ROUTING_MARKER = 'one per line as "id | product | capability"'
+BATCH_ROUTING_MARKER = 'one per line as "number | query"'
+FLOW_EDGES_MARKER = "Return the dependencies between them"
+COMBINED_MARKER = "Return one JSON object with the formatted message"
+DIGEST_LINE = re.compile(r"^(\S+) \| ", re.MULTILINE)
+
+WORDS = (
+    "simulate", "optimize", "validate", "model", "mesh", "solver", "battery", "thermal", "cooling", "design",
+    "geometry", "loads", "workflow", "parameters", "results", "performance", "structure", "flow", "data", "system",
+)
+
+DEFAULT_GRAPH = {
+    "nodes": [
+        {"id": "nx", "data": {"label": "NX"}, "position": {"x": 0, "y": 0}, "level": 1},
+        {"id": "star-ccm", "data": {"label": "Star-CCM+"}, "position": {"x": -150, "y": 150}, "level": 2},
+        {"id": "heeds", "data": {"label": "HEEDS"}, "position": {"x": 150, "y": 150}, "level": 2},
+    ],
+    "edges": [
+        {"id": "nx-star-ccm", "source": "nx", "target": "star-ccm"},
+        {"id": "nx-heeds", "source": "nx", "target": "heeds"},
+    ],
+}
+
+
+class FakeLLM(StreamingLLM):
+    """
+    Deterministic stand-in for the Ollama model: answers come from recorded responses (first matching substring
+    wins) or from built-in rules, after a simulated delay of latency + token_latency per generated token.
+
+    Built-in rules: the routing prompt gets the first `route_count` agent ids of its catalog digest (for every
+    query of a batched routing prompt), the combined formatter and the flow edges prompts chain the products they
+    mention in order, the full flow prompt gets a fixed graph and every other prompt gets a pseudo-random answer
+    seeded by the prompt text.
+    """
+
+    def __init__(self, latency=0.05, token_latency=0.0, answer_words=60, route_count=2, responses=None, **kwargs):
+        super().__init__(model=kwargs.pop("model", "ollama/llama3.2"), temperature=0, **kwargs)
+        self.latency = latency
+        self.token_latency = token_latency
+        self.answer_words = answer_words
+        self.route_count = route_count
+        self.responses = responses or []
+        self.calls = 0
+        self._calls_lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """
+        Load recorded responses from a JSON list of {"match": substring, "response": text}.
+        """
+        with open(path) as f:
+            return cls(responses=json.load(f), **kwargs)
+
+    def answer(self, prompt):
+        for recorded in self.responses:
+            if recorded["match"] in prompt:
+                return recorded["response"]
+        if BATCH_ROUTING_MARKER in prompt:
+            catalog, queries = prompt.split(BATCH_ROUTING_MARKER, 1)
+            agent_ids = DIGEST_LINE.findall(catalog)[:self.route_count]
+            numbers = re.findall(r"^(\d+) \| ", queries, re.MULTILINE)
+            return json.dumps({"routes": [{"query": int(number), "agent_ids": agent_ids} for number in numbers]})
+        if ROUTING_MARKER in prompt or "agent_ids" in prompt:
+            return json.dumps({"agent_ids": DIGEST_LINE.findall(prompt)[:self.route_count]})
+        if COMBINED_MARKER in prompt:
+            products = detect_products(prompt.split(COMBINED_MARKER)[0]) or ["NX", "HEEDS"]
+            return json.dumps({
+                "message": self.text(prompt),
+                "products": products,
+                "edges": [{"source": source, "target": target} for source, target in zip(products, products[1:])],
+            })
+        if FLOW_EDGES_MARKER in prompt:
+            products = detect_products(prompt.split(FLOW_EDGES_MARKER)[0].split("Siemens products:")[-1])
+            return json.dumps({"edges": [
+                {"source": source, "target": target} for source, target in zip(products, products[1:])
+            ]})
+        if "React Flow JSON" in prompt:
+            return json.dumps(DEFAULT_GRAPH)
+        return self.text(prompt)
+
+    def text(self, prompt):
+        seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest(), 16)
+        words = [WORDS[(seed >> (index % 200)) % len(WORDS)] for index in range(self.answer_words)]
+        return " ".join(words).capitalize() + "."
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None):
+        with self._calls_lock:
+            self.calls += 1
+        if isinstance(messages, str):
+            messages = [{"role": "user", "content": messages}]
+        text = self.answer("\n".join(str(message.get("content", "")) for message in messages))
+        response = f"Thought: I now can give a great answer\nFinal Answer: {text}"
+
+        delay = self.latency + self.token_latency * count_tokens(text)
+        callback = getattr(llm_streaming._sink, "callback", None)
+        # Like a real backend, give up when the pipeline deadline passes or the pipeline is cancelled.
+        check_deadline()
+        if callback is None:
+            timeout = llm_timeout()
+            time.sleep(delay if timeout is None else min(delay, timeout))
+            check_deadline()
+            return response
+        tokens = re.findall(r"\S+\s*", response)
+        for token in tokens:
+            time.sleep(delay / len(tokens))
+            check_deadline()
+            callback(token)
+        return response
@@ -0,0 +1,298 @@
+"""
+Offline benchmarks of the chat pipeline.
+
+The module-level `llm` of Agents.py is replaced by a deterministic FakeLLM, so the numbers measure the pipeline
+itself (routing, retrieval, crew overhead, parsing, Mongo) plus a fixed, configurable model latency.
+Run from the repository root:
+
+    python -m benchmarks.run --iterations 50 --latency 0.05
+    python -m benchmarks.run --scenario chat --concurrency 4 --fail-on-regression
+
+Without --mongo-uri the app runs against mongomock (pip install mongomock). A --mongo-uri must point to a
+dedicated database: its agents, chats and cache collections are emptied before the run.
+Results are written to benchmarks/results/ and compared with the newest earlier run made with the same settings
+(or --baseline); runs with different settings are not compared.
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, "results")
+SCENARIOS = ("orchestrator", "flow", "chat")
+QUERIES = [
+    "How can we optimize the battery cooling of an electric vehicle?",
+    "Reduce the mass of a car door while keeping its stiffness",
+    "Simulate the aerodynamics of a new SUV and validate it with wind tunnel tests",
+    "Manage simulation data for a multidisciplinary powertrain project",
+    "Design a lighter bracket and check its durability under vibration loads",
+]
+FLOW_INPUT = {
+    "result": "NX models the geometry, STAR-CCM+ simulates the cooling and HEEDS optimizes the design.",
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the chat pipeline with a deterministic fake LLM.")
+    parser.add_argument("--scenario", choices=SCENARIOS, action="append",
+                        help="scenario to run (repeatable, default: all)")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=1, help="unmeasured iterations run first")
+    parser.add_argument("--concurrency", type=int, default=1, help="iterations running at the same time")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per fake LLM call")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="extra seconds per generated token")
+    parser.add_argument("--responses", help="JSON list of recorded {match, response} answers for the fake LLM")
+    parser.add_argument("--routing-mode", default="llm")
+    parser.add_argument("--execution-mode", default="sequential")
+    parser.add_argument("--output-mode", default="separate")
+    parser.add_argument("--formatter-mode", default="local")
+    parser.add_argument("--mongo-uri", help="dedicated Mongo database to use instead of mongomock")
+    parser.add_argument("--baseline", help="results file to compare with (default: latest with the same settings)")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95 slowdown against the baseline")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 on a regression")
+    parser.add_argument("--verbose", action="store_true", help="keep the pipeline and crewai output")
+    return parser.parse_args(argv)
+
+
+def setup_app(mongo_uri):
+    from app.config import Config
+
+    if mongo_uri:
+        Config.MONGO_URI = mongo_uri
+    from app import create_app, mongo
+
+    app = create_app()
+    if not mongo_uri:
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("mongomock is required for the in-memory database (pip install mongomock), or pass --mongo-uri")
+        mongo.cx = mongomock.MongoClient()
+        mongo.db = mongo.cx["benchmarks"]
+    for collection in ("agents", "chats", "result_cache", "routing_memo"):
+        mongo.db[collection].delete_many({})
+    return app
+
+
+def install_fake_llm(args):
+    import Agents
+    from benchmarks.fake_llm import FakeLLM
+
+    options = {"latency": args.latency, "token_latency": args.token_latency}
+    fake_llm = FakeLLM.from_file(args.responses, **options) if args.responses else FakeLLM(**options)
+    Agents.llm = fake_llm
+    Agents.agent_pool.clear()
+    return fake_llm
+
+
+def seed_agents():
+    from app.services.agent_service import create_agents, get_agents
+
+    with open(os.path.join(BENCHMARK_DIR, "agents.json")) as f:
+        create_agents(json.load(f))
+    return get_agents()[0]
+
+
+def orchestrator_scenario(agents, args):
+    from Agents import run_orchestrator
+    from metrics import Trace, use_trace
+
+    def run(iteration):
+        data = {
+            "message": QUERIES[iteration % len(QUERIES)],
+            "routing_mode": args.routing_mode,
+            "execution_mode": args.execution_mode,
+            "output_mode": args.output_mode,
+            "formatter_mode": args.formatter_mode,
+        }
+        with use_trace(Trace()) as trace:
+            run_orchestrator(data, agents)
+        return trace.to_dict()
+
+    return run
+
+
+def flow_scenario(agents, args):
+    from Agents import run_flow_agent
+    from metrics import Trace, use_trace
+
+    def run(iteration):
+        with use_trace(Trace()) as trace:
+            run_flow_agent({"message": QUERIES[iteration % len(QUERIES)]}, FLOW_INPUT)
+        return trace.to_dict()
+
+    return run
+
+
+def chat_scenario(agents, args):
+    from app.repositories.chat_repository import find_chat_messages
+    from app.services.chat_service import chat_and_publish, create_chat
+
+    def run(iteration):
+        chat_id = create_chat({"title": f"benchmark {iteration}"})[0]["_id"]
+        message = {
+            "message": QUERIES[iteration % len(QUERIES)],
+            "routing_mode": args.routing_mode,
+            "execution_mode": args.execution_mode,
+            "output_mode": args.output_mode,
+            "formatter_mode": args.formatter_mode,
+            "use_cache": False,
+        }
+        chat_and_publish(chat_id, message, agents, trace=True)
+        return find_chat_messages(chat_id, limit=1)["messages"][-1]["trace"]
+
+    return run
+
+
+def run_scenario(run, args):
+    """
+    Run the scenario and return its throughput and the samples of every span, in milliseconds.
+    """
+    for iteration in range(args.warmup):
+        run(-1 - iteration)
+
+    samples = {}
+
+    def timed_run(iteration):
+        start = time.perf_counter()
+        trace = run(iteration)
+        samples.setdefault("total", []).append((time.perf_counter() - start) * 1000)
+        for span in trace["spans"]:
+            if span["kind"] in ("stage", "repository"):
+                samples.setdefault(span["name"], []).append(span["duration_ms"])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as pool:
+        list(pool.map(timed_run, range(args.iterations)))
+    elapsed = time.perf_counter() - start
+    return {
+        "iterations": args.iterations,
+        "throughput": args.iterations / elapsed if elapsed else 0.0,
+        "stages": {name: summarize(values) for name, values in sorted(samples.items())},
+    }
+
+
+def summarize(values):
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"n": len(values), "p50": round(float(p50), 2), "p95": round(float(p95), 2), "p99": round(float(p99), 2)}
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, cwd=BENCHMARK_DIR).strip()
+    except Exception:
+        return None
+
+
+# Settings that only change how the results are judged, not what is measured.
+REPORT_SETTINGS = ("tolerance", "fail_on_regression")
+
+
+def comparable_settings(settings):
+    return {key: value for key, value in settings.items() if key not in REPORT_SETTINGS}
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def latest_results(settings):
+    """
+    Newest results file measured with the same settings (scenarios, modes, latencies, concurrency...), or None.
+    """
+    for path in sorted(glob.glob(os.path.join(RESULTS_DIR, "*.json")), reverse=True):
+        try:
+            previous = load_results(path)
+        except (OSError, ValueError):
+            continue
+        if comparable_settings(previous.get("settings", {})) == comparable_settings(settings):
+            return path
+    return None
+
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Stages whose p95 got slower than the baseline by more than tolerance (ignoring sub-millisecond noise).
+    """
+    regressions = []
+    for scenario, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if not previous:
+            continue
+        for stage, stats in current["stages"].items():
+            before = previous["stages"].get(stage)
+            if before and stats["p95"] > max(before["p95"] * (1 + tolerance), before["p95"] + 1):
+                regressions.append(f"{scenario}/{stage}: p95 {before['p95']} ms -> {stats['p95']} ms")
+    return regressions
+
+
+def print_report(results):
+    for scenario, current in results["scenarios"].items():
+        print(f"\n{scenario}: {current['iterations']} iterations, {current['throughput']:.2f} req/s")
+        print(f"  {'stage':<45} {'n':>5} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10}")
+        for stage, stats in current["stages"].items():
+            print(f"  {stage:<45} {stats['n']:>5} {stats['p50']:>10} {stats['p95']:>10} {stats['p99']:>10}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    scenarios = args.scenario or list(SCENARIOS)
+    builders = {"orchestrator": orchestrator_scenario, "flow": flow_scenario, "chat": chat_scenario}
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        setup_app(args.mongo_uri)
+        fake_llm = install_fake_llm(args)
+        agents = seed_agents()
+        results = {
+            "created_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "revision": git_revision(),
+            "settings": {key: value for key, value in vars(args).items() if key not in ("baseline", "verbose")},
+            "scenarios": {},
+        }
+        for scenario in scenarios:
+            results["scenarios"][scenario] = run_scenario(builders[scenario](agents, args), args)
+        results["llm_calls"] = fake_llm.calls
+
+    print_report(results)
+
+    baseline_path = args.baseline or latest_results(results["settings"])
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results_path = os.path.join(RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(results_path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nSaved results to {results_path}")
+
+    if not baseline_path:
+        print("No earlier results with the same settings, nothing to compare with")
+        return 0
+    baseline = load_results(baseline_path)
+    settings = comparable_settings(results["settings"])
+    baseline_settings = comparable_settings(baseline.get("settings", {}))
+    changed = [
+        key for key in sorted(set(settings) | set(baseline_settings)) if settings.get(key) != baseline_settings.get(key)
+    ]
+    if changed:
+        print(f"Not comparing with {baseline_path}: it ran with different settings ({', '.join(changed)})")
+        return 0
+    regressions = find_regressions(results, baseline, args.tolerance)
+    print(f"Compared with {baseline_path} (revision {baseline.get('revision')}):",
+          "no regressions" if not regressions else "")
+    for regression in regressions:
+        print("  REGRESSION", regression)
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
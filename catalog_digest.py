@@ -0,0 +1,93 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+from utils import catalog_fingerprint, count_tokens
+
+# Routing prompt catalog: one "id | title | capability" line per agent, at most ROUTING_CATALOG_TOKEN_BUDGET tokens.
+ROUTING_CATALOG_TOKEN_BUDGET = int(os.environ.get("ROUTING_CATALOG_TOKEN_BUDGET", "1500"))
+ROUTING_SUMMARY_CHARS = int(os.environ.get("ROUTING_SUMMARY_CHARS", "140"))
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def capability_summary(agent, max_chars=ROUTING_SUMMARY_CHARS):
+    """
+    One-line summary of what an agent can help with: the first sentence of its goals, or its role.
+    """
+    text = re.sub(r"\s+", " ", str(agent.get("goals") or agent.get("role") or "")).strip()
+    text = SENTENCE_END.split(text, maxsplit=1)[0]
+    if len(text) > max_chars:
+        text = text[:max_chars - 1].rsplit(" ", 1)[0] + "…"
+    return text
+
+
+def digest_line(agent):
+    title = re.sub(r"\s+", " ", str(agent.get("title") or agent.get("role") or "")).strip()
+    return f"{agent['_id']} | {title} | {capability_summary(agent)}"
+
+
+def digest_version(agent):
+    return hashlib.sha256(
+        json.dumps([str(agent.get(field, "")) for field in ("_id", "title", "role", "goals")]).encode("utf-8")
+    ).hexdigest()[:16]
+
+
+class CatalogDigest:
+    """
+    Compact, precomputed description of the agent catalog for the routing prompt.
+
+    The line and token count of every agent are computed once per catalog version; render() then only has to pick
+    lines, best scored first, until the token budget is used up.
+    """
+
+    def __init__(self):
+        self.fingerprint = None
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, agent):
+        key = (str(agent["_id"]), digest_version(agent))
+        entry = self.entries.get(key)
+        if entry is None:
+            line = digest_line(agent)
+            entry = self.entries[key] = {"id": str(agent["_id"]), "line": line, "tokens": count_tokens(line) + 1}
+        return entry
+
+    def ensure(self, agents_data):
+        """
+        Regenerate the digest if the catalog changed since it was built.
+        """
+        fingerprint = catalog_fingerprint(agents_data)
+        with self._lock:
+            if fingerprint == self.fingerprint:
+                return
+            previous, self.entries = self.entries, {}
+            for agent in agents_data:
+                key = (str(agent["_id"]), digest_version(agent))
+                self.entries[key] = previous.get(key) or self._entry(agent)
+            self.fingerprint = fingerprint
+
+    def render(self, agents_data, scores=None, token_budget=ROUTING_CATALOG_TOKEN_BUDGET):
+        """
+        Digest text of agents_data (a catalog or a subset of it) within token_budget, and the ids it includes.
+        With scores ({agent_id: score}) the best matching agents are kept when the budget truncates the list;
+        the best agent is always included.
+        """
+        scores = scores or {}
+        with self._lock:
+            entries = [self._entry(agent) for agent in agents_data]
+        order = sorted(range(len(entries)), key=lambda i: -scores.get(entries[i]["id"], 0.0))
+        kept, used = [], 0
+        for index in order:
+            tokens = entries[index]["tokens"]
+            if kept and used + tokens > token_budget:
+                continue
+            kept.append(index)
+            used += tokens
+        if len(kept) < len(entries):
+            print(f"Routing catalog truncated to {len(kept)} of {len(entries)} agents ({used} tokens)")
+        kept.sort()
+        return "\n".join(entries[i]["line"] for i in kept), [entries[i]["id"] for i in kept]
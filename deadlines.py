@@ -0,0 +1,136 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Share of the request budget of every pipeline stage, in pipeline order. A stage has to end by the cumulative share
+# of the stages up to it, so the time a stage leaves unused carries over to the next ones.
+STAGE_SHARES = (("routing", 0.15), ("specialists", 0.55), ("formatter", 0.15), ("flow", 0.15))
+
+
+class PipelineCancelled(Exception):
+    """Raised in a pipeline whose chat was deleted or which a newer message of the chat superseded."""
+
+    def __init__(self, reason):
+        super().__init__(f"Pipeline cancelled: {reason}")
+        self.reason = reason
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a pipeline stage runs past its share of the request budget."""
+
+    def __init__(self, stage):
+        super().__init__(f"Deadline exceeded during {stage or 'the pipeline'}")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    Time budget (None for no limit) and cancellation flag of one pipeline run, checked cooperatively between tasks
+    and while the LLM streams. started is a time.time() value, so a budget can start before the run (e.g. when the
+    message was queued).
+    """
+
+    def __init__(self, seconds=None, started=None):
+        self.seconds = seconds
+        self.started = time.time() if started is None else started
+        self.reason = None
+        self._cancelled = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self, reason="cancelled"):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.reason = reason
+            self._cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(reason)
+
+    def on_cancel(self, callback):
+        """
+        Call callback(reason) when the deadline is cancelled, right away if it already is.
+        """
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        callback(self.reason)
+
+    def remaining(self, stage=None):
+        """
+        Seconds left for the stage (or the whole pipeline), never negative; None without a budget.
+        """
+        if self.seconds is None:
+            return None
+        share = 1.0
+        if stage is not None:
+            share = 0.0
+            for name, stage_share in STAGE_SHARES:
+                share += stage_share
+                if name == stage:
+                    break
+        return max(0.0, self.started + self.seconds * min(share, 1.0) - time.time())
+
+    def check(self, stage=None):
+        if self.cancelled:
+            raise PipelineCancelled(self.reason)
+        remaining = self.remaining(stage)
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(stage)
+
+
+# Deadline and stage of the pipeline running on the current thread, if any.
+_active = threading.local()
+
+
+def current_deadline():
+    return getattr(_active, "deadline", None)
+
+
+def current_stage():
+    return getattr(_active, "stage", None)
+
+
+@contextmanager
+def use_deadline(deadline, stage=None):
+    """
+    Check deadline (None stops checking) for the given stage on the current thread while the block runs.
+    """
+    previous = current_deadline(), current_stage()
+    _active.deadline, _active.stage = deadline, stage
+    try:
+        yield deadline
+    finally:
+        _active.deadline, _active.stage = previous
+
+
+@contextmanager
+def deadline_stage(stage):
+    """
+    Run the block as the given stage of the current pipeline.
+    """
+    with use_deadline(current_deadline(), stage):
+        yield
+
+
+def check_deadline():
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.check(current_stage())
+
+
+def llm_timeout(default=None):
+    """
+    Timeout of an LLM call: the time left for the current stage, capped by the LLM's own timeout.
+    """
+    deadline = current_deadline()
+    remaining = deadline.remaining(current_stage()) if deadline is not None else None
+    if remaining is None:
+        return default
+    return min(remaining, default) if default else remaining
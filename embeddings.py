@@ -0,0 +1,98 @@
+import hashlib
+import os
+import re
+
+import numpy as np
+
+from agent_router import STOP_WORDS
+
+# Local text embeddings shared by the routing memo and the retrieval indexes.
+# "hashing" needs nothing but NumPy; "ollama" calls the local Ollama embedding model through litellm.
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "hashing")
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "ollama/nomic-embed-text")
+HASHING_DIMENSIONS = int(os.environ.get("HASHING_DIMENSIONS", "1024"))
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+# Domain abbreviations are expanded so that "EV" and "electric vehicle" land on the same features.
+ABBREVIATIONS = {
+    "ev": "electric vehicle",
+    "evs": "electric vehicles",
+    "cfd": "computational fluid dynamics",
+    "fea": "finite element analysis",
+    "fem": "finite element model",
+    "cad": "computer aided design",
+    "cae": "computer aided engineering",
+    "plm": "product lifecycle management",
+    "mdo": "multidisciplinary design optimization",
+    "nvh": "noise vibration harshness",
+    "optimise": "optimize",
+    "optimisation": "optimization",
+}
+
+
+def normalize_words(text):
+    words = []
+    for word in WORD_PATTERN.findall(str(text or "").lower()):
+        if word not in STOP_WORDS:
+            words.extend(ABBREVIATIONS.get(word, word).split())
+    return words
+
+
+class HashingEmbedder:
+    """
+    Dependency-free embedder: words and character trigrams of every word are hashed into a fixed-size,
+    L2-normalized vector, so inflections ("optimize"/"optimization") still overlap.
+    """
+
+    def __init__(self, dimensions=HASHING_DIMENSIONS):
+        self.dimensions = dimensions
+
+    def _index(self, feature):
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "little") % self.dimensions
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in normalize_words(text):
+                vectors[row, self._index(f"w:{word}")] += 2.0
+                padded = f"<{word}>"
+                for start in range(len(padded) - 2):
+                    vectors[row, self._index(f"c:{padded[start:start + 3]}")] += 1.0
+        return normalize_rows(vectors)
+
+
+class OllamaEmbedder:
+    """
+    Embeds through the local Ollama embedding model (litellm), for better paraphrase matching.
+    """
+
+    def __init__(self, model=EMBEDDING_MODEL):
+        self.model = model
+
+    def embed(self, texts):
+        import litellm
+
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        response = litellm.embedding(model=self.model, input=[" ".join(normalize_words(text)) for text in texts])
+        vectors = np.array([item["embedding"] for item in response.data], dtype=np.float32)
+        return normalize_rows(vectors)
+
+
+def normalize_rows(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+_embedder = None
+
+
+def get_embedder():
+    """
+    Return the process-wide embedder selected by EMBEDDING_BACKEND.
+    """
+    global _embedder
+    if _embedder is None:
+        _embedder = OllamaEmbedder() if EMBEDDING_BACKEND == "ollama" else HashingEmbedder()
+    return _embedder
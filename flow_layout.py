@@ -0,0 +1,332 @@
+import re
+from collections import defaultdict, deque
+
+# 🔹 Siemens Product Mapping: the only labels a workflow graph node may carry.
+SIEMENS_PRODUCT_MAP = {
+    "CAD Modeling": "NX",
+    "Simulation": "Simcenter 3D",
+    "Thermal Management": "Star-CCM+",
+    "System Simulation": "AMESIM",
+    "Multidisciplinary Design": "HEEDS",
+    "Test & Validation": "Simcenter Testlab",
+    "Simulation Data Management": "Teamcenter Simulation",
+    "FEA Analysis": "NASTRAN",
+    "Finite Element Modeling": "FEMAP"
+}
+
+# Other spellings of the products, as they appear in agent titles and answers (compared after normalize_label).
+PRODUCT_ALIASES = {
+    "nx": "NX",
+    "siemens nx": "NX",
+    "nx cad": "NX",
+    "simcenter": "Simcenter 3D",
+    "simcenter 3d": "Simcenter 3D",
+    "star ccm": "Star-CCM+",
+    "starccm": "Star-CCM+",
+    "simcenter star ccm": "Star-CCM+",
+    "amesim": "AMESIM",
+    "simcenter amesim": "AMESIM",
+    "heeds": "HEEDS",
+    "heeds mdo": "HEEDS",
+    "simcenter heeds": "HEEDS",
+    "testlab": "Simcenter Testlab",
+    "simcenter testlab": "Simcenter Testlab",
+    "teamcenter": "Teamcenter Simulation",
+    "teamcenter simulation": "Teamcenter Simulation",
+    "nastran": "NASTRAN",
+    "simcenter nastran": "NASTRAN",
+    "femap": "FEMAP",
+    "simcenter femap": "FEMAP",
+}
+
+# Typical order in which the products take part in a simulation-driven design workflow (parent -> child).
+RULE_DEPENDENCIES = [
+    ("NX", "Simcenter 3D"),
+    ("NX", "Star-CCM+"),
+    ("NX", "FEMAP"),
+    ("NX", "AMESIM"),
+    ("FEMAP", "NASTRAN"),
+    ("Simcenter 3D", "NASTRAN"),
+    ("Simcenter 3D", "Simcenter Testlab"),
+    ("AMESIM", "Simcenter Testlab"),
+    ("Star-CCM+", "HEEDS"),
+    ("NASTRAN", "HEEDS"),
+    ("AMESIM", "HEEDS"),
+    ("HEEDS", "Teamcenter Simulation"),
+    ("Simcenter Testlab", "Teamcenter Simulation"),
+]
+
+NODE_SPACING_X = 220
+LEVEL_SPACING_Y = 150
+CROSSING_SWEEPS = 8
+
+
+def normalize_label(label):
+    return " ".join(re.findall(r"[a-z0-9]+", str(label).lower()))
+
+
+CANONICAL_LABELS = {
+    **{normalize_label(product): product for product in SIEMENS_PRODUCT_MAP.values()},
+    **PRODUCT_ALIASES,
+}
+# Longest aliases first, so "simcenter amesim" is matched before "amesim".
+MENTION_PATTERN = re.compile(
+    r"\b(" + "|".join(re.escape(alias) for alias in sorted(CANONICAL_LABELS, key=len, reverse=True)) + r")\b"
+)
+
+
+def canonical_product(label):
+    """
+    The Siemens product name a label refers to, or None when it is not one of SIEMENS_PRODUCT_MAP.
+    """
+    return CANONICAL_LABELS.get(normalize_label(label))
+
+
+def detect_products(text):
+    """
+    Siemens products mentioned in a text, in order of first mention.
+    """
+    products = []
+    for alias in MENTION_PATTERN.findall(normalize_label(text)):
+        product = CANONICAL_LABELS[alias]
+        if product not in products:
+            products.append(product)
+    return products
+
+
+def rule_edges(products):
+    """
+    RULE_DEPENDENCIES restricted to the given products; a dependency chain through products that are not in the
+    workflow still links its two ends (NX -> Star-CCM+ -> HEEDS gives NX -> HEEDS without Star-CCM+).
+    """
+    children = defaultdict(list)
+    for source, target in RULE_DEPENDENCIES:
+        children[source].append(target)
+    present = set(products)
+    edges = []
+    for source in products:
+        seen, queue = {source}, deque(children[source])
+        while queue:
+            product = queue.popleft()
+            if product in seen:
+                continue
+            seen.add(product)
+            if product in present:
+                edges.append((source, product))
+            else:
+                queue.extend(children[product])
+    return transitive_reduction(edges)
+
+
+def transitive_reduction(edges):
+    """
+    Drop the edges implied by a longer path (NX -> HEEDS when NX -> Star-CCM+ -> HEEDS is already there).
+    """
+    children = defaultdict(set)
+    for source, target in edges:
+        children[source].add(target)
+
+    def reachable_without(source, target):
+        stack, seen = [child for child in children[source] if child != target], set()
+        while stack:
+            node = stack.pop()
+            if node == target:
+                return True
+            if node not in seen:
+                seen.add(node)
+                stack.extend(children[node])
+        return False
+
+    return [(source, target) for source, target in edges if not reachable_without(source, target)]
+
+
+def rules_cover(products, edges):
+    """
+    Rule-based dependencies suffice when they connect every product of a multi-product workflow.
+    """
+    linked = {product for edge in edges for product in edge}
+    return len(products) < 2 or linked >= set(products)
+
+
+def node_id(product):
+    return re.sub(r"[^a-z0-9]+", "-", product.lower()).strip("-")
+
+
+def break_cycles(nodes, edges):
+    """
+    Drop the edges that close a cycle (found by depth-first search from the nodes in order) so layering is possible.
+    """
+    children = defaultdict(list)
+    for source, target in edges:
+        children[source].append(target)
+    state, back_edges = {}, set()
+
+    def visit(node):
+        state[node] = "active"
+        for child in children[node]:
+            if state.get(child) == "active":
+                back_edges.add((node, child))
+            elif child not in state:
+                visit(child)
+        state[node] = "done"
+
+    for node in nodes:
+        if node not in state:
+            visit(node)
+    return [edge for edge in edges if edge not in back_edges]
+
+
+def assign_levels(nodes, edges):
+    """
+    Longest-path layering: sources are on level 0 and every node sits one level below its deepest parent.
+    """
+    parents = defaultdict(list)
+    indegree = {node: 0 for node in nodes}
+    for source, target in edges:
+        parents[target].append(source)
+        indegree[target] += 1
+    children = defaultdict(list)
+    for source, target in edges:
+        children[source].append(target)
+
+    level = {}
+    queue = deque(node for node in nodes if indegree[node] == 0)
+    while queue:
+        node = queue.popleft()
+        level[node] = max((level[parent] + 1 for parent in parents[node]), default=0)
+        for child in children[node]:
+            indegree[child] -= 1
+            if indegree[child] == 0:
+                queue.append(child)
+    return level
+
+
+def split_long_edges(level, edges):
+    """
+    Replace every edge spanning several levels by a chain of dummy nodes, one per level crossed.
+    """
+    layered_edges = []
+    for source, target in edges:
+        previous = source
+        for depth in range(level[source] + 1, level[target]):
+            dummy = ("dummy", source, target, depth)
+            level[dummy] = depth
+            layered_edges.append((previous, dummy))
+            previous = dummy
+        layered_edges.append((previous, target))
+    return layered_edges
+
+
+def count_crossings(layers, edges):
+    position = {node: index for layer in layers for index, node in enumerate(layer)}
+    crossings = 0
+    for upper in range(len(layers) - 1):
+        members = set(layers[upper])
+        between = sorted((position[s], position[t]) for s, t in edges if s in members)
+        for i, (source_a, target_a) in enumerate(between):
+            for source_b, target_b in between[i + 1:]:
+                if source_b > source_a and target_b < target_a:
+                    crossings += 1
+    return crossings
+
+
+def order_layers(level, edges):
+    """
+    Order the nodes inside each level with alternating barycenter sweeps, keeping the ordering with the fewest
+    edge crossings.
+    """
+    depth = max(level.values(), default=-1) + 1
+    layers = [[] for _ in range(depth)]
+    for node in level:
+        layers[level[node]].append(node)
+    parents, children = defaultdict(list), defaultdict(list)
+    for source, target in edges:
+        parents[target].append(source)
+        children[source].append(target)
+
+    def sweep(layer_indexes, neighbours):
+        for index in layer_indexes:
+            position = {node: i for i, node in enumerate(layers[index - 1 if neighbours is parents else index + 1])}
+            current = {node: i for i, node in enumerate(layers[index])}
+
+            def barycenter(node):
+                linked = [position[other] for other in neighbours[node] if other in position]
+                return sum(linked) / len(linked) if linked else current[node]
+
+            layers[index].sort(key=lambda node: (barycenter(node), current[node]))
+
+    best, best_crossings = [list(layer) for layer in layers], count_crossings(layers, edges)
+    for iteration in range(CROSSING_SWEEPS):
+        if iteration % 2 == 0:
+            sweep(range(1, depth), parents)
+        else:
+            sweep(range(depth - 2, -1, -1), children)
+        crossings = count_crossings(layers, edges)
+        if crossings < best_crossings:
+            best, best_crossings = [list(layer) for layer in layers], crossings
+    return best
+
+
+def build_flow_graph(products, edges):
+    """
+    React Flow JSON ({"nodes", "edges"}) of a product workflow laid out top-down (Sugiyama style).
+
+    Labels are validated against SIEMENS_PRODUCT_MAP (aliases are mapped to the canonical name, unknown products
+    and edges touching them are dropped), cycles are broken, nodes are layered by longest path and ordered in each
+    level to reduce crossings; every level is centred on x = 0.
+    """
+    nodes = []
+    for product in products:
+        product = canonical_product(product)
+        if product and product not in nodes:
+            nodes.append(product)
+    valid_edges = []
+    for source, target in edges:
+        source, target = canonical_product(source), canonical_product(target)
+        if source in nodes and target in nodes and source != target and (source, target) not in valid_edges:
+            valid_edges.append((source, target))
+    valid_edges = break_cycles(nodes, valid_edges)
+
+    level = assign_levels(nodes, valid_edges)
+    layers = order_layers(level, split_long_edges(level, valid_edges))
+
+    position = {}
+    for depth, layer in enumerate(layers):
+        offset = (len(layer) - 1) * NODE_SPACING_X / 2
+        for index, node in enumerate(layer):
+            position[node] = {"x": index * NODE_SPACING_X - offset, "y": depth * LEVEL_SPACING_Y}
+
+    return {
+        "nodes": [
+            {
+                "id": node_id(product),
+                "data": {"label": product},
+                "position": position[product],
+                "level": level[product] + 1,
+            }
+            for product in nodes
+        ],
+        "edges": [
+            {"id": f"{node_id(source)}-{node_id(target)}", "source": node_id(source), "target": node_id(target)}
+            for source, target in valid_edges
+        ],
+    }
+
+
+def parse_react_flow(graph):
+    """
+    (products, edges) of a React Flow JSON drawn by the LLM, with edges as (source label, target label) pairs.
+    """
+    if not isinstance(graph, dict):
+        return [], []
+    labels = {}
+    for node in graph.get("nodes") or []:
+        if isinstance(node, dict):
+            label = (node.get("data") or {}).get("label") or node.get("label") or node.get("id")
+            labels[str(node.get("id", label))] = label
+    edges = [
+        (labels.get(str(edge.get("source"))), labels.get(str(edge.get("target"))))
+        for edge in graph.get("edges") or []
+        if isinstance(edge, dict)
+    ]
+    return list(labels.values()), edges
@@ -0,0 +1,16 @@
+# gunicorn.conf.py
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+
+# Socket.IO keeps per-client session state in the process, so a single worker serves everything
+# unless the servers share a message queue (SOCKETIO_MESSAGE_QUEUE, with sticky sessions in front of them);
+# concurrency comes from greenlets, not processes. With JOB_BACKEND=mongo the pipelines run in worker.py.
+workers = int(os.environ.get('WEB_WORKERS', '1'))
+worker_class = 'geventwebsocket.gunicorn.workers.GeventWebSocketWorker'
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', '10000'))
+
+# Long-lived WebSocket connections must not be recycled by the request timeout.
+timeout = 0
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', '120'))
+keepalive = 75
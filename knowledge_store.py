@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+from embeddings import EMBEDDING_BACKEND, get_embedder
+
+KNOWLEDGE_DIR = os.environ.get("KNOWLEDGE_DIR", "knowledge")
+KNOWLEDGE_INDEX_DIR = os.environ.get("KNOWLEDGE_INDEX_DIR", "./.knowledge-index")
+KNOWLEDGE_FILE_TYPES = (".txt", ".md")
+CHUNK_SIZE = int(os.environ.get("KNOWLEDGE_CHUNK_SIZE", "800"))
+CHUNK_OVERLAP = int(os.environ.get("KNOWLEDGE_CHUNK_OVERLAP", "100"))
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """
+    Split text into chunks of about chunk_size characters, preferring paragraph boundaries;
+    paragraphs longer than a chunk are cut with `overlap` characters repeated between pieces.
+    """
+    chunks, current = [], ""
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) + 2 > chunk_size:
+            chunks.append(current)
+            current = ""
+        while len(paragraph) > chunk_size:
+            chunks.append(paragraph[:chunk_size])
+            paragraph = paragraph[chunk_size - overlap:]
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class KnowledgeIndex:
+    """
+    Persistent vector index over the files of the knowledge directory.
+
+    Chunks are keyed by the hash of their content and their embeddings are stored on disk, so a restart reuses
+    them and a changed file only embeds the chunks that are actually new. Files are re-checked by modification
+    time on every search, which costs a stat per file.
+    """
+
+    def __init__(self, source_dir=KNOWLEDGE_DIR, index_dir=KNOWLEDGE_INDEX_DIR):
+        self.source_dir = source_dir
+        self.index_dir = index_dir
+        self.files = {}
+        self.chunk_ids = []
+        self.chunks = {}
+        self.vectors = {}
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.index_dir, "manifest.json")
+
+    @property
+    def vectors_path(self):
+        return os.path.join(self.index_dir, "vectors.npz")
+
+    def _load(self):
+        if not os.path.exists(self.manifest_path):
+            return
+        with open(self.manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get("embedder") != EMBEDDING_BACKEND:
+            return
+        self.files = manifest["files"]
+        self.chunks = manifest["chunks"]
+        if os.path.exists(self.vectors_path):
+            stored = np.load(self.vectors_path)
+            self.vectors = {chunk_id: stored[chunk_id] for chunk_id in stored.files}
+
+    def _save(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(self.manifest_path, "w") as f:
+            json.dump({"embedder": EMBEDDING_BACKEND, "files": self.files, "chunks": self.chunks}, f)
+        np.savez(self.vectors_path, **self.vectors)
+
+    def _source_files(self):
+        if not os.path.isdir(self.source_dir):
+            return {}
+        return {
+            name: os.path.getmtime(os.path.join(self.source_dir, name))
+            for name in sorted(os.listdir(self.source_dir))
+            if name.endswith(KNOWLEDGE_FILE_TYPES)
+        }
+
+    def refresh(self):
+        """
+        Bring the index in line with the knowledge directory, embedding only chunks that are not stored yet.
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+            sources = self._source_files()
+            changed = [name for name, mtime in sources.items() if self.files.get(name, {}).get("mtime") != mtime]
+            if not changed and set(sources) == set(self.files) and len(self.chunk_ids) == len(self.vectors):
+                return
+
+            for name in changed:
+                with open(os.path.join(self.source_dir, name), encoding="utf-8") as f:
+                    text = f.read()
+                digest = content_hash(text)
+                if self.files.get(name, {}).get("hash") == digest:
+                    self.files[name]["mtime"] = sources[name]
+                    continue
+                chunk_ids = []
+                for chunk in chunk_text(text):
+                    chunk_id = content_hash(chunk)
+                    self.chunks[chunk_id] = {"text": chunk, "source": name}
+                    chunk_ids.append(chunk_id)
+                self.files[name] = {"mtime": sources[name], "hash": digest, "chunks": chunk_ids}
+            for name in set(self.files) - set(sources):
+                del self.files[name]
+
+            live_ids = list(dict.fromkeys(chunk_id for entry in self.files.values() for chunk_id in entry["chunks"]))
+            missing = [chunk_id for chunk_id in live_ids if chunk_id not in self.vectors]
+            if missing:
+                print(f"📚 Embedding {len(missing)} new knowledge chunks")
+                for chunk_id, vector in zip(missing, get_embedder().embed([self.chunks[i]["text"] for i in missing])):
+                    self.vectors[chunk_id] = vector
+            self.chunks = {chunk_id: self.chunks[chunk_id] for chunk_id in live_ids}
+            self.vectors = {chunk_id: self.vectors[chunk_id] for chunk_id in live_ids}
+            self.chunk_ids = live_ids
+            self.matrix = np.array([self.vectors[chunk_id] for chunk_id in live_ids], dtype=np.float32)
+            self._save()
+
+    def search(self, query, top_k=3):
+        """
+        Return up to top_k {"text", "source", "score"} chunks most similar to the query.
+        """
+        self.refresh()
+        with self._lock:
+            if not self.chunk_ids:
+                return []
+            scores = self.matrix @ get_embedder().embed([query])[0]
+            order = np.argsort(-scores)[:top_k]
+            return [
+                {**self.chunks[self.chunk_ids[index]], "score": float(scores[index])}
+                for index in order
+            ]
@@ -0,0 +1,265 @@
+import json
+import re
+
+from crewai.utilities.converter import Converter
+from pydantic import ValidationError
+
+FENCE = re.compile(r"```(?:json)?", re.IGNORECASE)
+DANGLING_KEY = re.compile(r',?\s*"(?:[^"\\]|\\.)*"\s*:\s*$')
+PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+CLOSERS = {"{": "}", "[": "]"}
+ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f"}
+# Truncated output is closed at the end of the text, or else cut back to one of its last commas.
+MAX_TRUNCATION_CUTS = 8
+
+
+def strip_code_fences(text):
+    return FENCE.sub("", str(text or "")).strip()
+
+
+def repair_json(fragment, partial_strings=False):
+    """
+    Parse a JSON-like fragment starting at "{", repairing what LLMs commonly get wrong: single-quoted strings,
+    Python literals (True, False, None), trailing commas and truncation (open arrays and objects are closed, a
+    dangling key or partial value is dropped). Raises ValueError when it cannot be repaired.
+    """
+    for value in repairs(fragment, partial_strings):
+        return value
+    raise ValueError("Truncated JSON could not be repaired")
+
+
+def repairs(fragment, partial_strings=False):
+    """
+    Values the fragment can be repaired to, most complete first: a balanced fragment has one, a truncated one is
+    also cut back to each of its last commas. An unterminated string is kept (closed) before the cuts when
+    partial_strings is set, and only as a last resort otherwise.
+    """
+    out, stack, cuts = [], [], []
+    quote, escape, index = None, False, 0
+    while index < len(fragment):
+        char = fragment[index]
+        index += 1
+        if quote:
+            if escape:
+                escape = False
+                out.append("'" if char == "'" else "\\" + char)
+            elif char == "\\":
+                escape = True
+            elif char == quote:
+                quote = None
+                out.append('"')
+            else:
+                out.append('\\"' if char == '"' else char)
+        elif char in "\"'":
+            quote = char
+            out.append('"')
+        elif char in "{[":
+            stack.append(char)
+            out.append(char)
+        elif char in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            out.append(CLOSERS[stack.pop()] if stack else char)
+            if not stack:
+                break
+        elif char == ",":
+            cuts.append((len(out), list(stack)))
+            out.append(char)
+        elif char.isalpha():
+            word = re.match(r"\w+", fragment[index - 1:]).group(0)
+            out.append(PYTHON_LITERALS.get(word, word))
+            index += len(word) - 1
+        else:
+            out.append(char)
+
+    text = "".join(out)
+    if not stack and not quote:
+        yield json.loads(text, strict=False)
+        return
+
+    candidates = [("".join(out[:position]), open_stack) for position, open_stack in reversed(cuts)]
+    candidates = candidates[:MAX_TRUNCATION_CUTS]
+    if not quote:
+        candidates.insert(0, (text, stack))
+    elif partial_strings:
+        candidates.insert(0, (text + '"', stack))
+    else:
+        candidates.append((text + '"', stack))
+    for body, open_stack in candidates:
+        body = DANGLING_KEY.sub("", body.rstrip().rstrip(","))
+        try:
+            yield json.loads(body + "".join(CLOSERS[opener] for opener in reversed(open_stack)), strict=False)
+        except ValueError:
+            continue
+
+
+def validate(value, schema=None):
+    """
+    value as a dict if it is an object matching the pydantic schema (when given), else None.
+    """
+    if not isinstance(value, dict):
+        return None
+    if schema is None:
+        return value
+    try:
+        return schema.model_validate(value).model_dump()
+    except ValidationError:
+        return None
+
+
+class JSONStreamParser:
+    """
+    Incremental extractor of the first JSON object of an LLM answer, fed token by token (or with the whole text).
+
+    Text before the object (prose, "Final Answer:", code fences) is skipped and the object ends at its balancing
+    brace, so trailing text is ignored; an object that cannot be parsed or does not match the schema is skipped
+    for the next one. When field is set, feed() returns the newly decoded characters of that top-level string
+    field, so its value can be forwarded while the rest of the object is still being generated.
+    """
+
+    def __init__(self, schema=None, field=None):
+        self.schema = schema
+        self.field = field
+        self.text = ""
+        self.result = None
+        self._scanned = 0
+        self._reset()
+
+    def _reset(self):
+        self._start = None
+        self._depth = 0
+        self._quote = None
+        self._escape = False
+        self._unicode = None
+        self._expect_key = False
+        self._key = None
+        self._key_chars = None
+        self._capture = False
+
+    def feed(self, chunk):
+        self.text += chunk
+        if self.result is not None:
+            return ""
+        captured = []
+        while self._scanned < len(self.text) and self.result is None:
+            char = self.text[self._scanned]
+            self._scanned += 1
+            if self._start is None:
+                if char == "{":
+                    self._start = self._scanned - 1
+                    self._depth = 1
+                    self._expect_key = True
+                continue
+            if self._quote:
+                self._scan_string(char, captured)
+            elif char in "\"'":
+                self._quote = char
+                if self._depth == 1 and self._expect_key:
+                    self._key_chars = []
+                self._capture = self._depth == 1 and not self._expect_key and self._key == self.field
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._complete()
+            elif self._depth == 1 and char == ":":
+                self._expect_key = False
+            elif self._depth == 1 and char == ",":
+                self._expect_key, self._key = True, None
+        return "".join(captured)
+
+    def _scan_string(self, char, captured):
+        if self._unicode is not None:
+            self._unicode += char
+            if len(self._unicode) == 4:
+                decoded = chr(int(self._unicode, 16)) if re.fullmatch(r"[0-9a-fA-F]{4}", self._unicode) else ""
+                self._unicode = None
+                self._append(decoded, captured)
+        elif self._escape:
+            self._escape = False
+            if char == "u":
+                self._unicode = ""
+            else:
+                self._append(ESCAPES.get(char, char), captured)
+        elif char == "\\":
+            self._escape = True
+        elif char == self._quote:
+            self._quote = None
+            self._capture = False
+            if self._key_chars is not None:
+                self._key, self._key_chars = "".join(self._key_chars), None
+        else:
+            self._append(char, captured)
+
+    def _append(self, text, captured):
+        if self._key_chars is not None:
+            self._key_chars.append(text)
+        elif self._capture:
+            captured.append(text)
+
+    def _complete(self):
+        fragment = self.text[self._start:self._scanned]
+        try:
+            self.result = validate(repair_json(fragment), self.schema)
+        except ValueError as e:
+            print("Skipping unparsable JSON object:", str(e))
+        if self.result is None:
+            self._reset()
+
+    def partial(self):
+        """
+        Best-effort parse of the object received so far (not validated), or None before it starts.
+        """
+        if self.result is not None:
+            return self.result
+        if self._start is None:
+            return None
+        try:
+            value = repair_json(self.text[self._start:], partial_strings=True)
+        except ValueError:
+            return None
+        return value if isinstance(value, dict) else None
+
+    def close(self):
+        """
+        The extracted object once the stream is over: the first complete one, else the repaired truncated one.
+        """
+        if self.result is None and self._start is not None:
+            for value in repairs(self.text[self._start:]):
+                self.result = validate(value, self.schema)
+                if self.result is not None:
+                    break
+            else:
+                print("Truncated JSON output could not be repaired")
+        return self.result
+
+
+def extract_json(text, schema=None):
+    """
+    First JSON object of an LLM answer that parses (after repairs) and matches the schema, as a dict, or None.
+    """
+    parser = JSONStreamParser(schema)
+    parser.feed(str(text or ""))
+    return parser.close()
+
+
+class JSONRepairConverter(Converter):
+    """
+    crewai converter for output_json / output_pydantic tasks whose answer is not valid JSON as is: the answer is
+    repaired locally first, the conversion LLM call (crewai's default) only happens when nothing usable is found.
+    """
+
+    def to_json(self, current_attempt=1):
+        parsed = extract_json(self.text, self.model)
+        if parsed is not None:
+            return parsed
+        return super().to_json(current_attempt)
+
+    def to_pydantic(self, current_attempt=1):
+        parsed = extract_json(self.text, self.model)
+        if parsed is not None:
+            return self.model.model_validate(parsed)
+        return super().to_pydantic(current_attempt)
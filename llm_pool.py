@@ -0,0 +1,49 @@
+import threading
+
+from litellm.llms.custom_httpx.http_handler import HTTPHandler
+
+from llm_streaming import StreamingLLM
+
+
+class LLMPool:
+    """
+    One LLM client per model and settings, shared by every stage and agent that uses the model.
+
+    Ollama models also share one keep-alive HTTP connection pool per server (at most `connections` connections),
+    instead of the clients litellm caches on its own and drops every few minutes. Other providers keep the clients
+    of their SDK. `factory(model, **settings)` builds the clients (StreamingLLM by default).
+    """
+
+    def __init__(self, timeout=None, connections=32, factory=None, **settings):
+        self.timeout = timeout
+        self.connections = connections
+        self.factory = factory or StreamingLLM
+        self.settings = settings
+        self.llms = {}
+        self.http_clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, model, **settings):
+        settings = {**self.settings, **settings}
+        key = model, tuple(sorted((name, repr(value)) for name, value in settings.items()))
+        with self._lock:
+            llm = self.llms.get(key)
+            if llm is None:
+                if model.startswith("ollama/"):
+                    settings["client"] = self.http_client(settings.get("base_url") or settings.get("api_base"))
+                llm = self.llms[key] = self.factory(model=model, timeout=self.timeout, **settings)
+            return llm
+
+    def http_client(self, base_url=None):
+        # Called under the lock.
+        client = self.http_clients.get(base_url)
+        if client is None:
+            client = self.http_clients[base_url] = HTTPHandler(timeout=self.timeout, concurrent_limit=self.connections)
+        return client
+
+    def close(self):
+        with self._lock:
+            for client in self.http_clients.values():
+                client.close()
+            self.http_clients.clear()
+            self.llms.clear()
@@ -0,0 +1,84 @@
+import threading
+from contextlib import contextmanager
+
+import litellm
+from crewai import LLM
+
+from deadlines import check_deadline, current_deadline, llm_timeout
+
+# Per-thread token sink: set while a pipeline that wants live tokens is running on this thread.
+_sink = threading.local()
+
+
+@contextmanager
+def stream_tokens_to(callback):
+    """
+    Forward every token generated on the current thread to callback(token) while the block runs.
+    """
+    previous = getattr(_sink, "callback", None)
+    _sink.callback = callback
+    try:
+        yield
+    finally:
+        _sink.callback = previous
+
+
+class StreamingLLM(LLM):
+    """
+    crewai LLM that streams the completion when a token sink is active on the calling thread.
+    The full text is still returned to crewai; tool calls and backends that refuse streaming use the normal call.
+
+    Under a pipeline deadline (deadlines.use_deadline) the completion is always streamed: the request times out
+    when the current stage runs out of time and the stream is dropped as soon as the pipeline is cancelled.
+    """
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None):
+        callback = getattr(_sink, "callback", None)
+        if (callback is None and current_deadline() is None) or tools:
+            return super().call(messages, tools=tools, callbacks=callbacks, available_functions=available_functions)
+        check_deadline()
+
+        if isinstance(messages, str):
+            messages = [{"role": "user", "content": messages}]
+        params = {
+            "model": self.model,
+            "messages": messages,
+            "timeout": llm_timeout(self.timeout),
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "n": self.n,
+            "stop": self.stop,
+            "max_tokens": self.max_tokens or self.max_completion_tokens,
+            "presence_penalty": self.presence_penalty,
+            "frequency_penalty": self.frequency_penalty,
+            "seed": self.seed,
+            "api_base": self.api_base,
+            "base_url": self.base_url,
+            "api_version": self.api_version,
+            "api_key": self.api_key,
+            **self.additional_params,
+            "stream": True,
+        }
+        params = {k: v for k, v in params.items() if v is not None}
+
+        try:
+            response = litellm.completion(**params)
+        except Exception as e:
+            check_deadline()
+            print("Streaming not available, falling back to a blocking call:", str(e))
+            return super().call(messages, tools=tools, callbacks=callbacks, available_functions=available_functions)
+
+        text_response = []
+        try:
+            for chunk in response:
+                check_deadline()
+                token = chunk.choices[0].delta.content if chunk.choices else None
+                if token:
+                    text_response.append(token)
+                    if callback is not None:
+                        callback(token)
+        except Exception:
+            # A read timeout of the stream is reported as the stage deadline it enforces.
+            check_deadline()
+            raise
+        return "".join(text_response)
@@ -0,0 +1,159 @@
+import re
+
+from flow_layout import canonical_product, detect_products
+
+# Sections of the formatted answer, in display order, with the products that belong to each of them
+# (same structure as knowledge/results_formatted_example.txt).
+SECTIONS = [
+    ("Design and Modeling", ("NX", "FEMAP")),
+    ("Simulation and Analysis", ("Simcenter 3D", "Star-CCM+", "NASTRAN", "AMESIM")),
+    ("Design Exploration and Optimization", ("HEEDS",)),
+    ("Physical Testing and Data Analysis", ("Simcenter Testlab",)),
+    ("Data Management and Collaboration", ("Teamcenter Simulation",)),
+]
+OTHER_SECTION = "Additional Expertise"
+
+# Benefit each section brings when the specialists do not state one themselves.
+SECTION_BENEFITS = {
+    "Design and Modeling": "Create and iterate on designs faster.",
+    "Simulation and Analysis": "Reduce prototype testing with simulation-driven decisions.",
+    "Design Exploration and Optimization": "Find better-performing designs automatically.",
+    "Physical Testing and Data Analysis": "Validate simulations against real-world behavior.",
+    "Data Management and Collaboration": "Keep design and simulation data traceable and shared.",
+    OTHER_SECTION: "Bring the right expertise to every step.",
+}
+BENEFIT_WORDS = re.compile(
+    r"\b(reduc\w*|accelerat\w*|improv\w*|minimi[sz]\w*|maximi[sz]\w*|increas\w*|faster|lower\w*|sav\w*|"
+    r"efficien\w*|enhanc\w*)\b",
+    re.IGNORECASE,
+)
+MAX_BENEFITS = 3
+SUMMARY_SENTENCES = 2
+SUMMARY_CHARS = 320
+MAX_DETAILS = 4
+
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+")
+LIST_ITEM = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+(.*)$")
+REACT_PREFIX = re.compile(r"^\s*(?:Thought:.*?\n)?\s*(?:Final Answer:\s*)?", re.DOTALL)
+
+
+def plain_text(text):
+    """
+    Strip the Markdown emphasis, headings and links an LLM answer usually carries.
+    """
+    text = REACT_PREFIX.sub("", str(text or ""), count=1)
+    text = re.sub(r"\[([^\]]+)\]\([^)]*\)", r"\1", text)
+    text = re.sub(r"[*_`#>]+", "", text)
+    return text.strip()
+
+
+def split_output(text):
+    """
+    Prose sentences and list items of a specialist answer.
+    """
+    prose, items = [], []
+    for line in plain_text(text).splitlines():
+        match = LIST_ITEM.match(line)
+        if match:
+            items.append(match.group(1).strip())
+        elif line.strip():
+            prose.append(line.strip())
+    sentences = [sentence for sentence in SENTENCE_SPLIT.split(" ".join(prose)) if sentence]
+    return sentences, items
+
+
+def summarize(sentences, items):
+    summary = " ".join(sentences[:SUMMARY_SENTENCES]) or (items[0] if items else "")
+    if len(summary) > SUMMARY_CHARS:
+        summary = summary[:SUMMARY_CHARS - 1].rsplit(" ", 1)[0] + "…"
+    return summary
+
+
+def section_of(product):
+    for section, products in SECTIONS:
+        if product in products:
+            return section
+    return OTHER_SECTION
+
+
+def contribution_product(contribution):
+    """
+    Siemens product of a specialist: its agent title when it names one, else the first product it mentions.
+    """
+    product = canonical_product(contribution.get("title", ""))
+    if product:
+        return product
+    mentioned = detect_products(f"{contribution.get('title', '')} {contribution.get('role', '')}")
+    return mentioned[0] if mentioned else None
+
+
+def collect_benefits(sentences_by_contribution, sections):
+    benefits = []
+    for sentences in sentences_by_contribution:
+        for sentence in sentences:
+            if BENEFIT_WORDS.search(sentence) and len(sentence) <= 160 and sentence not in benefits:
+                benefits.append(sentence if sentence.endswith((".", "!", "?")) else sentence + ".")
+                break
+    for section in sections:
+        if len(benefits) >= MAX_BENEFITS:
+            break
+        if SECTION_BENEFITS[section] not in benefits:
+            benefits.append(SECTION_BENEFITS[section])
+    return benefits[:MAX_BENEFITS]
+
+
+def format_answer(query, contributions):
+    """
+    Chat-style Markdown answer assembled from the specialist outputs without an LLM call.
+
+    contributions is a list of {"title", "role", "output"} (one per specialist, in routing order). Each one becomes
+    a product bullet with the first sentences of its answer and up to MAX_DETAILS of its list items, grouped in
+    SECTIONS; a benefits summary and a closing sentence follow.
+    """
+    grouped, sentences_by_contribution = {}, []
+    for contribution in contributions:
+        sentences, items = split_output(contribution.get("output"))
+        summary = summarize(sentences, items)
+        if not summary:
+            continue
+        sentences_by_contribution.append(sentences)
+        product = contribution_product(contribution)
+        label = contribution.get("title") or product or contribution.get("role", "Specialist")
+        lines = [f"- **{label}**: {summary}"]
+        lines += [f"  - {item}" for item in items[:MAX_DETAILS] if item not in summary]
+        grouped.setdefault(section_of(product), []).append("\n".join(lines))
+
+    if not grouped:
+        return ""
+    sections = [section for section, _ in SECTIONS if section in grouped]
+    if OTHER_SECTION in grouped:
+        sections.append(OTHER_SECTION)
+    benefits = collect_benefits(sentences_by_contribution, sections)
+
+    request = re.sub(r"\s+", " ", str(query)).strip().rstrip(" .!?")
+    parts = [
+        "---",
+        f"**{request[:1].upper()}{request[1:]}: Siemens Digital Industries Software**",
+        "To address this request, consider the following integrated tools and workflows:",
+    ]
+    parts += [f"**{section}**\n" + "\n".join(grouped[section]) for section in sections]
+    parts.append("**Benefits of Integrating These Tools**\n" + "\n".join(f"- {benefit}" for benefit in benefits))
+    parts.append(
+        "By integrating these tools from Siemens Digital Industries Software, you can connect every step of the "
+        "workflow above, from design to validation."
+    )
+    parts.append("---")
+    return "\n\n".join(parts)
+
+
+def contribution_products(contributions):
+    """
+    Siemens products of the specialists, followed by the other products their answers mention.
+    """
+    products = []
+    for product in [contribution_product(contribution) for contribution in contributions] + detect_products(
+        " ".join(str(contribution.get("output", "")) for contribution in contributions)
+    ):
+        if product and product not in products:
+            products.append(product)
+    return products
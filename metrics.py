@@ -0,0 +1,141 @@
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Histogram
+
+# Prometheus metrics of the chat pipeline, served by the Flask app at /metrics.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+STAGE_SECONDS = Histogram(
+    "pipeline_stage_seconds", "Duration of a chat pipeline stage.", ["stage"], buckets=LATENCY_BUCKETS
+)
+STAGE_TOKENS = Histogram(
+    "pipeline_stage_tokens", "Tokens sent to (prompt) or received from (completion) the LLM by a pipeline stage.",
+    ["stage", "kind"], buckets=TOKEN_BUCKETS,
+)
+REPOSITORY_SECONDS = Histogram(
+    "repository_call_seconds", "Duration of a Mongo repository call.", ["operation"], buckets=LATENCY_BUCKETS
+)
+CACHE_LOOKUPS = Counter("cache_lookups_total", "Cache lookups by cache and outcome.", ["cache", "result"])
+LLM_CALL_SECONDS = Histogram(
+    "llm_call_seconds", "Duration of an LLM call by pipeline stage and model.", ["stage", "model"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_CALL_ERRORS = Counter("llm_call_errors_total", "Failed LLM calls by pipeline stage and model.", ["stage", "model"])
+MODEL_FALLBACKS = Counter(
+    "llm_model_fallbacks_total", "Times a stage stopped using a model that was too slow or failing.", ["stage", "model"]
+)
+
+# Trace of the request running on the current thread, if one is being collected.
+_active = threading.local()
+
+
+class Trace:
+    """
+    Spans recorded while one request runs; several threads (e.g. parallel specialists) may add to it.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add(self, name, kind, start, seconds, **attributes):
+        with self._lock:
+            self.spans.append({
+                "name": name,
+                "kind": kind,
+                "start_ms": round((start - self.started) * 1000, 1),
+                "duration_ms": round(seconds * 1000, 1),
+                **attributes,
+            })
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["start_ms"])
+        return {"total_ms": round((time.perf_counter() - self.started) * 1000, 1), "spans": spans}
+
+
+def current_trace():
+    return getattr(_active, "trace", None)
+
+
+@contextmanager
+def use_trace(trace):
+    """
+    Record the spans of the current thread into trace (None stops recording) while the block runs.
+    """
+    previous = current_trace()
+    _active.trace = trace
+    try:
+        yield trace
+    finally:
+        _active.trace = previous
+
+
+def record_span(name, seconds, kind="stage", start=None, **attributes):
+    """
+    Record an already measured span: observe its histogram and add it to the active trace.
+    """
+    if kind == "repository":
+        REPOSITORY_SECONDS.labels(name).observe(seconds)
+    else:
+        STAGE_SECONDS.labels(name).observe(seconds)
+    trace = current_trace()
+    if trace is not None:
+        trace.add(name, kind, start if start is not None else time.perf_counter() - seconds, seconds, **attributes)
+
+
+@contextmanager
+def span(name, kind="stage", **attributes):
+    """
+    Time the block as a span; the yielded dict can receive extra attributes for the trace.
+    """
+    start = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        record_span(name, time.perf_counter() - start, kind, start, **attributes)
+
+
+def timed(operation):
+    """
+    Decorator recording every call of a repository function as a span of the given operation.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(operation, kind="repository"):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_tokens(stage, tokens, kind="prompt"):
+    STAGE_TOKENS.labels(stage, kind).observe(tokens)
+    trace = current_trace()
+    if trace is not None:
+        trace.add(f"{stage} tokens", "tokens", time.perf_counter(), 0, tokens=tokens, token_kind=kind)
+
+
+def record_cache_lookup(cache, hit):
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+    trace = current_trace()
+    if trace is not None:
+        trace.add(f"{cache} lookup", "cache", time.perf_counter(), 0, hit=hit)
+
+
+def record_llm_call(stage, model, seconds, ok=True):
+    LLM_CALL_SECONDS.labels(stage, model).observe(seconds)
+    if not ok:
+        LLM_CALL_ERRORS.labels(stage, model).inc()
+    trace = current_trace()
+    if trace is not None:
+        trace.add(f"{stage} llm", "llm", time.perf_counter() - seconds, seconds, model=model, ok=ok)
+
+
+def record_model_fallback(stage, model):
+    MODEL_FALLBACKS.labels(stage, model).inc()
@@ -0,0 +1,149 @@
+import math
+import threading
+import time
+from collections import deque
+
+from crewai import LLM
+
+from deadlines import DeadlineExceeded, PipelineCancelled
+from metrics import record_llm_call, record_model_fallback
+
+
+def parse_stage_setting(text, convert=str):
+    """
+    Parse a "stage=value;stage=value" setting (e.g. STAGE_MODELS) into a dict, converting the values.
+    """
+    setting = {}
+    for entry in (text or "").split(";"):
+        if "=" in entry:
+            stage, value = entry.split("=", 1)
+            setting[stage.strip()] = convert(value.strip())
+    return setting
+
+
+def parse_model_chain(text):
+    return [model.strip() for model in text.split(",") if model.strip()]
+
+
+class ModelHealth:
+    """
+    Latency and outcome of the last calls of one model in one stage.
+    """
+
+    def __init__(self, window):
+        self.samples = deque(maxlen=window)
+        self.tripped_until = 0.0
+
+    def p95(self):
+        latencies = sorted(seconds for seconds, _ in self.samples)
+        return latencies[max(0, math.ceil(0.95 * len(latencies)) - 1)] if latencies else 0.0
+
+    def error_rate(self):
+        return sum(1 for _, ok in self.samples if not ok) / len(self.samples) if self.samples else 0.0
+
+
+class ModelTiers:
+    """
+    Chain of models of every pipeline stage, preferred model first and faster fallbacks after it.
+
+    Each call is measured per stage and model. When the p95 latency of a model's last `window` calls goes over the
+    stage's threshold, or their error rate over `max_error_rate` (once there are `min_calls` of them), the model is
+    skipped for `cooldown` seconds and its stage falls back to the next model of the chain; afterwards it gets
+    traffic again with a fresh window. The last model of a chain is never skipped.
+    """
+
+    def __init__(self, chains, p95_seconds, max_error_rate=0.2, window=50, min_calls=5, cooldown=300):
+        self.chains = chains
+        self.p95_seconds = p95_seconds
+        self.max_error_rate = max_error_rate
+        self.window = window
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.health = {}
+        self._lock = threading.Lock()
+
+    def _health(self, stage, model):
+        # Called under the lock.
+        health = self.health.get((stage, model))
+        if health is None:
+            health = self.health[stage, model] = ModelHealth(self.window)
+        return health
+
+    def select(self, stage):
+        chain = self.chains[stage]
+        now = time.monotonic()
+        with self._lock:
+            for model in chain[:-1]:
+                if self._health(stage, model).tripped_until <= now:
+                    return model
+        return chain[-1]
+
+    def record(self, stage, model, seconds, ok=True):
+        record_llm_call(stage, model, seconds, ok)
+        with self._lock:
+            health = self._health(stage, model)
+            health.samples.append((seconds, ok))
+            if len(health.samples) < self.min_calls or model == self.chains[stage][-1]:
+                return
+            p95, error_rate = health.p95(), health.error_rate()
+            threshold = self.p95_seconds.get(stage)
+            if (threshold is None or p95 <= threshold) and error_rate <= self.max_error_rate:
+                return
+            health.tripped_until = time.monotonic() + self.cooldown
+            health.samples.clear()
+        print(f"Model {model} is too slow or failing for {stage} (p95 {p95:.1f}s, {error_rate:.0%} errors), "
+              f"falling back for {self.cooldown}s")
+        record_model_fallback(stage, model)
+
+    def status(self):
+        """
+        Current model and rolling statistics of every stage.
+        """
+        now = time.monotonic()
+        with self._lock:
+            stages = {}
+            for stage, chain in self.chains.items():
+                models = []
+                for model in chain:
+                    health = self._health(stage, model)
+                    models.append({
+                        "model": model,
+                        "calls": len(health.samples),
+                        "p95_seconds": round(health.p95(), 3),
+                        "error_rate": round(health.error_rate(), 3),
+                        "skipped_for_seconds": round(max(0.0, health.tripped_until - now), 1),
+                    })
+                stages[stage] = models
+        return {stage: {"model": self.select(stage), "models": models} for stage, models in stages.items()}
+
+
+class TieredLLM(LLM):
+    """
+    crewai LLM of one pipeline stage: every call goes to the model ModelTiers currently selects for the stage,
+    through the shared client of that model in the LLMPool, and its latency and outcome are recorded.
+    """
+
+    def __init__(self, stage, tiers, pool, **kwargs):
+        super().__init__(model=tiers.chains[stage][0], **kwargs)
+        self.stage = stage
+        self.tiers = tiers
+        self.pool = pool
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None):
+        model = self.tiers.select(self.stage)
+        # crewai sets the stop words on the agent's LLM, the pooled client of the model needs them too.
+        llm = self.pool.get(model, stop=list(self.stop or []), temperature=self.temperature)
+        start = time.perf_counter()
+        try:
+            response = llm.call(messages, tools=tools, callbacks=callbacks, available_functions=available_functions)
+        except PipelineCancelled:
+            raise
+        except DeadlineExceeded:
+            # The call was cut short, its duration is still a lower bound of the model's latency.
+            self.tiers.record(self.stage, model, time.perf_counter() - start)
+            raise
+        except Exception:
+            self.tiers.record(self.stage, model, time.perf_counter() - start, ok=False)
+            raise
+        self.tiers.record(self.stage, model, time.perf_counter() - start)
+        return response
@@ -0,0 +1,75 @@
+import threading
+
+from deadlines import check_deadline, current_deadline, current_stage
+
+# How often a request waiting for another one's batched call checks its own deadline.
+FOLLOW_POLL_SECONDS = 0.1
+
+
+def _follow_timeout():
+    deadline = current_deadline()
+    remaining = deadline.remaining(current_stage()) if deadline is not None else None
+    return FOLLOW_POLL_SECONDS if remaining is None else min(FOLLOW_POLL_SECONDS, remaining)
+
+
+class _Batch:
+    def __init__(self):
+        self.requests = []
+        self.results = None
+        self.error = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class RoutingBatcher:
+    """
+    Micro-batcher for routing calls: requests with the same key (the same candidate catalog) that arrive within
+    `window` seconds of the first one, at most `max_batch` of them, are answered by a single route_batch(requests)
+    call, which must return one result per request, in order.
+
+    The first request of a batch waits for the window to close and makes the call on its own thread; the others
+    wait for its results, so a request is delayed by at most `window` plus the batched call. The call runs under
+    the first request's deadline: the others stop waiting with DeadlineExceeded or PipelineCancelled when their own
+    deadline (current stage) runs out or is cancelled. A window of 0 disables batching: every request is routed on
+    its own.
+    """
+
+    def __init__(self, route_batch, window=0.005, max_batch=8):
+        self.route_batch = route_batch
+        self.window = window
+        self.max_batch = max_batch
+        self.open = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key, request):
+        if self.window <= 0 or self.max_batch <= 1:
+            return self.route_batch([request])[0]
+
+        with self._lock:
+            batch = self.open.get(key)
+            leader = batch is None
+            if leader:
+                batch = self.open[key] = _Batch()
+            index = len(batch.requests)
+            batch.requests.append(request)
+            if len(batch.requests) >= self.max_batch:
+                del self.open[key]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self.open.get(key) is batch:
+                    del self.open[key]
+            try:
+                batch.results = self.route_batch(batch.requests)
+            except Exception as e:
+                batch.error = e
+            batch.done.set()
+        else:
+            while not batch.done.wait(_follow_timeout()):
+                check_deadline()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[index]
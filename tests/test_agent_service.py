@@ -0,0 +1,22 @@
+# tests/test_agent_service.py
+import unittest
+
+from app import create_app
+
+
+class CreateAgentsBodyTest(unittest.TestCase):
+    """POST /agent/bulk rejects JSON bodies that are not a list of agents before touching Mongo."""
+
+    def setUp(self):
+        self.client = create_app().test_client()
+
+    def test_scalar_bodies_are_rejected(self):
+        for body in (5, True, 1.5, "agents", {"title": "x"}):
+            with self.subTest(body=body):
+                response = self.client.post('/agent/bulk', json=body)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.get_json(), {'error': 'Expected a list of agents'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+# tests/test_chat_repository.py
+import unittest
+
+import mongomock
+from bson import ObjectId
+
+from app import create_app, mongo
+from app.repositories import chat_repository
+from app.repositories.chat_repository import find_chat_summaries, insert_chat, push_message
+
+
+def message(text, owner='USER'):
+    return {'message': text, 'owner': owner, 'timestamp': '2024-01-01 00:00:00'}
+
+
+class ChatSummaryTest(unittest.TestCase):
+    """The denormalized message_count / last_message fields stay right, also for chats created before them."""
+
+    def setUp(self):
+        self.app = create_app()
+        mongo.cx = mongomock.MongoClient()
+        mongo.db = mongo.cx['test']
+        chat_repository._summaries_ready = False
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def test_push_message_counts_new_chats(self):
+        chat = insert_chat({'title': 'new', 'messages': [message('hi')]})
+        updated = push_message(chat['_id'], message('answer', 'SYSTEM'))
+        self.assertEqual(updated['message_count'], 2)
+        self.assertEqual(updated['messages'], [message('answer', 'SYSTEM')])
+
+    def test_push_message_backfills_legacy_chats(self):
+        # Inserted directly, as before the summary fields existed.
+        legacy = {'title': 'old', 'messages': [message(str(i)) for i in range(10)]}
+        chat_id = mongo.db.chats.insert_one(legacy).inserted_id
+        updated = push_message(str(chat_id), message('eleventh'))
+        self.assertEqual(updated['message_count'], 11)
+        [summary] = find_chat_summaries()
+        self.assertEqual(summary['message_count'], 11)
+        self.assertEqual(summary['last_message'], 'eleventh')
+
+    def test_push_message_to_missing_chat(self):
+        self.assertIsNone(push_message(str(ObjectId()), message('hi')))
+
+
+if __name__ == '__main__':
+    unittest.main()
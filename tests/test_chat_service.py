@@ -0,0 +1,155 @@
+# tests/test_chat_service.py
+import time
+import unittest
+from unittest import mock
+
+import mongomock
+
+from app import create_app, mongo, pipeline_flights, pipeline_jobs
+from app.repositories.chat_repository import find_chat_messages, insert_chat
+from app.services.cache_service import result_cache_key
+from app.services.chat_service import chat_and_publish
+from deadlines import Deadline, PipelineCancelled
+
+MESSAGE = {'message': 'How do I simulate a PLC?', 'use_cache': False}
+AGENTS = [
+    {'_id': 'plc', 'title': 'PLC expert', 'role': 'PLC Specialist'},
+    {'_id': 'hmi', 'title': 'HMI expert', 'role': 'HMI Specialist'},
+]
+GRAPH = {'nodes': [{'id': 'plcsim'}], 'edges': []}
+
+
+class FlightTestCase(unittest.TestCase):
+    """Chats sending the message of a pipeline that is running (the leader's flight)."""
+
+    def setUp(self):
+        self.app = create_app()
+        mongo.cx = mongomock.MongoClient()
+        mongo.db = mongo.cx['test']
+        # One worker and no backlog: a message that needed a worker while the leader runs would get a 503.
+        self.app.config.update(PIPELINE_WORKERS=1, PIPELINE_QUEUE_SIZE=0, PIPELINE_TRACE=False)
+        pipeline_jobs.init_app(self.app)
+        self.client = self.app.test_client()
+        agents = mock.patch('app.services.chat_service.get_agents', return_value=(AGENTS, 200))
+        agents.start()
+        self.addCleanup(agents.stop)
+        # A leader that routed to both specialists, got one answer and is still running.
+        self.key = result_cache_key(MESSAGE, AGENTS)
+        self.flight, leader = pipeline_flights.join(self.key, lambda event, payload: None)
+        self.assertTrue(leader)
+        self.leader_slot = pipeline_jobs.reserve('leader')
+        self.flight.publish('routing', {'agent_ids': ['plc', 'hmi']})
+        self.flight.publish('task_done', {'agent': 'PLC Specialist', 'output': 'Use PLCSIM Advanced.'})
+        self.addCleanup(self.finish_leader, error=RuntimeError('test over'))
+
+    def finish_leader(self, result=None, error=None):
+        if not self.flight.finished(0):
+            pipeline_flights.finish(self.key, self.flight, result, error)
+
+    def new_chat(self):
+        return insert_chat({'title': 'coalesced', 'messages': []})['_id']
+
+    def send(self, chat_id, **options):
+        response = self.client.post(f'/chat/{chat_id}/message', json={**MESSAGE, **options})
+        self.assertEqual(response.status_code, 200, response.get_json())
+        return response.get_json()['job_id']
+
+    def job(self, chat_id, job_id):
+        return self.client.get(f'/chat/{chat_id}/jobs/{job_id}').get_json()
+
+    def answers(self, chat_id):
+        return [message for message in find_chat_messages(chat_id)['messages'] if message['owner'] == 'SYSTEM']
+
+    def wait_for(self, condition, timeout=3):
+        end = time.monotonic() + timeout
+        while not condition() and time.monotonic() < end:
+            time.sleep(0.02)
+        self.assertTrue(condition())
+
+
+class CoalescedMessageTest(FlightTestCase):
+    """Messages identical to a running pipeline are answered from it without taking a worker."""
+
+    def test_followers_take_no_worker(self):
+        chats = [self.new_chat() for _ in range(3)]
+        jobs = [self.send(chat_id) for chat_id in chats]
+        for chat_id, job_id in zip(chats, jobs):
+            self.assertEqual(self.job(chat_id, job_id)['status'], 'running')
+        self.finish_leader(({'result': 'Use PLCSIM Advanced.'}, GRAPH))
+        for chat_id, job_id in zip(chats, jobs):
+            self.assertEqual(self.job(chat_id, job_id)['status'], 'done')
+            [answer] = self.answers(chat_id)
+            self.assertEqual((answer['message'], answer['graph']), ({'result': 'Use PLCSIM Advanced.'}, GRAPH))
+            self.assertEqual(answer['job_id'], job_id)
+
+    def test_follower_answers_partially_when_its_deadline_expires(self):
+        chat_id = self.new_chat()
+        job_id = self.send(chat_id, deadline=0.3)
+        self.wait_for(lambda: self.job(chat_id, job_id)['status'] == 'done')
+        [answer] = self.answers(chat_id)
+        self.assertTrue(answer['message']['partial'])
+        self.assertIn('PLCSIM Advanced', answer['message']['result'])
+        self.assertIn('error', answer['graph'])
+
+    def test_cancelled_follower_stops_listening(self):
+        chat_id = self.new_chat()
+        job_id = self.send(chat_id)
+        self.client.delete(f'/chat/{chat_id}')
+        job = self.job(chat_id, job_id)
+        self.assertEqual((job['status'], job['cancel_reason']), ('cancelled', 'chat deleted'))
+        self.finish_leader(({'result': 'Use PLCSIM Advanced.'}, GRAPH))
+        self.assertIsNone(mongo.db.chats.find_one({'title': 'coalesced'}))
+
+    def test_follower_fails_with_its_leader(self):
+        chat_id = self.new_chat()
+        job_id = self.send(chat_id)
+        self.finish_leader(error=RuntimeError('Connection refused'))
+        job = self.job(chat_id, job_id)
+        self.assertEqual((job['status'], job['error']), ('failed', 'Connection refused'))
+        self.assertEqual([answer['message'] for answer in self.answers(chat_id)], [{'error': 'Connection refused'}])
+
+    def test_follower_runs_the_pipeline_when_its_leader_is_cancelled(self):
+        chat_id = self.new_chat()
+        job_id = self.send(chat_id)
+        # The leader's worker is free again, the follower takes it.
+        pipeline_jobs.release(self.leader_slot)
+        with mock.patch('app.services.chat_service.run_orchestrator', return_value={'result': 'Run it again.'}), \
+                mock.patch('app.services.chat_service.run_flow_agent', return_value=GRAPH):
+            self.finish_leader(error=PipelineCancelled('superseded by a newer message'))
+            self.wait_for(lambda: self.job(chat_id, job_id)['status'] == 'done')
+        [answer] = self.answers(chat_id)
+        self.assertEqual(answer['message'], {'result': 'Run it again.'})
+
+
+class FollowFlightDeadlineTest(FlightTestCase):
+    """A message that joins the flight from its own pipeline (e.g. the worker processes) keeps its deadline too."""
+
+    def test_follower_answers_partially_when_its_deadline_expires(self):
+        chat_id = self.new_chat()
+        start = time.monotonic()
+        chat_and_publish(chat_id, MESSAGE, AGENTS, deadline=Deadline(0.3))
+        self.assertLess(time.monotonic() - start, 2)
+        [answer] = self.answers(chat_id)
+        self.assertTrue(answer['message']['partial'])
+        self.assertIn('PLCSIM Advanced', answer['message']['result'])
+
+
+class PipelineTraceTest(unittest.TestCase):
+    """The trace attached to an answer covers the whole pipeline."""
+
+    def setUp(self):
+        self.app = create_app()
+        mongo.cx = mongomock.MongoClient()
+        mongo.db = mongo.cx['test']
+
+    def test_pipeline_span_is_in_the_trace(self):
+        chat_id = insert_chat({'title': 'traced', 'messages': []})['_id']
+        with mock.patch('app.services.chat_service.run_orchestrator', return_value={'result': 'Use PLCSIM.'}), \
+                mock.patch('app.services.chat_service.run_flow_agent', return_value=GRAPH):
+            chat_and_publish(chat_id, MESSAGE, AGENTS, trace=True)
+        [answer] = find_chat_messages(chat_id)['messages']
+        self.assertIn('pipeline', [span['name'] for span in answer['trace']['spans']])
+
+
+if __name__ == '__main__':
+    unittest.main()
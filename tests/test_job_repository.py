@@ -0,0 +1,117 @@
+# tests/test_job_repository.py
+import unittest
+import uuid
+from datetime import datetime, timedelta
+
+import mongomock
+
+from app import create_app, mongo
+from app.repositories.job_repository import (
+    insert_job,
+    find_job,
+    claim_job,
+    extend_job_lease,
+    finish_job,
+    finish_cancelled_job,
+    retry_job,
+    dead_letter_expired_jobs,
+    cancel_jobs,
+)
+
+LEASE_SECONDS = 30
+MAX_ATTEMPTS = 3
+HISTORY_SECONDS = 60
+
+
+class JobStateTest(unittest.TestCase):
+    """Claims, leases, retries, dead-lettering and cancellation of the jobs of the "mongo" backend."""
+
+    def setUp(self):
+        self.app = create_app()
+        mongo.cx = mongomock.MongoClient()
+        mongo.db = mongo.cx['test']
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def queue_job(self, chat_id='chat'):
+        now = datetime.utcnow()
+        return insert_job({
+            '_id': uuid.uuid4().hex,
+            'chat_id': chat_id,
+            'message': {'message': 'hi'},
+            'status': 'queued',
+            'attempts': 0,
+            'created_at': now,
+            'available_at': now,
+        })
+
+    def expire_lease(self, job_id):
+        mongo.db.pipeline_jobs.update_one(
+            {'_id': job_id}, {'$set': {'lease_expires_at': datetime.utcnow() - timedelta(seconds=1)}}
+        )
+
+    def test_claim_takes_a_queued_job_once(self):
+        job = self.queue_job()
+        claimed = claim_job('w1', LEASE_SECONDS, MAX_ATTEMPTS)
+        self.assertEqual(claimed['_id'], job['_id'])
+        self.assertEqual((claimed['status'], claimed['worker'], claimed['attempts']), ('running', 'w1', 1))
+        self.assertIsNone(claim_job('w2', LEASE_SECONDS, MAX_ATTEMPTS))
+
+    def test_expired_lease_is_claimed_again(self):
+        job = self.queue_job()
+        claim_job('w1', LEASE_SECONDS, MAX_ATTEMPTS)
+        self.expire_lease(job['_id'])
+        claimed = claim_job('w2', LEASE_SECONDS, MAX_ATTEMPTS)
+        self.assertEqual((claimed['_id'], claimed['worker'], claimed['attempts']), (job['_id'], 'w2', 2))
+        # The first worker lost the job: it can neither renew its lease nor finish it.
+        self.assertIsNone(extend_job_lease(job['_id'], 'w1', LEASE_SECONDS))
+        finish_job(job['_id'], 'w1', HISTORY_SECONDS)
+        self.assertEqual(find_job(job['_id'])['status'], 'running')
+
+    def test_retry_waits_for_its_backoff(self):
+        job = self.queue_job()
+        claim_job('w1', LEASE_SECONDS, MAX_ATTEMPTS)
+        retry_job(job['_id'], 'w1', 'LLM down', datetime.utcnow() + timedelta(seconds=60))
+        self.assertEqual(find_job(job['_id'])['status'], 'queued')
+        self.assertIsNone(claim_job('w2', LEASE_SECONDS, MAX_ATTEMPTS))
+
+    def test_attempts_cap_leads_to_dead(self):
+        job = self.queue_job()
+        for attempt in range(MAX_ATTEMPTS):
+            claimed = claim_job(f'w{attempt}', LEASE_SECONDS, MAX_ATTEMPTS)
+            self.assertEqual(claimed['attempts'], attempt + 1)
+            self.expire_lease(job['_id'])
+        self.assertIsNone(claim_job('w', LEASE_SECONDS, MAX_ATTEMPTS))
+        self.assertEqual(dead_letter_expired_jobs(MAX_ATTEMPTS), 1)
+        dead = find_job(job['_id'])
+        self.assertEqual((dead['status'], dead['error']), ('dead', 'Worker lease expired'))
+        self.assertNotIn('expires_at', dead)
+
+    def test_cancel_jobs_flags_running_jobs(self):
+        running = self.queue_job()
+        claim_job('w1', LEASE_SECONDS, MAX_ATTEMPTS)
+        queued = self.queue_job()
+        other_chat = self.queue_job('other')
+        self.assertEqual(cancel_jobs('chat', 'newer message', HISTORY_SECONDS), 2)
+        self.assertEqual(find_job(queued['_id'])['status'], 'cancelled')
+        self.assertEqual(find_job(other_chat['_id'])['status'], 'queued')
+        # The running job keeps running until its worker sees the reason at its next lease renewal.
+        self.assertEqual(find_job(running['_id'])['status'], 'running')
+        self.assertEqual(extend_job_lease(running['_id'], 'w1', LEASE_SECONDS)['cancel_reason'], 'newer message')
+
+    def test_finish_does_not_overwrite_a_cancelled_job(self):
+        job = self.queue_job()
+        claim_job('w1', LEASE_SECONDS, MAX_ATTEMPTS)
+        cancel_jobs('chat', 'chat deleted', HISTORY_SECONDS)
+        finish_cancelled_job(job['_id'], 'w1', 'chat deleted', HISTORY_SECONDS)
+        finish_job(job['_id'], 'w1', HISTORY_SECONDS)
+        cancelled = find_job(job['_id'])
+        self.assertEqual((cancelled['status'], cancelled['cancel_reason']), ('cancelled', 'chat deleted'))
+        self.assertNotIn('lease_expires_at', cancelled)
+
+
+if __name__ == '__main__':
+    unittest.main()
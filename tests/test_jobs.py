@@ -0,0 +1,64 @@
+# tests/test_jobs.py
+import unittest
+from unittest import mock
+
+import mongomock
+
+from app import create_app, mongo
+from app.jobs import JobQueue
+from app.repositories.chat_repository import find_chat_messages, insert_chat
+from app.services.chat_service import chat_and_publish
+from deadlines import Deadline
+
+MESSAGE = {'message': 'How do I simulate a PLC?', 'use_cache': False}
+
+
+class JobQueueStatusTest(unittest.TestCase):
+    """The status of a thread-backend job reflects how its pipeline ended."""
+
+    def setUp(self):
+        self.app = create_app()
+        mongo.cx = mongomock.MongoClient()
+        mongo.db = mongo.cx['test']
+        self.jobs = JobQueue(self.app)
+        self.chat_id = insert_chat({'title': 'jobs', 'messages': []})['_id']
+        flow_agent = mock.patch('app.services.chat_service.run_flow_agent', return_value={'nodes': []})
+        flow_agent.start()
+        self.addCleanup(flow_agent.stop)
+
+    def run_job(self, orchestrator_result, deadline=None):
+        with mock.patch('app.services.chat_service.run_orchestrator', return_value=orchestrator_result):
+            job = self.jobs.reserve(self.chat_id)
+            self.jobs.start(job, chat_and_publish, self.chat_id, MESSAGE, [], False, deadline, job['_id'],
+                            deadline=deadline)
+            self.jobs.shutdown()
+        return self.jobs.get(job['_id'])
+
+    def answers(self):
+        return [message['message'] for message in find_chat_messages(self.chat_id)['messages']]
+
+    def test_answered_pipeline_is_done(self):
+        job = self.run_job({'answer': 'Use PLCSIM.'})
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(self.answers(), [{'answer': 'Use PLCSIM.'}])
+
+    def test_error_result_fails_the_job(self):
+        job = self.run_job({'error': 'Connection refused'})
+        self.assertEqual((job['status'], job['error']), ('failed', 'Connection refused'))
+        # The thread backend does not retry, the error is the answer.
+        self.assertEqual(self.answers(), [{'error': 'Connection refused'}])
+
+    def test_partial_result_is_an_answer(self):
+        job = self.run_job({'error': 'The agents did not answer in time.', 'partial': True})
+        self.assertEqual(job['status'], 'done')
+
+    def test_cancelled_pipeline_is_cancelled(self):
+        deadline = Deadline()
+        deadline.cancel('superseded by a newer message')
+        job = self.run_job({'answer': 'Use PLCSIM.'}, deadline)
+        self.assertEqual((job['status'], job['cancel_reason']), ('cancelled', 'superseded by a newer message'))
+        self.assertEqual(self.answers(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+# tests/test_routing_batcher.py
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from deadlines import Deadline, DeadlineExceeded, PipelineCancelled, deadline_stage, use_deadline
+from routing_batcher import RoutingBatcher
+
+
+class RoutingBatcherTest(unittest.TestCase):
+    """Windowing and demultiplexing of batched routing calls, and the deadlines of the requests waiting on them."""
+
+    def setUp(self):
+        self.calls = []
+
+    def route_batch(self, requests):
+        self.calls.append(list(requests))
+        return [f"route {request}" for request in requests]
+
+    def submit_all(self, batcher, requests, key='catalog'):
+        with ThreadPoolExecutor(len(requests)) as pool:
+            return list(pool.map(lambda request: batcher.submit(key, request), requests))
+
+    def test_requests_within_the_window_share_one_call(self):
+        batcher = RoutingBatcher(self.route_batch, window=0.2, max_batch=8)
+        results = self.submit_all(batcher, ['a', 'b', 'c'])
+        self.assertEqual(results, ['route a', 'route b', 'route c'])
+        self.assertEqual(len(self.calls), 1)
+        self.assertCountEqual(self.calls[0], ['a', 'b', 'c'])
+
+    def test_full_batch_is_sent_before_the_window_closes(self):
+        batcher = RoutingBatcher(self.route_batch, window=5, max_batch=2)
+        start = time.monotonic()
+        self.assertEqual(self.submit_all(batcher, ['a', 'b']), ['route a', 'route b'])
+        self.assertLess(time.monotonic() - start, 2)
+
+    def test_keys_are_batched_apart(self):
+        batcher = RoutingBatcher(self.route_batch, window=0.1, max_batch=8)
+        with ThreadPoolExecutor(2) as pool:
+            first = pool.submit(batcher.submit, 'catalog 1', 'a')
+            second = pool.submit(batcher.submit, 'catalog 2', 'b')
+        self.assertEqual((first.result(), second.result()), ('route a', 'route b'))
+        self.assertEqual(sorted(self.calls), [['a'], ['b']])
+
+    def test_zero_window_routes_every_request_alone(self):
+        batcher = RoutingBatcher(self.route_batch, window=0, max_batch=8)
+        self.assertEqual(self.submit_all(batcher, ['a', 'b']), ['route a', 'route b'])
+        self.assertEqual(sorted(self.calls), [['a'], ['b']])
+
+    def test_error_reaches_every_request_of_the_batch(self):
+        def fail(requests):
+            raise RuntimeError("LLM down")
+
+        batcher = RoutingBatcher(fail, window=5, max_batch=2)
+        with ThreadPoolExecutor(2) as pool:
+            futures = [pool.submit(batcher.submit, 'catalog', request) for request in ('a', 'b')]
+        for future in futures:
+            self.assertRaises(RuntimeError, future.result)
+
+    def run_follower(self, deadline):
+        """Submit a request behind a leader whose call hangs; returns the follower's error and wait."""
+        release = threading.Event()
+
+        def hang(requests):
+            release.wait(5)
+            return [None] * len(requests)
+
+        batcher = RoutingBatcher(hang, window=5, max_batch=2)
+
+        def follow():
+            with use_deadline(deadline), deadline_stage("routing"):
+                return batcher.submit('catalog', 'follower')
+
+        with ThreadPoolExecutor(2) as pool:
+            pool.submit(batcher.submit, 'catalog', 'leader')
+            time.sleep(0.05)
+            start = time.monotonic()
+            follower = pool.submit(follow)
+            try:
+                error = follower.exception(timeout=3)
+            finally:
+                release.set()
+        return error, time.monotonic() - start
+
+    def test_follower_stops_at_its_routing_deadline(self):
+        error, waited = self.run_follower(Deadline(1.0))
+        self.assertIsInstance(error, DeadlineExceeded)
+        # The routing share of a 1s budget.
+        self.assertLess(waited, 1.0)
+
+    def test_follower_stops_when_cancelled(self):
+        deadline = Deadline()
+        threading.Timer(0.1, deadline.cancel, ('chat deleted',)).start()
+        error, waited = self.run_follower(deadline)
+        self.assertIsInstance(error, PipelineCancelled)
+        self.assertLess(waited, 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import os
 import json
 import re
+import hashlib
 from datetime import datetime
 from pathlib import Path
 
@@ -10,30 +11,64 @@ from crewai.knowledge.source.string_knowledge_source import StringKnowledgeSourc
 from crewai.knowledge.source.text_file_knowledge_source import TextFileKnowledgeSource
 from pydantic import BaseModel, Field
 
+from llm_json import extract_json, strip_code_fences
+
 def clean_json_output(raw_output: str) -> str:
     """
-    Ensures Mistral's output is a clean, valid JSON string.
+    JSON text of the first JSON object in an LLM answer, found and repaired by llm_json.extract_json;
+    the answer without its code fences when it holds no usable object.
     """
-    cleaned = raw_output.strip()
-
-    # Remove markdown code blocks if present
-    cleaned = re.sub(r"```json|```", "", cleaned, flags=re.MULTILINE).strip()
-
-    # Check if output is valid JSON
-    try:
-        json.loads(cleaned)  # Validate JSON
-        return cleaned
-    except json.JSONDecodeError as e:
-        print(f"❌ JSON Parsing Error: {e}")
-        return '{"error": "Invalid JSON format"}'
+    parsed = extract_json(raw_output)
+    if parsed is None:
+        return strip_code_fences(raw_output)
+    return json.dumps(parsed)
 
 
 def parse_flow_json(raw_result) -> dict:
     """
     Parses Mistral's output into JSON. If invalid, wraps it in a dictionary.
     """
-    cleaned = clean_json_output(str(raw_result))
-    try:
-        return json.loads(cleaned)
-    except json.JSONDecodeError:
-        return {"error": "Failed to parse JSON", "raw_output": cleaned}
\ No newline at end of file
+    parsed = extract_json(str(raw_result))
+    if parsed is None:
+        return {"error": "Failed to parse JSON", "raw_output": strip_code_fences(raw_result)}
+    return parsed
+
+
+def catalog_fingerprint(agents_data) -> str:
+    """
+    Stable hash of the agent catalog, used to tell when anything derived from it is stale.
+    """
+    fields = ('_id', 'title', 'role', 'goals', 'backstory', 'docs')
+    canonical = sorted(
+        json.dumps([str(agent.get(field, '')) for field in fields]) for agent in agents_data
+    )
+    return hashlib.sha256("\n".join(canonical).encode("utf-8")).hexdigest()
+
+
+def normalize_message(message) -> str:
+    """
+    Canonical form of a user message for exact-match lookups: case, spacing and trailing punctuation are ignored.
+    """
+    return re.sub(r"\s+", " ", str(message)).strip().lower().rstrip(" .!?")
+
+
+_token_encoding = None
+
+
+def count_tokens(text) -> int:
+    """
+    Token count of a prompt fragment: tiktoken's cl100k_base when its encoding is available,
+    otherwise the usual estimate of four characters per token.
+    """
+    global _token_encoding
+    text = str(text or "")
+    if _token_encoding is None:
+        try:
+            import tiktoken
+            _token_encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print("tiktoken encoding not available, estimating token counts:", str(e))
+            _token_encoding = False
+    if _token_encoding:
+        return len(_token_encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
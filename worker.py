@@ -0,0 +1,79 @@
+# worker.py
+#
+# Pipeline worker for JOB_BACKEND=mongo: the web nodes only queue chat messages in the pipeline_jobs collection,
+# any number of these processes claim and run them (routing, crews and flow graph through chat_and_publish).
+# Their Socket.IO events reach the clients through the message queue shared with the web nodes:
+#
+#     JOB_BACKEND=mongo SOCKETIO_MESSAGE_QUEUE=mongodb://localhost:27017/socketio python worker.py --concurrency 4
+#
+# SIGTERM / Ctrl+C stops claiming new jobs and lets the running ones finish. A job whose chat is deleted or gets a
+# newer message is cancelled at the next renewal of its lease.
+
+import argparse
+import os
+import signal
+import socket
+import threading
+
+from flask import current_app
+
+from app import create_app, agent_catalog
+from app.services.agent_service import get_agents
+from app.services.chat_service import chat_and_publish
+from app.services.job_service import run_next_job
+from utils import catalog_fingerprint
+
+
+def run_job(job, deadline):
+    agents = get_agents()[0]
+    if job.get('catalog') and catalog_fingerprint(agents) != job['catalog']:
+        # The agents were edited through another node since this process cached them.
+        agent_catalog.invalidate()
+        agents = get_agents()[0]
+    # The error of a failed pipeline only becomes the chat's answer when the job will not be retried.
+    final = job['attempts'] >= current_app.config['JOB_MAX_ATTEMPTS']
+    chat_and_publish(job['chat_id'], job['message'], agents, job.get('trace', False), deadline, job['_id'], final)
+
+
+def work(app, worker_id, stop):
+    with app.app_context():
+        while not stop.is_set():
+            try:
+                ran = run_next_job(worker_id, run_job)
+            except Exception as e:
+                print("Job queue unavailable:", e)
+                ran = False
+            if not ran:
+                stop.wait(app.config['JOB_POLL_INTERVAL'])
+
+
+def main():
+    app = create_app()
+    parser = argparse.ArgumentParser(description="Run queued chat pipelines (JOB_BACKEND=mongo).")
+    parser.add_argument('--concurrency', type=int, default=app.config['PIPELINE_WORKERS'],
+                        help="pipelines run at the same time by this process")
+    args = parser.parse_args()
+    if app.config['JOB_BACKEND'] != 'mongo':
+        print("Warning: JOB_BACKEND is not 'mongo', the web nodes will not queue jobs for this worker")
+    if not app.config['SOCKETIO_MESSAGE_QUEUE']:
+        print("Warning: SOCKETIO_MESSAGE_QUEUE is not set, clients will only receive the stored messages")
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    threads = [
+        threading.Thread(target=work, args=(app, f"{prefix}:{index}", stop), name=f"worker-{index}")
+        for index in range(max(1, args.concurrency))
+    ]
+    for thread in threads:
+        thread.start()
+    print(f"Worker {prefix} running {len(threads)} pipelines at a time")
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(timeout=1)
+
+
+if __name__ == '__main__':
+    main()